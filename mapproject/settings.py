@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -81,7 +82,27 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {'timeout': 20},
+    },
+    # Same file, opened query_only; the map API reads through it (see maps.database)
+    'readonly': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'timeout': 20},
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['maps.database.ReadDatabaseRouter']
+MAPS_READ_DATABASE = 'readonly'
+
+# Applied to every new SQLite connection (maps.database.apply_sqlite_pragmas)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',      # readers and the writer no longer block each other
+    'synchronous': 'NORMAL',    # safe with WAL, skips an fsync per commit
+    'cache_size': -65536,       # page cache in KiB (64 MiB)
+    'mmap_size': 268435456,     # 256 MiB memory-mapped reads
+    'temp_store': 'MEMORY',
 }
 
 
@@ -122,6 +143,38 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]
 
+# Cache of map API responses, snapshots and data versions (see maps.snapshots).
+# Pick a backend with the MAP_CACHE_BACKEND environment variable; locmem is
+# per process, file and redis are shared between workers (redis needs the
+# redis package and a server at MAP_CACHE_REDIS_URL).
+MAP_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'maps',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'django',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('MAP_CACHE_REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+MAP_CACHE_BACKEND = os.environ.get('MAP_CACHE_BACKEND', 'locmem')
+CACHES = {
+    'default': {
+        **MAP_CACHE_BACKENDS[MAP_CACHE_BACKEND],
+        'KEY_PREFIX': 'mapproject',
+        'TIMEOUT': 60 * 60 * 24,
+    },
+}
+
+# Disk cache for Mapbox Vector Tiles (/api/hierarchical/tiles/)
+VECTOR_TILE_CACHE_DIR = BASE_DIR / 'cache' / 'tiles'
+
 # CORS settings for embedding
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -137,6 +190,8 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
+    # ?format= selects the payload layout (format=columnar), not a renderer
+    'URL_FORMAT_OVERRIDE': None,
 }
 
 # Default primary key field type
@@ -8,9 +8,24 @@ class MapsConfig(AppConfig):
     def ready(self):
         # Import here to avoid circular import issues
         import os
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from . import signals  # noqa: F401  (connects receivers)
+        from .database import apply_sqlite_pragmas
+        
+        connection_created.connect(apply_sqlite_pragmas)
+        
+        # Schema migrations that rebuild a location table drop its R*Tree triggers
+        post_migrate.connect(self.install_spatial_indexes, sender=self)
+        
         if os.environ.get('VERCEL'):
             self.create_sample_data()
     
+    def install_spatial_indexes(self, using, **kwargs):
+        from django.db import connections
+        from .spatial import install_spatial_indexes
+        install_spatial_indexes(connections[using])
+    
     def create_sample_data(self):
         try:
             from .models import Domain, Category, Location
@@ -0,0 +1,159 @@
+"""
+In-memory autocomplete index over location names, cities and postal codes
+For each domain, every distinct term (normalized like the search index, see
+maps.search.normalize_text) is stored once with its location count. A
+sorted array holds one key per word start of each term ("optik berlin" and
+"berlin"), so a prefix lookup is two bisects; prefixes matching more than
+MAX_SCANNED_KEYS keys get their best suggestions precomputed instead of
+ranked per request. When the prefix finds too little, spellings one edit away (delete, insert, replace or swap a
+character) are tried as prefixes as well.
+
+Indexes are built lazily per process and keyed by the domain's DataVersion
+(like maps.category_index), so an import rebuilds them on next use.
+"""
+
+import heapq
+from bisect import bisect_left
+from collections import Counter
+
+from .hierarchical_models import DataVersion, DomainMembership
+from .search import normalize_text
+
+SUGGESTION_TYPES = ('city', 'postal_code', 'name')
+
+# Keys ranked per lookup at most; prefixes matching more keys get their
+# best suggestions precomputed when the index is built
+MAX_SCANNED_KEYS = 500
+# Highest possible character, ends the key range of a prefix
+LAST_CHAR = chr(0x10FFFF)
+# Shortest normalized query that gets typo suggestions
+MIN_FUZZY_LENGTH = 3
+MAX_LIMIT = 50
+
+_indexes = {}
+
+
+def edits1(word, alphabet):
+    """Every string one delete, swap, replace or insert away from ``word``"""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [left + right[1:] for left, right in splits if right]
+    swaps = [left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1]
+    replaces = [left + c + right[1:] for left, right in splits if right for c in alphabet]
+    inserts = [left + c + right for left, right in splits for c in alphabet]
+    return set(deletes + swaps + replaces + inserts)
+
+
+class AutocompleteIndex:
+    """Sorted term keys of one domain"""
+
+    def __init__(self, domain_id, version, terms):
+        """``terms``: (type, normalized text) -> (label, location count)"""
+        self.domain_id = domain_id
+        self.version = version
+        # Rank = position in this list: most locations first, then cities
+        # before postal codes before names
+        ordered = sorted(
+            terms.items(), key=lambda item: (-item[1][1], SUGGESTION_TYPES.index(item[0][0]), item[1][0])
+        )
+        self.suggestions = [
+            {'text': label, 'type': kind, 'count': count} for (kind, _), (label, count) in ordered
+        ]
+
+        keys = []
+        for rank, ((_, normalized), _) in enumerate(ordered):
+            words = normalized.split(' ')
+            for start in range(len(words)):
+                keys.append((' '.join(words[start:]), rank))
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.ranks = [rank for _, rank in keys]
+        self.alphabet = sorted({c for key in self.keys for c in key})
+
+        # Best ranks of every prefix with too many keys to scan. A prefix's
+        # keys are a subset of its parent's, so only children of such
+        # prefixes can have too many as well.
+        self.top = {}
+        pending = list({key[:1] for key in self.keys})
+        while pending:
+            prefix = pending.pop()
+            start, end = self.prefix_range(prefix)
+            if end - start <= MAX_SCANNED_KEYS:
+                continue
+            self.top[prefix] = heapq.nsmallest(MAX_LIMIT, set(self.ranks[start:end]))
+            length = len(prefix) + 1
+            pending.extend({key[:length] for key in self.keys[start:end] if len(key) >= length})
+
+    @classmethod
+    def build(cls, domain_id, version):
+        rows = DomainMembership.objects.filter(
+            domain__domain_id=domain_id, location__is_active=True
+        ).values_list('location__name', 'location__city', 'location__postal_code')
+
+        counts = Counter()
+        labels = {}
+        for row in rows.iterator(chunk_size=5000):
+            for kind, label in zip(('name', 'city', 'postal_code'), row):
+                normalized = normalize_text(label)
+                if normalized:
+                    counts[kind, normalized] += 1
+                    labels.setdefault((kind, normalized), label.strip())
+        return cls(domain_id, version, {term: (labels[term], count) for term, count in counts.items()})
+
+    def prefix_range(self, prefix):
+        """Positions [start, end) of the keys starting with ``prefix``"""
+        start = bisect_left(self.keys, prefix)
+        return start, bisect_left(self.keys, prefix + LAST_CHAR, start)
+
+    def prefix_ranks(self, prefix):
+        """
+        Ranks of the terms with a word starting with ``prefix`` (only the
+        MAX_LIMIT best for prefixes with more than MAX_SCANNED_KEYS keys)
+        """
+        best = self.top.get(prefix)
+        if best is not None:
+            return set(best)
+        start, end = self.prefix_range(prefix)
+        return set(self.ranks[start:end])
+
+    def has_prefix(self, prefix):
+        position = bisect_left(self.keys, prefix)
+        return position < len(self.keys) and self.keys[position].startswith(prefix)
+
+    def complete(self, text, limit=10):
+        """
+        Suggestions for what the user typed, best first. Prefix matches come
+        before typo suggestions, which are marked ``fuzzy``.
+        """
+        prefix = normalize_text(text)
+        if not prefix:
+            return []
+
+        ranks = sorted(self.prefix_ranks(prefix))[:limit]
+        suggestions = [{**self.suggestions[rank], 'fuzzy': False} for rank in ranks]
+        if len(suggestions) < limit and len(prefix) >= MIN_FUZZY_LENGTH:
+            fuzzy = set()
+            for variant in edits1(prefix, self.alphabet):
+                # Shorter variants would match half the index
+                if len(variant) >= MIN_FUZZY_LENGTH and self.has_prefix(variant):
+                    fuzzy |= self.prefix_ranks(variant)
+            fuzzy.difference_update(ranks)
+            suggestions.extend(
+                {**self.suggestions[rank], 'fuzzy': True}
+                for rank in sorted(fuzzy)[:limit - len(suggestions)]
+            )
+        return suggestions
+
+
+def get_autocomplete_index(domain_id):
+    """Current AutocompleteIndex for a domain, rebuilt when its data version changes"""
+    version = DataVersion.current(domain_id)
+    index = _indexes.get(domain_id)
+    if index is not None and index.version == version:
+        return index
+
+    index = _indexes[domain_id] = AutocompleteIndex.build(domain_id, version)
+    return index
+
+
+def clear_autocomplete_indexes():
+    _indexes.clear()
@@ -0,0 +1,106 @@
+"""
+In-memory category membership index for multi-category filtering
+For each domain, every category maps to a bitset of HierarchicalLocation
+primary keys (bit n set = location pk n belongs to the category). Python
+ints serve as the bitsets, so AND/OR filters are single big-int operations
+instead of a through-table join plus DISTINCT.
+
+Indexes are built lazily per process and keyed by the domain's DataVersion,
+so any membership change rebuilds them on next use.
+"""
+
+from .hierarchical_models import DataVersion, DomainMembership
+
+MATCH_ANY = 'any'
+MATCH_ALL = 'all'
+MATCH_MODES = (MATCH_ANY, MATCH_ALL)
+
+# Bit offsets set in each byte value, for fast bitset -> pk decoding
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+_indexes = {}
+
+
+def bitset_from(positions):
+    """Bitset with the given positions set, built in one pass over a byte buffer"""
+    if not positions:
+        return 0
+    data = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+def bitset_members(bits):
+    """Sorted list of the positions set in a bitset"""
+    if not bits:
+        return []
+    members = []
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for offset, byte in enumerate(data):
+        if byte:
+            base = offset * 8
+            members.extend(base + bit for bit in _BYTE_BITS[byte])
+    return members
+
+
+class CategoryIndex:
+    """Category id -> location bitset for one domain"""
+
+    def __init__(self, domain_id, version, bitsets):
+        self.domain_id = domain_id
+        self.version = version
+        self.bitsets = bitsets
+        self.all = 0
+        for bits in bitsets.values():
+            self.all |= bits
+
+    @classmethod
+    def build(cls, domain_id, version):
+        memberships = DomainMembership.objects.filter(
+            domain__domain_id=domain_id
+        ).values_list('location_id', 'category_ids')
+
+        # OR-ing one bit per row would copy the whole big int each time
+        positions = {}
+        for location_pk, category_ids in memberships.iterator(chunk_size=5000):
+            for category_id in category_ids:
+                positions.setdefault(category_id, []).append(location_pk)
+        bitsets = {category_id: bitset_from(pks) for category_id, pks in positions.items()}
+        return cls(domain_id, version, bitsets)
+
+    def match(self, category_ids=(), mode=MATCH_ANY):
+        """
+        Bitset of locations in any (or, with MATCH_ALL, every) of the
+        categories. No categories selects every location of the domain;
+        unknown category ids match nothing.
+        """
+        if not category_ids:
+            return self.all
+
+        bitsets = [self.bitsets.get(category_id, 0) for category_id in category_ids]
+        result = bitsets[0]
+        for bits in bitsets[1:]:
+            if mode == MATCH_ALL:
+                result &= bits
+            else:
+                result |= bits
+        return result
+
+    def location_pks(self, category_ids=(), mode=MATCH_ANY):
+        return bitset_members(self.match(category_ids, mode))
+
+
+def get_category_index(domain_id):
+    """Current CategoryIndex for a domain, rebuilt when its data version changes"""
+    version = DataVersion.current(domain_id)
+    index = _indexes.get(domain_id)
+    if index is not None and index.version == version:
+        return index
+
+    index = _indexes[domain_id] = CategoryIndex.build(domain_id, version)
+    return index
+
+
+def clear_category_indexes():
+    _indexes.clear()
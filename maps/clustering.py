@@ -0,0 +1,155 @@
+"""
+Server-side marker clustering for the hierarchical map
+Grid clustering index stored in ClusterCell, so cluster queries never
+touch the location table. Cells are tiles, so the finest level is
+aggregated in SQL by grouping on quadkey prefixes. The cells are rebuilt
+where the data changes: once per domain when a batch_version_bumps block
+exits, and after the commit of any other edit (see maps.signals). Requests
+only read them.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Q, Sum
+
+from .geo import point_tile, quadkey_tile
+from .hierarchical_models import ClusterCell, DataVersion, Domain, DomainMembership, HierarchicalLocation
+from .spatial import quadkey_prefix
+
+# Zoom levels 0..CLUSTER_MAX_ZOOM are answered from the index,
+# above that the clusters endpoint returns individual locations
+CLUSTER_MAX_ZOOM = 12
+
+# Each map tile is split into 2**CELL_ZOOM_OFFSET cells per side (64px cells at 2)
+CELL_ZOOM_OFFSET = 2
+
+
+def cell_for(lat, lng, zoom):
+    """Grid cell (x, y) containing a point at the given zoom level"""
+    return point_tile(lat, lng, zoom + CELL_ZOOM_OFFSET)
+
+
+def rebuild_cluster_index(domain):
+    """
+    Recompute every ClusterCell of a domain.
+
+    The finest level is grouped by quadkey prefix in the database, each
+    lower level is then merged from the level above (a cell at zoom z covers
+    the 2x2 cells at z+1). Returns the number of cells written.
+    """
+    # Read first and uncached: the version the rebuilt data is at, or older
+    version = DataVersion.objects.filter(
+        scope=domain.domain_id
+    ).values_list('version', flat=True).first() or 1
+    through = HierarchicalLocation.categories.through
+    memberships = through.objects.filter(
+        hierarchicalcategory__domain=domain,
+        hierarchicallocation__is_active=True,
+    )
+    cell_zoom = CLUSTER_MAX_ZOOM + CELL_ZOOM_OFFSET
+
+    # cell quadkey -> [count, sum_lat, sum_lng, Counter(category_id -> count)]
+    finest = {}
+    located = HierarchicalLocation.objects.filter(
+        is_active=True,
+        pk__in=DomainMembership.objects.filter(domain=domain).values('location_id'),
+    ).values(cell=quadkey_prefix(cell_zoom)).annotate(
+        count=Count('pk'),
+        # Float sums: a Decimal sum would overflow the column's max_digits
+        sum_lat=Sum('latitude', output_field=FloatField()),
+        sum_lng=Sum('longitude', output_field=FloatField()),
+    ).order_by()
+    for row in located:
+        finest[row['cell']] = [row['count'], row['sum_lat'], row['sum_lng'], Counter()]
+
+    breakdown = memberships.values(
+        cell=quadkey_prefix(cell_zoom, 'hierarchicallocation__quadkey'),
+        category_id=F('hierarchicalcategory__category_id'),
+    ).annotate(count=Count('pk')).order_by()
+    for row in breakdown:
+        # The m2m and DomainMembership may briefly disagree about a location
+        cell = finest.get(row['cell'])
+        if cell is not None:
+            cell[3][row['category_id']] = row['count']
+
+    # Finest level, keyed by grid (x, y)
+    level = {}
+    for quadkey, cell in finest.items():
+        x, y, _ = quadkey_tile(quadkey)
+        level[x, y] = cell
+
+    levels = {CLUSTER_MAX_ZOOM: level}
+    for zoom in range(CLUSTER_MAX_ZOOM - 1, -1, -1):
+        parent_level = {}
+        for (x, y), (count, sum_lat, sum_lng, categories) in levels[zoom + 1].items():
+            key = (x >> 1, y >> 1)
+            cell = parent_level.get(key)
+            if cell is None:
+                cell = parent_level[key] = [0, 0.0, 0.0, Counter()]
+            cell[0] += count
+            cell[1] += sum_lat
+            cell[2] += sum_lng
+            cell[3].update(categories)
+        levels[zoom] = parent_level
+
+    cells = [
+        ClusterCell(
+            domain=domain,
+            zoom=zoom,
+            cell_x=x,
+            cell_y=y,
+            count=count,
+            latitude=round(sum_lat / count, 7),
+            longitude=round(sum_lng / count, 7),
+            category_counts=dict(categories),
+        )
+        for zoom, level in levels.items()
+        for (x, y), (count, sum_lat, sum_lng, categories) in level.items()
+    ]
+
+    with transaction.atomic():
+        ClusterCell.objects.filter(domain=domain).delete()
+        ClusterCell.objects.bulk_create(cells, batch_size=1000)
+        # update(): saving the domain would bump its version again
+        Domain.objects.filter(pk=domain.pk).update(cluster_index_version=version)
+    domain.cluster_index_version = version
+
+    return len(cells)
+
+
+def has_cluster_index(domain):
+    """Whether the domain's cells were ever built (domains created before the index was)"""
+    return domain.cluster_index_version > 0
+
+
+def ensure_cluster_index(domain):
+    """Build the domain's cells if they were never built; True if built"""
+    if has_cluster_index(domain):
+        return False
+    rebuild_cluster_index(domain)
+    return True
+
+
+def rebuild_cluster_indexes(domain_ids):
+    """Rebuild the cells of the given domains (by domain_id); deleted domains are skipped"""
+    for domain in Domain.objects.filter(domain_id__in=set(domain_ids)):
+        rebuild_cluster_index(domain)
+
+
+def cluster_cells(domain, zoom, bbox=None):
+    """ClusterCell queryset for a zoom level, optionally limited to a bbox"""
+    cells = ClusterCell.objects.filter(domain=domain, zoom=zoom)
+
+    if bbox:
+        min_lng, min_lat, max_lng, max_lat = bbox
+        west, south = cell_for(min_lat, min_lng, zoom)
+        east, north = cell_for(max_lat, max_lng, zoom)
+        # Tile rows grow southwards
+        cells = cells.filter(cell_y__gte=north, cell_y__lte=south)
+        if min_lng > max_lng:
+            cells = cells.filter(Q(cell_x__gte=west) | Q(cell_x__lte=east))
+        else:
+            cells = cells.filter(cell_x__gte=west, cell_x__lte=east)
+
+    return cells
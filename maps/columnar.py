@@ -0,0 +1,94 @@
+"""
+Compact columnar JSON for map points
+Instead of one GeoJSON Feature per location the payload holds parallel
+arrays; coordinates are quantized to integers and delta encoded, categories
+are indexes into a shared dictionary:
+
+    {
+        "format": "columnar",
+        "precision": 5,
+        "ids": ["b1", "m1"],
+        "names": ["Optik Berlin", "KFZ München"],
+        "lat": [5252000, -404300],          # first value absolute, then deltas
+        "lng": [1340500, 817700],
+        "categories": [[0], [1]],           # indexes into category_dictionary
+        "category_dictionary": [{"id": "optiker", ...}, {"id": "kfz", ...}],
+        "properties": {"city": ["Berlin", "München"]}   # optional columns
+    }
+
+Decode with lat[i] = sum(lat[:i + 1]) / 10 ** precision.
+"""
+
+# 5 decimal places is ~1.1 m, well below marker resolution
+COORDINATE_PRECISION = 5
+
+
+def delta_decode(values, precision=COORDINATE_PRECISION):
+    """Inverse of the coordinate encoding (used by tests and Python clients)"""
+    scale = 10 ** precision
+    decoded = []
+    current = 0
+    for value in values:
+        current += value
+        decoded.append(current / scale)
+    return decoded
+
+
+class ColumnarBuilder:
+    """Accumulate locations into the columnar payload"""
+
+    def __init__(self, property_fields=(), precision=COORDINATE_PRECISION):
+        self.precision = precision
+        self.scale = 10 ** precision
+        self.ids = []
+        self.names = []
+        self.lat = []
+        self.lng = []
+        self.categories = []
+        self.category_dictionary = []
+        self.category_indexes = {}
+        self.properties = {field: [] for field in property_fields}
+        self._last_lat = 0
+        self._last_lng = 0
+
+    def category_index(self, key, payload):
+        """Index of a category in the dictionary, adding ``payload`` on first use"""
+        index = self.category_indexes.get(key)
+        if index is None:
+            index = self.category_indexes[key] = len(self.category_dictionary)
+            self.category_dictionary.append(payload)
+        return index
+
+    def add(self, location_id, name, latitude, longitude, category_indexes, properties=None):
+        lat = round(float(latitude) * self.scale)
+        lng = round(float(longitude) * self.scale)
+
+        self.ids.append(location_id)
+        self.names.append(name)
+        self.lat.append(lat - self._last_lat)
+        self.lng.append(lng - self._last_lng)
+        self.categories.append(category_indexes)
+        for field, values in self.properties.items():
+            values.append(properties.get(field) if properties else None)
+
+        self._last_lat = lat
+        self._last_lng = lng
+
+    def __len__(self):
+        return len(self.ids)
+
+    def payload(self, **extra):
+        data = {
+            'format': 'columnar',
+            'precision': self.precision,
+            'ids': self.ids,
+            'names': self.names,
+            'lat': self.lat,
+            'lng': self.lng,
+            'categories': self.categories,
+            'category_dictionary': self.category_dictionary,
+        }
+        if self.properties:
+            data['properties'] = self.properties
+        data.update(extra)
+        return data
@@ -0,0 +1,59 @@
+"""
+Content-Encoding helpers for map payloads
+gzip is always available; brotli is used when the optional ``brotli``
+package is installed.
+"""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+def _gzip(body):
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+ENCODERS = {'gzip': _gzip}
+if brotli is not None:
+    ENCODERS['br'] = lambda body: brotli.compress(body, quality=9)
+
+# Server preference when the client accepts several encodings equally
+PREFERRED_ENCODINGS = ('br', 'gzip')
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Pick the best available encoding for an Accept-Encoding header value.
+    Returns None when the body should be sent uncompressed.
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in PREFERRED_ENCODINGS:
+        if encoding not in ENCODERS:
+            continue
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    return ENCODERS[encoding](body)
@@ -0,0 +1,138 @@
+"""
+Denormalized active-location counters on Domain and HierarchicalCategory
+Counters are adjusted incrementally from the signal handlers in maps.signals;
+bulk imports recount the touched domains once instead (see
+batch_version_bumps), and ``manage.py recount_locations`` repairs any drift.
+
+    HierarchicalCategory.location_count  active locations in the category
+    Domain.location_count                distinct active locations in any of its categories
+    Domain.category_count                active categories
+"""
+
+from collections import Counter
+
+from django.db.models import Count, F, Q
+
+from .hierarchical_models import Domain, DomainMembership, HierarchicalCategory, HierarchicalLocation
+
+LocationCategory = HierarchicalLocation.categories.through
+
+
+def _adjust(model, pks, field, delta):
+    if pks and delta:
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def _domains_of(category_pks):
+    """category pk -> domain pk"""
+    return dict(
+        HierarchicalCategory.objects.filter(pk__in=category_pks).values_list('pk', 'domain_id')
+    )
+
+
+def _active_pairs(pairs):
+    pairs = set(pairs)
+    active = set(
+        HierarchicalLocation.objects.filter(
+            pk__in={location_pk for location_pk, _ in pairs}, is_active=True
+        ).values_list('pk', flat=True)
+    )
+    return {(location_pk, category_pk) for location_pk, category_pk in pairs if location_pk in active}
+
+
+def _group_by_domain(pairs, domains):
+    """domain pk -> (location pks, category pks) of the pairs in that domain"""
+    grouped = {}
+    for location_pk, category_pk in pairs:
+        locations, categories = grouped.setdefault(domains[category_pk], (set(), set()))
+        locations.add(location_pk)
+        categories.add(category_pk)
+    return grouped
+
+
+def _members_of_domain(location_pks, domain_pk, exclude_category_pks=()):
+    """Subset of location_pks with at least one membership in the domain"""
+    memberships = LocationCategory.objects.filter(
+        hierarchicallocation_id__in=location_pks,
+        hierarchicalcategory__domain_id=domain_pk,
+    )
+    if exclude_category_pks:
+        memberships = memberships.exclude(hierarchicalcategory_id__in=exclude_category_pks)
+    return set(memberships.values_list('hierarchicallocation_id', flat=True))
+
+
+def memberships_added(pairs):
+    """Count (location pk, category pk) pairs whose rows were just added"""
+    pairs = _active_pairs(pairs)
+    if not pairs:
+        return
+
+    domains = _domains_of({category_pk for _, category_pk in pairs})
+    for category_pk, count in Counter(category_pk for _, category_pk in pairs).items():
+        _adjust(HierarchicalCategory, [category_pk], 'location_count', count)
+
+    for domain_pk, (locations, added) in _group_by_domain(pairs, domains).items():
+        # New to the domain unless a membership outside the added ones exists
+        already_members = _members_of_domain(locations, domain_pk, exclude_category_pks=added)
+        _adjust(Domain, [domain_pk], 'location_count', len(locations - already_members))
+
+
+def memberships_removed(pairs):
+    """Uncount (location pk, category pk) pairs whose rows were just deleted"""
+    pairs = _active_pairs(pairs)
+    if not pairs:
+        return
+
+    domains = _domains_of({category_pk for _, category_pk in pairs})
+    for category_pk, count in Counter(category_pk for _, category_pk in pairs).items():
+        _adjust(HierarchicalCategory, [category_pk], 'location_count', -count)
+
+    for domain_pk, (locations, _) in _group_by_domain(pairs, domains).items():
+        still_members = _members_of_domain(locations, domain_pk)
+        _adjust(Domain, [domain_pk], 'location_count', -len(locations - still_members))
+
+
+def location_activity_changed(location_pk, is_active):
+    """A location was activated or deactivated: adjust every category and domain it is in"""
+    delta = 1 if is_active else -1
+    memberships = list(
+        LocationCategory.objects.filter(hierarchicallocation_id=location_pk)
+        .values_list('hierarchicalcategory_id', 'hierarchicalcategory__domain_id')
+    )
+    _adjust(HierarchicalCategory, [category_pk for category_pk, _ in memberships], 'location_count', delta)
+    _adjust(Domain, {domain_pk for _, domain_pk in memberships}, 'location_count', delta)
+
+
+def category_activity_changed(domain_pk, is_active):
+    _adjust(Domain, [domain_pk], 'category_count', 1 if is_active else -1)
+
+
+def category_deleting(category_pk, domain_pk):
+    """Before a category is deleted: uncount locations that only belong to the domain through it"""
+    locations = set(
+        LocationCategory.objects.filter(
+            hierarchicalcategory_id=category_pk, hierarchicallocation__is_active=True
+        ).values_list('hierarchicallocation_id', flat=True)
+    )
+    if locations:
+        still_members = _members_of_domain(locations, domain_pk, exclude_category_pks=[category_pk])
+        _adjust(Domain, [domain_pk], 'location_count', -len(locations - still_members))
+
+
+def recount_domain(domain_pk):
+    """Recompute the counters of a domain and its categories from scratch"""
+    active_members = Q(locations__is_active=True)
+    categories = HierarchicalCategory.objects.filter(domain_id=domain_pk).annotate(
+        active_locations=Count('locations', filter=active_members)
+    )
+    for category_pk, count in categories.values_list('pk', 'active_locations'):
+        HierarchicalCategory.objects.filter(pk=category_pk).update(location_count=count)
+
+    # One row per location of the domain, rebuilt before any recount
+    location_count = DomainMembership.objects.filter(
+        domain_id=domain_pk, location__is_active=True
+    ).count()
+    category_count = HierarchicalCategory.objects.filter(domain_id=domain_pk, is_active=True).count()
+    Domain.objects.filter(pk=domain_pk).update(
+        location_count=location_count, category_count=category_count
+    )
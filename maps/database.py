@@ -0,0 +1,107 @@
+"""
+SQLite connection profile and the read-only database alias of the map API
+Every new SQLite connection runs the SQLITE_PRAGMAS of the settings (WAL
+journal, synchronous=NORMAL, a larger page cache, mmap, in-memory temp
+tables). The MAPS_READ_DATABASE alias points at the same file but is opened
+with query_only; views decorated with ``use_read_database`` send their reads
+there, so with WAL an import or admin write on ``default`` no longer blocks
+map reads.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_reading = ContextVar('maps_read_database', default=False)
+
+
+def read_database_alias():
+    """The configured read-only alias, or ``default`` when there is none"""
+    alias = getattr(settings, 'MAPS_READ_DATABASE', None)
+    return alias if alias in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+def connection_pragmas(alias):
+    """PRAGMA name -> value for a new connection of ``alias``"""
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    if alias != DEFAULT_DB_ALIAS and alias == read_database_alias():
+        pragmas['query_only'] = 'ON'
+    return pragmas
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in connection_pragmas(connection.alias).items():
+        # On the raw connection, so the pragmas do not show up as queries
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def reading_database():
+    """Route ORM reads to the read-only alias inside the block"""
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+def _read_while_streaming(content):
+    iterator = iter(content)
+    while True:
+        with reading_database():
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+def use_read_database(view_func):
+    """
+    Decorate a read-only view so its queries use the read-only alias.
+    Streaming bodies are generated after the view returns, so they are
+    routed chunk by chunk.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with reading_database():
+            response = view_func(request, *args, **kwargs)
+        if response.streaming:
+            response.streaming_content = _read_while_streaming(response.streaming_content)
+        return response
+
+    return wrapper
+
+
+class ReadDatabaseRouter:
+    """
+    Sends reads inside ``reading_database()`` to the read-only alias.
+    Writes always go to ``default`` (also for objects loaded from the read
+    alias), and reads inside a transaction on ``default`` stay there so they
+    see its uncommitted writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _reading.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return read_database_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, read_database_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db != DEFAULT_DB_ALIAS and db == read_database_alias():
+            return False
+        return None
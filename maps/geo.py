@@ -0,0 +1,256 @@
+"""
+Geographic helpers shared by the map APIs
+Bounding box parsing, radius boxes, distances, Web Mercator tile math and quadkeys
+"""
+
+import math
+
+MAX_ZOOM = 22
+MAX_MERCATOR_LAT = 85.0511287798
+
+# Zoom level of the quadkeys stored on locations (~38m tiles at the equator)
+QUADKEY_ZOOM = 20
+
+# Upper bound of every quadkey starting with a prefix: digits are 0-3
+QUADKEY_END = '4'
+
+
+def parse_bbox(value):
+    """
+    Parse a ``minLng,minLat,maxLng,maxLat`` string.
+
+    Returns a tuple of floats or raises ``ValueError``. A bbox whose minLng is
+    greater than its maxLng is kept as-is and means it crosses the antimeridian.
+    """
+    parts = [part.strip() for part in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox must be minLng,minLat,maxLng,maxLat')
+
+    min_lng, min_lat, max_lng, max_lat = (float(part) for part in parts)
+
+    if not all(math.isfinite(v) for v in (min_lng, min_lat, max_lng, max_lat)):
+        raise ValueError('bbox values must be finite numbers')
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+        raise ValueError('bbox longitudes must be between -180 and 180')
+    if not (-90 <= min_lat <= 90 and -90 <= max_lat <= 90):
+        raise ValueError('bbox latitudes must be between -90 and 90')
+    if min_lat > max_lat:
+        raise ValueError('bbox minLat must not be greater than maxLat')
+
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def parse_zoom(value):
+    """
+    Parse a zoom level and clamp it to the supported range. Fractional zooms
+    (pinch or smooth zooming) are floored to the tile zoom they display.
+    """
+    zoom = float(value)
+    if not math.isfinite(zoom):
+        raise ValueError('zoom must be a finite number')
+    return max(0, min(MAX_ZOOM, math.floor(zoom)))
+
+
+def lng_to_tile_x(lng, zoom):
+    """Fractional tile column for a longitude"""
+    return (lng + 180.0) / 360.0 * (1 << zoom)
+
+
+def lat_to_tile_y(lat, zoom):
+    """Fractional tile row for a latitude (Web Mercator)"""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    lat_rad = math.radians(lat)
+    return (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * (1 << zoom)
+
+
+def tile_x_to_lng(x, zoom):
+    """Longitude of the west edge of tile column ``x``"""
+    return x / (1 << zoom) * 360.0 - 180.0
+
+
+def tile_y_to_lat(y, zoom):
+    """Latitude of the north edge of tile row ``y``"""
+    n = math.pi - 2.0 * math.pi * y / (1 << zoom)
+    return math.degrees(math.atan(math.sinh(n)))
+
+
+def tile_bounds(x, y, zoom):
+    """Return (minLng, minLat, maxLng, maxLat) of a tile"""
+    return (
+        tile_x_to_lng(x, zoom),
+        tile_y_to_lat(y + 1, zoom),
+        tile_x_to_lng(x + 1, zoom),
+        tile_y_to_lat(y, zoom),
+    )
+
+
+def snap_bbox_to_tiles(bbox, zoom):
+    """
+    Expand a bbox outwards to the tile grid of ``zoom``.
+
+    Small pans inside the same tiles produce the same bbox, so clients can
+    skip refetching and identical requests share one response.
+    """
+    min_lng, min_lat, max_lng, max_lat = bbox
+    n = 1 << zoom
+
+    if min_lng > max_lng:
+        # Antimeridian crossing: snap each side on its own
+        west = math.floor(lng_to_tile_x(min_lng, zoom))
+        east = math.ceil(lng_to_tile_x(max_lng, zoom))
+        snapped_min_lng = tile_x_to_lng(west, zoom)
+        snapped_max_lng = tile_x_to_lng(min(east, n), zoom)
+    else:
+        west = math.floor(lng_to_tile_x(min_lng, zoom))
+        east = max(west + 1, math.ceil(lng_to_tile_x(max_lng, zoom)))
+        snapped_min_lng = tile_x_to_lng(max(west, 0), zoom)
+        snapped_max_lng = tile_x_to_lng(min(east, n), zoom)
+
+    top = math.floor(lat_to_tile_y(max_lat, zoom))
+    bottom = max(top + 1, math.ceil(lat_to_tile_y(min_lat, zoom)))
+    snapped_max_lat = 90.0 if top <= 0 else tile_y_to_lat(top, zoom)
+    snapped_min_lat = -90.0 if bottom >= n else tile_y_to_lat(bottom, zoom)
+
+    return (
+        round(snapped_min_lng, 7),
+        round(snapped_min_lat, 7),
+        round(snapped_max_lng, 7),
+        round(snapped_max_lat, 7),
+    )
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def radius_bbox(lat, lng, radius_km):
+    """
+    Smallest (minLng, minLat, maxLng, maxLat) containing the circle of
+    ``radius_km`` around a point; use as a prefilter for radius queries.
+    Crosses the antimeridian (minLng > maxLng) where the circle does.
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = lat - delta_lat
+    max_lat = lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        # Circle contains a pole: every longitude
+        return -180.0, max(-90.0, min_lat), 180.0, min(90.0, max_lat)
+
+    delta_lng = math.degrees(
+        math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat))))
+    )
+    min_lng = lng - delta_lng
+    max_lng = lng + delta_lng
+    if min_lng < -180:
+        min_lng += 360
+    if max_lng > 180:
+        max_lng -= 360
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+# Quadkeys
+#
+# A quadkey names a tile by one digit (0-3) per zoom level, so the tile of a
+# point at any zoom z <= QUADKEY_ZOOM is the first z digits of its quadkey,
+# and all quadkeys inside a tile sort between ``prefix`` and ``prefix + '4'``.
+
+
+def point_tile(lat, lng, zoom):
+    """Tile (x, y) containing a point, clamped to the grid"""
+    last = (1 << zoom) - 1
+    x = int(lng_to_tile_x(lng, zoom))
+    y = int(lat_to_tile_y(lat, zoom))
+    return min(last, max(0, x)), min(last, max(0, y))
+
+
+def tile_quadkey(x, y, zoom):
+    digits = []
+    for level in range(zoom, 0, -1):
+        mask = 1 << (level - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return ''.join(digits)
+
+
+def quadkey_tile(quadkey):
+    """Inverse of tile_quadkey: (x, y, zoom)"""
+    x = y = 0
+    for digit in quadkey:
+        digit = int(digit)
+        x = x << 1 | digit & 1
+        y = y << 1 | digit >> 1
+    return x, y, len(quadkey)
+
+
+def point_quadkey(lat, lng, zoom=QUADKEY_ZOOM):
+    return tile_quadkey(*point_tile(float(lat), float(lng), zoom), zoom)
+
+
+def _bbox_tiles(bbox, zoom):
+    """Tile ranges (x0, x1, y0, y1) covering a bbox, two when it crosses the antimeridian"""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    parts = [(min_lng, 180.0), (-180.0, max_lng)] if min_lng > max_lng else [(min_lng, max_lng)]
+    top = point_tile(max_lat, 0, zoom)[1]
+    bottom = point_tile(min_lat, 0, zoom)[1]
+    return [
+        (point_tile(0, west, zoom)[0], point_tile(0, east, zoom)[0], top, bottom)
+        for west, east in parts
+    ]
+
+
+def quadkey_ranges(bbox, max_tiles=32):
+    """
+    Cover a bbox with quadkey ranges ``[(low, high), ...]`` (low inclusive,
+    high exclusive) for prefix-range filtering on the quadkey column.
+
+    Uses the deepest zoom whose covering tiles number at most ``max_tiles``
+    and merges tiles that are adjacent in quadkey order, so the ranges only
+    overapproximate the bbox; combine with an exact coordinate filter.
+    """
+    zoom = 0
+    while zoom < QUADKEY_ZOOM:
+        tiles = sum(
+            (x1 - x0 + 1) * (y1 - y0 + 1) for x0, x1, y0, y1 in _bbox_tiles(bbox, zoom + 1)
+        )
+        if tiles > max_tiles:
+            break
+        zoom += 1
+
+    # A quadkey is its tile's Morton (Z-order) index written in base 4
+    indexes = sorted({
+        _morton(x, y)
+        for x0, x1, y0, y1 in _bbox_tiles(bbox, zoom)
+        for x in range(x0, x1 + 1)
+        for y in range(y0, y1 + 1)
+    })
+
+    runs = []
+    for index in indexes:
+        if runs and index == runs[-1][1] + 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return [
+        (_index_quadkey(low, zoom), _index_quadkey(high, zoom) + QUADKEY_END)
+        for low, high in runs
+    ]
+
+
+def _morton(x, y):
+    index = 0
+    bit = 0
+    while x >> bit or y >> bit:
+        index |= (x >> bit & 1) << 2 * bit | (y >> bit & 1) << 2 * bit + 1
+        bit += 1
+    return index
+
+
+def _index_quadkey(index, zoom):
+    return ''.join(str(index >> 2 * level & 3) for level in range(zoom - 1, -1, -1))
@@ -5,7 +5,6 @@ Enhanced admin with hierarchical views and statistics
 
 from django.contrib import admin
 from django.utils.html import format_html
-from django.db.models import Count, Q
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
@@ -13,6 +12,7 @@ from django.utils.safestring import mark_safe
 from .hierarchical_models import (
     Domain, HierarchicalCategory, HierarchicalLocation, DataImportLog
 )
+from .signals import batch_version_bumps, bump_domains
 
 @admin.register(Domain)
 class DomainAdmin(admin.ModelAdmin):
@@ -48,7 +48,7 @@ class DomainAdmin(admin.ModelAdmin):
     )
     
     def total_categories_display(self, obj):
-        count = obj.categories.filter(is_active=True).count()
+        count = obj.category_count
         url = reverse('admin:maps_hierarchicalcategory_changelist') + f'?domain__id__exact={obj.id}'
         return format_html(
             '<a href="{}">{} categories</a>',
@@ -57,9 +57,7 @@ class DomainAdmin(admin.ModelAdmin):
     total_categories_display.short_description = 'Categories'
     
     def total_locations_display(self, obj):
-        count = HierarchicalLocation.objects.filter(
-            categories__domain=obj, is_active=True
-        ).distinct().count()
+        count = obj.location_count
         url = reverse('admin:maps_hierarchicallocation_changelist') + f'?categories__domain__id__exact={obj.id}'
         return format_html(
             '<a href="{}">{} locations</a>',
@@ -72,9 +70,7 @@ class DomainAdmin(admin.ModelAdmin):
             return "Save domain first to see statistics"
         
         # Get category statistics
-        categories = obj.categories.annotate(
-            location_count=Count('locations', filter=Q(locations__is_active=True))
-        ).filter(is_active=True).order_by('-location_count')[:10]
+        categories = obj.categories.filter(is_active=True).order_by('-location_count')[:10]
         
         stats_html = f"""
         <div style="background: #f8f9fa; padding: 15px; border-radius: 5px;">
@@ -138,8 +134,15 @@ class HierarchicalCategoryAdmin(admin.ModelAdmin):
     
     inlines = [LocationInline]
     
+    def save_related(self, request, form, formsets, change):
+        # LocationInline writes the auto-created through table, which sends no
+        # model signals: bump the domain (and recount its counters) explicitly
+        with batch_version_bumps():
+            super().save_related(request, form, formsets, change)
+            bump_domains([form.instance.domain.domain_id])
+    
     def location_count_display(self, obj):
-        count = obj.locations.filter(is_active=True).count()
+        count = obj.location_count
         url = reverse('admin:maps_hierarchicallocation_changelist') + f'?categories__id__exact={obj.id}'
         return format_html(
             '<a href="{}">{} locations</a>',
@@ -218,6 +221,16 @@ class HierarchicalLocationAdmin(admin.ModelAdmin):
     
     inlines = [CategoryInline]
     
+    def save_related(self, request, form, formsets, change):
+        # CategoryInline writes the auto-created through table, which sends no
+        # model signals: bump the domains before and after the edit (and
+        # rebuild their counters and memberships) explicitly
+        location = form.instance
+        with batch_version_bumps():
+            bump_domains(location.categories.values_list('domain__domain_id', flat=True))
+            super().save_related(request, form, formsets, change)
+            bump_domains(location.categories.values_list('domain__domain_id', flat=True))
+    
     def categories_display(self, obj):
         categories = obj.categories.all()[:3]  # Show first 3
         total = obj.categories.count()
@@ -3,11 +3,17 @@ Django Models for 3-Tier Hierarchical Data Structure
 Mở rộng models hiện có để hỗ trợ cấu trúc 3 tầng
 """
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from django.utils.text import slugify
 import json
 
+from .geo import QUADKEY_ZOOM, point_quadkey
+from .search import LocationManager
+
 class Domain(models.Model):
     """
     TẦNG 1: LĨNH VỰC (DOMAIN)
@@ -34,6 +40,13 @@ class Domain(models.Model):
     last_updated = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Denormalized counters, maintained by maps.counters
+    category_count = models.PositiveIntegerField(default=0, editable=False, help_text='Active categories')
+    location_count = models.PositiveIntegerField(default=0, editable=False, help_text='Active locations')
+    
+    # DataVersion the ClusterCell rows were built at (0: never built), see maps.clustering
+    cluster_index_version = models.PositiveIntegerField(default=0, editable=False)
+    
     class Meta:
         verbose_name = 'Domain'
         verbose_name_plural = 'Domains'
@@ -45,15 +58,12 @@ class Domain(models.Model):
     @property
     def total_categories(self):
         """Tổng số categories trong domain"""
-        return self.categories.filter(is_active=True).count()
+        return self.category_count
     
     @property
     def total_locations(self):
         """Tổng số locations trong domain"""
-        return HierarchicalLocation.objects.filter(
-            categories__domain=self,
-            is_active=True
-        ).distinct().count()
+        return self.location_count
 
 class HierarchicalCategory(models.Model):
     """
@@ -77,6 +87,9 @@ class HierarchicalCategory(models.Model):
     is_active = models.BooleanField(default=True)
     display_order = models.IntegerField(default=0, help_text='Order for display')
     
+    # Denormalized counter, maintained by maps.counters
+    location_count = models.PositiveIntegerField(default=0, editable=False, help_text='Active locations')
+    
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -101,7 +114,7 @@ class HierarchicalCategory(models.Model):
     
     def get_location_count(self):
         """Số lượng locations trong category này"""
-        return self.locations.filter(is_active=True).count()
+        return self.location_count
 
 class HierarchicalLocation(models.Model):
     """
@@ -127,6 +140,13 @@ class HierarchicalLocation(models.Model):
         decimal_places=7,
         validators=[MinValueValidator(-180), MaxValueValidator(180)]
     )
+    quadkey = models.CharField(
+        max_length=QUADKEY_ZOOM,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text='Tile quadkey of the coordinates, set on save()'
+    )
     
     # Address information
     street = models.CharField(max_length=200, blank=True)
@@ -150,12 +170,14 @@ class HierarchicalLocation(models.Model):
     # Metadata
     source_name = models.CharField(max_length=200, blank=True)
     detail_url = models.URLField(blank=True, help_text='URL to detailed information')
-    raw_data = models.JSONField(blank=True, null=True, help_text='Original raw data')
+    # Original raw data lives in HierarchicalLocationRaw (see raw_data)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = LocationManager()
+    
     class Meta:
         verbose_name = 'Hierarchical Location'
         verbose_name_plural = 'Hierarchical Locations'
@@ -169,6 +191,7 @@ class HierarchicalLocation(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(f"{self.name}-{self.city}")
+        self.quadkey = point_quadkey(self.latitude, self.longitude)
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -177,6 +200,9 @@ class HierarchicalLocation(models.Model):
     @property
     def coordinates(self):
         """Return coordinates as [lat, lng] for JavaScript"""
+        if hasattr(self, 'lat'):
+            # Loaded through objects.float_coordinates()
+            return [self.lat, self.lng]
         return [float(self.latitude), float(self.longitude)]
     
     @property
@@ -198,6 +224,149 @@ class HierarchicalLocation(models.Model):
         """Get primary domain (first category's domain)"""
         first_category = self.categories.first()
         return first_category.domain if first_category else None
+    
+    @property
+    def raw_data(self):
+        """Original source record, loaded from HierarchicalLocationRaw"""
+        try:
+            return self.raw.data
+        except HierarchicalLocationRaw.DoesNotExist:
+            return None
+    
+    def store_raw_data(self, data):
+        """Create, replace or (with None) delete the original source record"""
+        if data is None:
+            HierarchicalLocationRaw.objects.filter(location=self).delete()
+        else:
+            HierarchicalLocationRaw.objects.update_or_create(
+                location=self, defaults={'data': data}
+            )
+
+class HierarchicalLocationRaw(models.Model):
+    """
+    Original source record of a HierarchicalLocation
+    Kept out of the location table so map queries scan narrow rows; only the
+    detail endpoint and the admin read it.
+    """
+    location = models.OneToOneField(
+        HierarchicalLocation, on_delete=models.CASCADE, primary_key=True, related_name='raw'
+    )
+    data = models.JSONField(help_text='Original raw data')
+    
+    class Meta:
+        verbose_name = 'Hierarchical Location Raw Data'
+        verbose_name_plural = 'Hierarchical Location Raw Data'
+    
+    def __str__(self):
+        return f"Raw data of {self.location_id}"
+
+class DomainMembership(models.Model):
+    """
+    Denormalized domain membership: one row per (domain, location) with the
+    location's category ids in that domain, kept in sync by maps.memberships.
+    A domain's locations come from one range scan of the unique index,
+    without the through/category joins and DISTINCT.
+    """
+    # Leading column of the unique index, no separate index needed
+    domain = models.ForeignKey(
+        Domain, on_delete=models.CASCADE, related_name='memberships', db_index=False
+    )
+    location = models.ForeignKey(
+        HierarchicalLocation, on_delete=models.CASCADE, related_name='domain_memberships'
+    )
+    category_ids = models.JSONField(
+        default=list, help_text='category_id of each of the location\'s categories in the domain'
+    )
+    
+    class Meta:
+        verbose_name = 'Domain Membership'
+        verbose_name_plural = 'Domain Memberships'
+        unique_together = [['domain', 'location']]
+    
+    def __str__(self):
+        return f"{self.location_id} in {self.domain_id}"
+
+class ClusterCell(models.Model):
+    """
+    Pre-aggregated marker cluster for one grid cell at one zoom level
+    Rebuilt from HierarchicalLocation whenever its domain changes (see maps.clustering)
+    """
+    domain = models.ForeignKey(Domain, on_delete=models.CASCADE, related_name='cluster_cells')
+    
+    # Grid position (cells are tiles of zoom + CELL_ZOOM_OFFSET)
+    zoom = models.PositiveSmallIntegerField()
+    cell_x = models.IntegerField()
+    cell_y = models.IntegerField()
+    
+    # Aggregates
+    count = models.IntegerField(default=0)
+    latitude = models.FloatField(help_text='Centroid latitude')
+    longitude = models.FloatField(help_text='Centroid longitude')
+    category_counts = models.JSONField(default=dict, help_text='Location count per category_id')
+    
+    class Meta:
+        verbose_name = 'Cluster Cell'
+        verbose_name_plural = 'Cluster Cells'
+        indexes = [
+            models.Index(fields=['domain', 'zoom', 'cell_x', 'cell_y']),
+        ]
+    
+    def __str__(self):
+        return f"{self.domain_id} z{self.zoom} ({self.cell_x}, {self.cell_y}): {self.count}"
+
+class DataVersion(models.Model):
+    """
+    Monotonic data version per scope (a domain_id, ALL_DOMAINS or LEGACY)
+    Bumped whenever the scope's map data changes; derived artifacts
+    (tiles, cached payloads, ETags) are keyed by it.
+    """
+    # Bumped together with any domain, for endpoints spanning all domains
+    ALL_DOMAINS = '__all__'
+    # Legacy Category / Location / MapConfiguration models
+    LEGACY = '__legacy__'
+    
+    scope = models.CharField(max_length=100, unique=True, help_text='Domain ID or special scope')
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Data Version'
+        verbose_name_plural = 'Data Versions'
+    
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+    
+    @staticmethod
+    def cache_key(scope):
+        return f'maps:data-version:{scope}'
+    
+    @classmethod
+    def current(cls, scope):
+        """
+        Current version of a scope (1 if it was never bumped)
+        Read through the cache with a short TTL, so warm requests skip the
+        database; other processes see a bump within DATA_VERSION_CACHE_TTL.
+        """
+        key = cls.cache_key(scope)
+        version = cache.get(key)
+        if version is None:
+            version = cls.objects.filter(scope=scope).values_list('version', flat=True).first() or 1
+            cache.set(key, version, getattr(settings, 'DATA_VERSION_CACHE_TTL', 5))
+        return version
+    
+    @classmethod
+    def bump(cls, scope):
+        """Increment the version of a scope and return the new value"""
+        updated = cls.objects.filter(scope=scope).update(
+            version=models.F('version') + 1, updated_at=timezone.now()
+        )
+        if not updated:
+            obj, created = cls.objects.get_or_create(scope=scope, defaults={'version': 2})
+            if not created:
+                return cls.bump(scope)
+        version = cls.objects.filter(scope=scope).values_list('version', flat=True).get()
+        cache.set(cls.cache_key(scope), version, getattr(settings, 'DATA_VERSION_CACHE_TTL', 5))
+        return version
 
 class DataImportLog(models.Model):
     """
@@ -14,9 +14,14 @@ urlpatterns = [
     
     # API endpoints for data
     path('api/locations/', views.HierarchicalLocationsAPI.as_view(), name='api_locations'),
+    path('api/locations/<str:location_id>/', views.LocationDetailAPI.as_view(), name='api_location_detail'),
     path('api/categories/', views.category_list_api, name='api_categories'),
     path('api/search/', views.search_locations_api, name='api_search'),
+    path('api/autocomplete/', views.autocomplete_api, name='api_autocomplete'),
     path('api/domains/', views.domain_list_api, name='api_domains'),
+    path('api/clusters/', views.cluster_api, name='api_clusters'),
+    path('api/nearby/', views.nearby_api, name='api_nearby'),
+    path('api/tiles/<int:z>/<int:x>/<int:y>.pbf', views.vector_tile_api, name='api_tiles'),
     
     # Legacy compatibility
     path('legacy/', views.hierarchical_map, name='legacy_map'),
@@ -27,7 +32,12 @@ urlpatterns = [
 map_urlpatterns = [
     path('hierarchical/', views.HierarchicalMapView.as_view(), name='hierarchical_map_view'),
     path('api/hierarchical/locations/', views.HierarchicalLocationsAPI.as_view(), name='hierarchical_locations_api'),
+    path('api/hierarchical/locations/<str:location_id>/', views.LocationDetailAPI.as_view(), name='hierarchical_location_detail_api'),
     path('api/hierarchical/categories/', views.category_list_api, name='hierarchical_categories_api'),
     path('api/hierarchical/search/', views.search_locations_api, name='hierarchical_search_api'),
+    path('api/hierarchical/autocomplete/', views.autocomplete_api, name='hierarchical_autocomplete_api'),
     path('api/hierarchical/domains/', views.domain_list_api, name='hierarchical_domains_api'),
+    path('api/hierarchical/clusters/', views.cluster_api, name='hierarchical_clusters_api'),
+    path('api/hierarchical/nearby/', views.nearby_api, name='hierarchical_nearby_api'),
+    path('api/hierarchical/tiles/<int:z>/<int:x>/<int:y>.pbf', views.vector_tile_api, name='hierarchical_tiles_api'),
 ]
\ No newline at end of file
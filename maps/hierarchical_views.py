@@ -238,9 +238,7 @@ def api_categories(request):
     
     domain = get_object_or_404(Domain, domain_id=domain_id, is_active=True)
     
-    categories = domain.categories.filter(is_active=True).annotate(
-        location_count=Count('locations', filter=Q(locations__is_active=True))
-    ).order_by('-location_count')
+    categories = domain.categories.filter(is_active=True).order_by('-location_count')
     
     category_data = [
         {
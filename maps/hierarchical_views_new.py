@@ -3,12 +3,31 @@ Django Views for 3-Tier Hierarchical Map Interface
 """
 
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
-from django.db.models import Count, Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import Prefetch, Q
+from django.utils.decorators import method_decorator
+from django.utils.cache import patch_vary_headers
 from django.views.decorators.http import require_http_methods
 from django.views import View
 import json
 import logging
+import math
+import re
+
+from .autocomplete import MAX_LIMIT as AUTOCOMPLETE_MAX_LIMIT, get_autocomplete_index
+from .category_index import MATCH_ALL, MATCH_ANY, MATCH_MODES, get_category_index
+from .clustering import CLUSTER_MAX_ZOOM, cluster_cells, has_cluster_index
+from .columnar import ColumnarBuilder
+from .compression import compress, negotiate_encoding
+from .conditional import all_domain_scopes, domain_scopes, versioned_etag
+from .database import use_read_database
+from .facets import facet_counts, parse_facets
+from .geo import MAX_ZOOM, parse_bbox, parse_zoom, snap_bbox_to_tiles
+from .nearby import get_nearby_index
+from .snapshots import cached_encoded_snapshot, cached_response
+from .spatial import float_coordinates
+from .vector_tiles import MVT_CONTENT_TYPE, get_tile
 
 try:
     from .hierarchical_models import Domain, HierarchicalCategory, HierarchicalLocation
@@ -17,6 +36,128 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+
+# Optional feature properties selectable with fields= (and the columns they read).
+# Without fields= a feature only carries id, name and category ids.
+LOCATION_PROPERTY_FIELDS = {
+    'address': ('street', 'postal_code', 'city', 'country'),
+    'street': ('street',),
+    'city': ('city',),
+    'postal_code': ('postal_code',),
+    'country': ('country',),
+    'phone': ('phone',),
+    'fax': ('fax',),
+    'email': ('email',),
+    'website': ('website',),
+    'description': ('description',),
+    'source_name': ('source_name',),
+    'detail_url': ('detail_url',),
+    'category_details': (),  # category objects instead of ids, plus 'category'
+}
+# Coordinates are read as lat/lng floats through objects.float_coordinates()
+LEAN_LOCATION_COLUMNS = ('location_id', 'name')
+
+RESPONSE_FORMATS = ('geojson', 'columnar')
+
+# Largest k of the nearby API
+MAX_NEARBY_RESULTS = 1000
+# Largest page of the search API
+MAX_SEARCH_RESULTS = 100
+
+INDEXED_CATEGORY_PARAM = re.compile(r'categories\[(\d+)\]')
+
+# Locations per database round trip when building features
+# (kept below SQLite's historical limit of 999 query parameters)
+FEATURE_CHUNK_SIZE = 900
+
+
+def parse_fields(value):
+    """Parse a comma separated fields= projection ('all' selects every field)"""
+    fields = {field.strip() for field in (value or '').split(',') if field.strip()}
+    if 'all' in fields:
+        return sorted(LOCATION_PROPERTY_FIELDS)
+    unknown = fields - set(LOCATION_PROPERTY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return sorted(fields)
+
+
+def parse_category_ids(query):
+    """
+    Category ids from a query string. Accepts categories[]=a&categories[]=b,
+    the indexed categories[0]=a&categories[1]=b form and plain categories=a,b.
+    Duplicates are dropped, first occurrence wins.
+    """
+    values = query.getlist('categories[]')
+    indexed = []
+    for key in query:
+        match = INDEXED_CATEGORY_PARAM.fullmatch(key)
+        if match:
+            indexed.append((int(match.group(1)), query[key]))
+    values += [value for _, value in sorted(indexed)]
+    for value in query.getlist('categories'):
+        values += value.split(',')
+    
+    category_ids = []
+    for value in values:
+        value = value.strip()
+        if value and value not in category_ids:
+            category_ids.append(value)
+    return category_ids
+
+
+def location_columns(fields):
+    """Model columns needed to render the given fields"""
+    columns = set(LEAN_LOCATION_COLUMNS)
+    for field in fields:
+        columns.update(LOCATION_PROPERTY_FIELDS[field])
+    return sorted(columns)
+
+
+def location_rows(locations, fields):
+    """
+    Named rows (pk, columns of the fields, lat, lng) of a location queryset;
+    skips model instances and Decimal coordinates on the feature read paths.
+    """
+    return locations.float_coordinates().values_list(
+        'pk', *location_columns(fields), 'lat', 'lng', named=True
+    )
+
+
+def location_properties(location, fields):
+    """Extra feature properties for the selected fields (location: model instance or named row)"""
+    properties = {}
+    for field in fields:
+        if field == 'address':
+            properties['address'] = HierarchicalLocation.full_address.fget(location)
+        elif field != 'category_details':
+            properties[field] = getattr(location, field)
+    return properties
+
+
+def category_payload(category):
+    return {
+        'id': category.category_id,
+        'name': category.name,
+        'color': category.color or '#3388ff',
+        'icon': category.icon or 'Category'
+    }
+
+
+def encoded_json_response(body, encoding, size):
+    """
+    JSON response for a body already in ``encoding`` (None for identity).
+    X-Uncompressed-Length / X-Compressed-Length report the payload sizes.
+    """
+    response = HttpResponse(body, content_type='application/json')
+    response['X-Uncompressed-Length'] = str(size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+        response['X-Compressed-Length'] = str(len(body))
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
 class HierarchicalMapView(View):
     """Main view for 3-tier hierarchical map interface"""
     
@@ -27,9 +168,7 @@ class HierarchicalMapView(View):
             return JsonResponse({'error': 'Hierarchical models not available'}, status=500)
         
         # Get all available domains
-        domains = Domain.objects.annotate(
-            location_count=Count('categories__locations')
-        ).order_by('name')
+        domains = Domain.objects.order_by('name')
         
         # Get selected domain (default to first)
         domain_id = request.GET.get('domain')
@@ -45,8 +184,6 @@ class HierarchicalMapView(View):
         if domain:
             categories = HierarchicalCategory.objects.filter(
                 domain=domain
-            ).annotate(
-                location_count=Count('locations')
             ).order_by('name')
             
             # Prepare categories data for JavaScript
@@ -70,140 +207,470 @@ class HierarchicalMapView(View):
         
         return render(request, 'maps/hierarchical_map.html', context)
 
+@method_decorator(use_read_database, name='get')
+@method_decorator(versioned_etag(domain_scopes), name='get')
 class HierarchicalLocationsAPI(View):
     """API endpoint to provide locations data for map"""
     
     def get(self, request):
-        """Return GeoJSON format locations for selected domain/categories"""
+        """
+        Return GeoJSON format locations for selected domain/categories
+
+        Optional viewport filtering:
+            bbox=minLng,minLat,maxLng,maxLat  only locations inside the box
+            zoom=<int>                        snap bbox outwards to the tile grid
+
+        Features are lean by default (id, name, category ids); fields=a,b
+        adds properties from LOCATION_PROPERTY_FIELDS. Full records, including
+        raw_data, come from LocationDetailAPI.
+
+        format=columnar returns parallel arrays instead of Features
+        (see maps.columnar), several times smaller and faster to parse.
+
+        facets=category,city,domain (or facets=all) adds per-facet location
+        counts of the whole match (see maps.facets).
+
+        Responses for a domain are served from a snapshot keyed by the
+        domain's data version (see maps.snapshots); concurrent misses build
+        it once, and during a rebuild the previous one is served with
+        X-Cache: STALE. stream=1 skips the snapshot and streams features
+        chunk by chunk, so memory stays flat for very large domains.
+        """
         
         if not all([Domain, HierarchicalCategory, HierarchicalLocation]):
             return JsonResponse({'error': 'Hierarchical models not available'}, status=500)
         
+        bbox = None
+        zoom = None
         try:
-            domain_id = request.GET.get('domain')
-            category_ids = request.GET.getlist('categories[]')
-            
-            print(f"DEBUG: domain_id={domain_id}, category_ids={category_ids}")
-            
-            # Build query
-            query = Q()
-            
-            if domain_id:
-                query &= Q(categories__domain__domain_id=domain_id)
-            
-            if category_ids:
-                query &= Q(categories__category_id__in=category_ids)
-            
-            print(f"DEBUG: Query built: {query}")
-            
-            # Get locations
-            locations = HierarchicalLocation.objects.filter(query).distinct().prefetch_related(
-                'categories__domain'
+            if request.GET.get('zoom'):
+                zoom = parse_zoom(request.GET['zoom'])
+            if request.GET.get('bbox'):
+                bbox = parse_bbox(request.GET['bbox'])
+                if zoom is not None:
+                    bbox = snap_bbox_to_tiles(bbox, zoom)
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid viewport: {e}'}, status=400)
+        
+        try:
+            fields = parse_fields(request.GET.get('fields'))
+            facets = parse_facets(request.GET.get('facets'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        response_format = request.GET.get('format', 'geojson')
+        if response_format not in RESPONSE_FORMATS:
+            return JsonResponse({'error': f'Unknown format: {response_format}'}, status=400)
+        
+        category_mode = request.GET.get('category_mode', MATCH_ANY)
+        if category_mode not in MATCH_MODES:
+            return JsonResponse({'error': f'Unknown category_mode: {category_mode}'}, status=400)
+        
+        domain_id = request.GET.get('domain')
+        category_ids = parse_category_ids(request.GET)
+        
+        if response_format == 'geojson' and request.GET.get('stream', '').lower() in ('1', 'true'):
+            return StreamingHttpResponse(
+                self.stream_geojson(domain_id, category_ids, bbox, zoom, fields, category_mode, facets),
+                content_type='application/json'
             )
-            print(f"DEBUG: Query successful, found {locations.count()} locations")
+        
+        def build():
+            if response_format == 'columnar':
+                data = self.build_columnar(domain_id, category_ids, bbox, zoom, fields, category_mode, facets)
+                return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+            geojson = self.build_geojson(domain_id, category_ids, bbox, zoom, fields, category_mode, facets)
+            return json.dumps(geojson, cls=DjangoJSONEncoder).encode('utf-8')
+        
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        
+        try:
+            # Unsnapped bboxes are too varied to be worth a snapshot
+            if domain_id and (bbox is None or zoom is not None):
+                params = {
+                    'categories': sorted(category_ids),
+                    'category_mode': category_mode,
+                    'bbox': bbox,
+                    'zoom': zoom,
+                    'fields': fields,
+                    'facets': facets,
+                }
+                body, size, stale = cached_encoded_snapshot(response_format, domain_id, params, build, encoding)
+            else:
+                body = build()
+                size = len(body)
+                stale = False
+                if encoding:
+                    body = compress(body, encoding)
         except Exception as e:
-            print(f"DEBUG: Error in API: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error building hierarchical locations for domain %s', domain_id)
             return JsonResponse({'error': str(e)}, status=500)
         
-        # Build GeoJSON features
+        response = encoded_json_response(body, encoding, size)
+        if stale:
+            response['X-Cache'] = 'STALE'
+        return response
+    
+    def location_queryset(self, domain_id, category_ids, bbox, fields=(), category_mode=MATCH_ANY):
+        """Locations matching the filters in SQL, as named rows with the columns the fields need"""
+        return location_rows(self.matching_locations(domain_id, category_ids, bbox, category_mode), fields)
+    
+    def matching_locations(self, domain_id, category_ids, bbox, category_mode=MATCH_ANY):
+        """Queryset of the locations matching the filters"""
+        
+        # Build query
+        query = Q()
+        
+        if domain_id:
+            query &= Q(categories__domain__domain_id=domain_id)
+        
+        if category_ids and category_mode == MATCH_ANY:
+            query &= Q(categories__category_id__in=category_ids)
+        
+        locations = HierarchicalLocation.objects.filter(query)
+        if bbox:
+            locations = locations.in_bbox(bbox)
+        if category_mode == MATCH_ALL:
+            for category_id in category_ids:
+                locations = locations.filter(categories__category_id=category_id)
+        
+        return locations.distinct()
+    
+    def iter_locations(self, domain_id, category_ids, bbox, fields=(), category_mode=MATCH_ANY,
+                       chunk_size=FEATURE_CHUNK_SIZE):
+        """
+        Yield the locations matching the filters, as named rows (see location_rows).
+        
+        Within a domain, membership comes from the in-memory CategoryIndex
+        instead of a through-table join: without a bbox locations are fetched
+        by primary key in chunks, with a bbox the viewport query is filtered
+        against the matching keys. Either way results are in pk order.
+        """
+        if not domain_id:
+            locations = self.location_queryset(domain_id, category_ids, bbox, fields, category_mode)
+            yield from locations.iterator(chunk_size=chunk_size)
+            return
+        
+        pks = get_category_index(domain_id).location_pks(category_ids, category_mode)
+        locations = HierarchicalLocation.objects.order_by('pk')
+        
+        if bbox:
+            members = set(pks)
+            in_bbox = location_rows(locations.in_bbox(bbox), fields)
+            for location in in_bbox.iterator(chunk_size=chunk_size):
+                if location.pk in members:
+                    yield location
+            return
+        
+        locations = location_rows(locations, fields)
+        for start in range(0, len(pks), chunk_size):
+            yield from locations.filter(pk__in=pks[start:start + chunk_size])
+    
+    def iter_location_chunks(self, locations, chunk_size=FEATURE_CHUNK_SIZE):
+        """
+        Yield (locations, memberships) per chunk of locations, where memberships
+        maps a location pk to its (category_id, name, color, icon) rows in
+        display order. Categories are loaded with one through-table query per chunk.
+        """
+        chunk = []
+        for location in locations:
+            chunk.append(location)
+            if len(chunk) >= chunk_size:
+                yield chunk, self._load_memberships(chunk)
+                chunk = []
+        if chunk:
+            yield chunk, self._load_memberships(chunk)
+    
+    def _load_memberships(self, locations):
+        through = HierarchicalLocation.categories.through
+        rows = through.objects.filter(
+            hierarchicallocation_id__in=[location.pk for location in locations]
+        ).order_by(
+            'hierarchicalcategory__display_order', 'hierarchicalcategory__name'
+        ).values_list(
+            'hierarchicallocation_id', 'hierarchicalcategory__category_id',
+            'hierarchicalcategory__name', 'hierarchicalcategory__color', 'hierarchicalcategory__icon'
+        )
+        
+        memberships = {}
+        for location_pk, *category in rows:
+            memberships.setdefault(location_pk, []).append(category)
+        return memberships
+    
+    def iter_feature_chunks(self, locations, fields=(), chunk_size=FEATURE_CHUNK_SIZE):
+        """Yield lists of GeoJSON features, one list per chunk of locations"""
+        category_details = 'category_details' in fields
+        for chunk, memberships in self.iter_location_chunks(locations, chunk_size):
+            yield self._build_features(chunk, memberships, fields, category_details)
+    
+    def _build_features(self, locations, memberships, fields, category_details):
         features = []
         for location in locations:
-            # Get location categories
-            location_categories = []
-            for category in location.categories.all():
-                location_categories.append({
-                    'id': category.category_id,
-                    'name': category.name,
-                    'color': category.color or '#3388ff',
-                    'icon': category.icon or 'Category'
-                })
+            rows = memberships.get(location.pk, [])
+            if category_details:
+                location_categories = [
+                    {
+                        'id': category_id,
+                        'name': name,
+                        'color': color or '#3388ff',
+                        'icon': icon or 'Category'
+                    }
+                    for category_id, name, color, icon in rows
+                ]
+            else:
+                location_categories = [category_id for category_id, *_ in rows]
+            
+            properties = {
+                'id': location.location_id,
+                'name': location.name,
+                'categories': location_categories,
+            }
+            if category_details:
+                properties['category'] = location_categories[0] if location_categories else None
+            properties.update(location_properties(location, fields))
             
-            # Create feature
-            feature = {
+            features.append({
                 'type': 'Feature',
                 'geometry': {
                     'type': 'Point',
-                    'coordinates': [float(location.longitude), float(location.latitude)]
+                    'coordinates': [location.lng, location.lat]
                 },
-                'properties': {
-                    'id': location.location_id,
-                    'name': location.name,
-                    'address': location.full_address,  # Use the full_address property
-                    'street': location.street,
-                    'city': location.city,
-                    'postal_code': location.postal_code,
-                    'country': location.country,
-                    'phone': location.phone,
-                    'email': location.email,
-                    'website': location.website,
-                    'categories': location_categories,
-                    'category': location_categories[0] if location_categories else None,
-                    'raw_data': location.raw_data
-                }
-            }
-            features.append(feature)
+                'properties': properties
+            })
+        return features
+    
+    def build_meta(self, domain_id, category_ids, bbox, zoom, fields, total, category_mode=MATCH_ANY):
+        return {
+            'total_locations': total,
+            'domain_id': domain_id,
+            'categories_requested': category_ids,
+            'category_mode': category_mode,
+            'bbox': list(bbox) if bbox else None,
+            'zoom': zoom,
+            'fields': fields
+        }
+    
+    def build_facets(self, domain_id, category_ids, bbox, category_mode, facets):
+        locations = self.matching_locations(domain_id, category_ids, bbox, category_mode)
+        return facet_counts(locations, facets, domain_id)
+    
+    def build_geojson(self, domain_id, category_ids, bbox, zoom, fields=(), category_mode=MATCH_ANY, facets=()):
+        """Query locations and build the GeoJSON FeatureCollection dict"""
+        locations = self.iter_locations(domain_id, category_ids, bbox, fields, category_mode)
+        features = [
+            feature
+            for chunk in self.iter_feature_chunks(locations, fields)
+            for feature in chunk
+        ]
         
-        # Return GeoJSON
         geojson = {
             'type': 'FeatureCollection',
             'features': features,
-            'meta': {
-                'total_locations': len(features),
-                'domain_id': domain_id,
-                'categories_requested': category_ids
-            }
+            'meta': self.build_meta(
+                domain_id, category_ids, bbox, zoom, fields, len(features), category_mode
+            )
         }
+        if facets:
+            geojson['facets'] = self.build_facets(domain_id, category_ids, bbox, category_mode, facets)
+        return geojson
+    
+    def build_columnar(self, domain_id, category_ids, bbox, zoom, fields=(), category_mode=MATCH_ANY, facets=()):
+        """
+        Query locations and build the compact columnar payload (see maps.columnar).
+        The category dictionary always carries full category details.
+        """
+        locations = self.iter_locations(domain_id, category_ids, bbox, fields, category_mode)
+        property_fields = [field for field in fields if field != 'category_details']
+        builder = ColumnarBuilder(property_fields)
         
-        return JsonResponse(geojson)
+        for chunk, memberships in self.iter_location_chunks(locations):
+            for location in chunk:
+                category_indexes = [
+                    builder.category_index(category_id, {
+                        'id': category_id,
+                        'name': name,
+                        'color': color or '#3388ff',
+                        'icon': icon or 'Category'
+                    })
+                    for category_id, name, color, icon in memberships.get(location.pk, [])
+                ]
+                builder.add(
+                    location.location_id, location.name, location.lat, location.lng,
+                    category_indexes, location_properties(location, property_fields)
+                )
+        
+        payload = builder.payload(
+            meta=self.build_meta(
+                domain_id, category_ids, bbox, zoom, fields, len(builder), category_mode
+            )
+        )
+        if facets:
+            payload['facets'] = self.build_facets(domain_id, category_ids, bbox, category_mode, facets)
+        return payload
+    
+    def stream_geojson(self, domain_id, category_ids, bbox, zoom, fields=(), category_mode=MATCH_ANY,
+                       facets=(), chunk_size=FEATURE_CHUNK_SIZE):
+        """
+        Yield the FeatureCollection as bytes, one piece per chunk of locations.
+        Peak memory stays at one chunk; meta (and facets) come last since
+        meta holds the total.
+        """
+        locations = self.iter_locations(domain_id, category_ids, bbox, fields, category_mode)
+        encoder = DjangoJSONEncoder()
+        
+        yield b'{"type": "FeatureCollection", "features": ['
+        total = 0
+        for features in self.iter_feature_chunks(locations, fields, chunk_size):
+            prefix = ', ' if total else ''
+            total += len(features)
+            yield (prefix + ', '.join(encoder.encode(feature) for feature in features)).encode('utf-8')
+        
+        meta = self.build_meta(domain_id, category_ids, bbox, zoom, fields, total, category_mode)
+        tail = '], "meta": ' + encoder.encode(meta)
+        if facets:
+            facet_data = self.build_facets(domain_id, category_ids, bbox, category_mode, facets)
+            tail += ', "facets": ' + encoder.encode(facet_data)
+        yield (tail + '}').encode('utf-8')
+
+@method_decorator(use_read_database, name='get')
+@method_decorator(cached_response('location-detail', all_domain_scopes), name='get')
+class LocationDetailAPI(View):
+    """Full record of one location, loaded on demand by map popups"""
+    
+    def get(self, request, location_id):
+        if not HierarchicalLocation:
+            return JsonResponse({'error': 'Location model not available'}, status=500)
+        
+        locations = HierarchicalLocation.objects.filter(location_id=location_id)
+        
+        domain_id = request.GET.get('domain')
+        if domain_id:
+            locations = locations.filter(domain_memberships__domain__domain_id=domain_id)
+        
+        location = locations.select_related('raw').prefetch_related('categories__domain').first()
+        if location is None:
+            return JsonResponse({'error': 'Location not found'}, status=404)
+        
+        location_categories = []
+        for category in location.categories.all():
+            payload = category_payload(category)
+            payload['domain_id'] = category.domain.domain_id
+            location_categories.append(payload)
+        
+        properties = {
+            'id': location.location_id,
+            'name': location.name,
+            **location_properties(location, parse_fields('all')),
+            'categories': location_categories,
+            'category': location_categories[0] if location_categories else None,
+            'verified': location.verified,
+            'raw_data': location.raw_data,
+        }
+        
+        return JsonResponse({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [float(location.longitude), float(location.latitude)]
+            },
+            'properties': properties
+        })
 
+@use_read_database
+@cached_response('search', domain_scopes)
 @require_http_methods(["GET"])
 def search_locations_api(request):
-    """Search locations by name or address"""
+    """
+    Full-text search (name, address, city, postal code, category names), best match first
+    facets=category,city,domain (or facets=all) adds counts over every match,
+    not just the returned page (see maps.facets).
+    """
     
     if not HierarchicalLocation:
         return JsonResponse({'error': 'Location model not available'}, status=500)
     
     query = request.GET.get('q', '').strip()
     domain_id = request.GET.get('domain')
-    limit = int(request.GET.get('limit', 20))
+    try:
+        limit = max(0, min(int(request.GET.get('limit', 20)), MAX_SEARCH_RESULTS))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    try:
+        facets = parse_facets(request.GET.get('facets'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     
     if not query:
         return JsonResponse({'locations': []})
     
-    # Build search query
-    search_query = Q(name__icontains=query) | Q(address__icontains=query)
-    
+    # Best BM25 match first (see maps.search)
+    locations = HierarchicalLocation.objects.search(query).filter(is_active=True)
     if domain_id:
-        search_query &= Q(categories__domain_id=domain_id)
+        # One membership row per location and domain, so no DISTINCT needed
+        locations = locations.filter(domain_memberships__domain__domain_id=domain_id)
+    matches = locations
     
-    locations = HierarchicalLocation.objects.filter(
-        search_query
-    ).distinct().prefetch_related('categories')[:limit]
+    locations = locations.defer('latitude', 'longitude').float_coordinates().prefetch_related(
+        Prefetch('categories', queryset=HierarchicalCategory.objects.only(
+            'domain', 'category_id', 'name', 'color', 'icon', 'display_order'
+        ))
+    )[:limit]
     
     location_list = []
     for location in locations:
-        categories = list(location.categories.values('category_id', 'name', 'color', 'icon'))
+        categories = [
+            {'category_id': c.category_id, 'name': c.name, 'color': c.color, 'icon': c.icon}
+            for c in location.categories.all()
+        ]
         
         location_list.append({
             'location_id': location.location_id,
             'name': location.name,
-            'address': location.address,
-            'latitude': location.latitude,
-            'longitude': location.longitude,
+            'address': location.full_address,
+            'latitude': location.lat,
+            'longitude': location.lng,
             'phone': location.phone,
             'email': location.email,
             'website': location.website,
             'categories': categories
         })
     
-    return JsonResponse({
+    data = {
         'locations': location_list,
         'query': query,
         'total_found': len(location_list)
-    })
+    }
+    if facets:
+        data['facets'] = facet_counts(matches, facets, domain_id)
+    return JsonResponse(data)
+
+@use_read_database
+@cached_response('autocomplete', domain_scopes)
+@require_http_methods(["GET"])
+def autocomplete_api(request):
+    """
+    Suggestions for a search box: location names, cities and postal codes
+    starting with what was typed, then spellings one typo away.
+    Params: domain (required), q, limit (default 10)
+    """
+    
+    domain_id = request.GET.get('domain')
+    if not domain_id:
+        return JsonResponse({'error': 'domain parameter is required'}, status=400)
+    
+    try:
+        limit = min(int(request.GET.get('limit', 10)), AUTOCOMPLETE_MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    
+    query = request.GET.get('q', '').strip()
+    suggestions = get_autocomplete_index(domain_id).complete(query, limit) if query and limit > 0 else []
+    
+    return JsonResponse({'query': query, 'suggestions': suggestions})
 
+@use_read_database
+@versioned_etag(all_domain_scopes)
+@cached_response('domains', all_domain_scopes, stale=True)
 @require_http_methods(["GET"])
 def domain_list_api(request):
     """Simple API to list all domains"""
@@ -211,10 +678,7 @@ def domain_list_api(request):
     if not Domain:
         return JsonResponse({'error': 'Domain model not available'}, status=500)
     
-    domains = Domain.objects.annotate(
-        category_count=Count('categories'),
-        location_count=Count('categories__locations')
-    ).order_by('name')
+    domains = Domain.objects.order_by('name')
     
     domain_list = []
     for domain in domains:
@@ -230,6 +694,9 @@ def domain_list_api(request):
     
     return JsonResponse({'domains': domain_list})
 
+@use_read_database
+@versioned_etag(domain_scopes)
+@cached_response('categories', domain_scopes, stale=True)
 @require_http_methods(["GET"])
 def category_list_api(request):
     """API to list categories for a domain"""
@@ -239,9 +706,7 @@ def category_list_api(request):
     
     domain_id = request.GET.get('domain')
     
-    categories = HierarchicalCategory.objects.annotate(
-        location_count=Count('locations')
-    )
+    categories = HierarchicalCategory.objects.all()
     
     if domain_id:
         categories = categories.filter(domain__domain_id=domain_id)
@@ -261,6 +726,189 @@ def category_list_api(request):
     
     return JsonResponse({'categories': category_list})
 
+@use_read_database
+@cached_response('clusters', domain_scopes)
+@require_http_methods(["GET"])
+def cluster_api(request):
+    """
+    Zoom-aware marker clusters for a domain
+
+    Up to CLUSTER_MAX_ZOOM returns pre-aggregated cluster centroids with
+    counts and per-category breakdowns; above it returns individual locations.
+    Params: domain (required), z, bbox=minLng,minLat,maxLng,maxLat
+    """
+    
+    if not Domain:
+        return JsonResponse({'error': 'Domain model not available'}, status=500)
+    
+    domain_id = request.GET.get('domain')
+    if not domain_id:
+        return JsonResponse({'error': 'domain parameter is required'}, status=400)
+    
+    try:
+        zoom = parse_zoom(request.GET.get('z', 0))
+        bbox = parse_bbox(request.GET['bbox']) if request.GET.get('bbox') else None
+    except ValueError as e:
+        return JsonResponse({'error': f'Invalid viewport: {e}'}, status=400)
+    
+    domain = get_object_or_404(Domain, domain_id=domain_id)
+    # Read only: the cells are rebuilt where the data changes (maps.signals).
+    # A domain whose cells were never built gets its individual locations.
+    clustered = zoom <= CLUSTER_MAX_ZOOM and has_cluster_index(domain)
+    
+    features = []
+    if clustered:
+        cells = cluster_cells(domain, zoom, bbox).values_list(
+            'latitude', 'longitude', 'count', 'category_counts'
+        )
+        for latitude, longitude, count, category_counts in cells:
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                'properties': {
+                    'cluster': True,
+                    'count': count,
+                    'categories': category_counts,
+                }
+            })
+    else:
+        locations = domain.memberships.filter(location__is_active=True)
+        if bbox:
+            locations = locations.filter(
+                location__in=HierarchicalLocation.objects.in_bbox(bbox).values('pk')
+            )
+        
+        rows = locations.annotate(**float_coordinates('location__')).values_list(
+            'location__location_id', 'location__name', 'lat', 'lng', 'category_ids'
+        ).order_by('location__name')
+        
+        for location_id, name, lat, lng, category_ids in rows:
+            features.append({
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [lng, lat]
+                },
+                'properties': {
+                    'cluster': False,
+                    'id': location_id,
+                    'name': name,
+                    'categories': category_ids,
+                }
+            })
+    
+    return JsonResponse({
+        'type': 'FeatureCollection',
+        'features': features,
+        'meta': {
+            'domain_id': domain_id,
+            'zoom': zoom,
+            'bbox': list(bbox) if bbox else None,
+            'clustered': clustered,
+            'cluster_max_zoom': CLUSTER_MAX_ZOOM,
+        }
+    })
+
+@use_read_database
+@cached_response('nearby', domain_scopes)
+@require_http_methods(["GET"])
+def nearby_api(request):
+    """
+    Locations of a domain closest to a point, nearest first
+    Params: domain, lat, lng (required), k (default 10 without radius_km),
+    radius_km, categories, category_mode, fields (as for HierarchicalLocationsAPI).
+    With radius_km alone every location within the radius is returned, with
+    both the k nearest within it. Features carry distance_km.
+    """
+    
+    if not all([Domain, HierarchicalLocation]):
+        return JsonResponse({'error': 'Hierarchical models not available'}, status=500)
+    
+    domain_id = request.GET.get('domain')
+    if not domain_id:
+        return JsonResponse({'error': 'domain parameter is required'}, status=400)
+    
+    try:
+        lat = float(request.GET['lat'])
+        lng = float(request.GET['lng'])
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError('lat must be between -90 and 90, lng between -180 and 180')
+        radius_km = float(request.GET['radius_km']) if request.GET.get('radius_km') else None
+        if radius_km is not None and not (math.isfinite(radius_km) and radius_km > 0):
+            raise ValueError('radius_km must be a positive number')
+        k = int(request.GET['k']) if request.GET.get('k') else (10 if radius_km is None else None)
+        if k is not None and not 1 <= k <= MAX_NEARBY_RESULTS:
+            raise ValueError(f'k must be between 1 and {MAX_NEARBY_RESULTS}')
+    except KeyError as e:
+        return JsonResponse({'error': f'{e.args[0]} parameter is required'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': f'Invalid point: {e}'}, status=400)
+    
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    category_mode = request.GET.get('category_mode', MATCH_ANY)
+    if category_mode not in MATCH_MODES:
+        return JsonResponse({'error': f'Unknown category_mode: {category_mode}'}, status=400)
+    category_ids = parse_category_ids(request.GET)
+    
+    get_object_or_404(Domain, domain_id=domain_id)
+    nearest = get_nearby_index(domain_id).nearest(lat, lng, k, radius_km, category_ids, category_mode)
+    
+    # Rows come back in pk order, features go out in distance order
+    rows = {}
+    locations = location_rows(HierarchicalLocation.objects.all(), fields)
+    for start in range(0, len(nearest), FEATURE_CHUNK_SIZE):
+        pks = [pk for pk, _ in nearest[start:start + FEATURE_CHUNK_SIZE]]
+        rows.update((location.pk, location) for location in locations.filter(pk__in=pks))
+    located = [(rows[pk], distance) for pk, distance in nearest if pk in rows]
+    
+    features = []
+    for chunk in HierarchicalLocationsAPI().iter_feature_chunks((row for row, _ in located), fields):
+        features.extend(chunk)
+    for feature, (_, distance) in zip(features, located):
+        feature['properties']['distance_km'] = round(distance, 3)
+    
+    return JsonResponse({
+        'type': 'FeatureCollection',
+        'features': features,
+        'meta': {
+            'domain_id': domain_id,
+            'center': [lng, lat],
+            'k': k,
+            'radius_km': radius_km,
+            'categories': category_ids,
+            'category_mode': category_mode,
+            'total': len(features),
+        }
+    })
+
+@use_read_database
+@require_http_methods(["GET"])
+def vector_tile_api(request, z, x, y):
+    """
+    Mapbox Vector Tile of a domain's locations
+    One point layer per category; tiles are cached on disk per data version.
+    """
+    
+    if not Domain:
+        return JsonResponse({'error': 'Domain model not available'}, status=500)
+    
+    domain_id = request.GET.get('domain')
+    if not domain_id:
+        return JsonResponse({'error': 'domain parameter is required'}, status=400)
+    
+    if z > MAX_ZOOM or x >= (1 << z) or y >= (1 << z):
+        return JsonResponse({'error': 'Tile coordinates out of range'}, status=404)
+    
+    domain = get_object_or_404(Domain, domain_id=domain_id)
+    
+    response = HttpResponse(get_tile(domain, z, x, y), content_type=MVT_CONTENT_TYPE)
+    response['Cache-Control'] = 'public, max-age=300'
+    return response
+
 # Legacy compatibility functions
 def hierarchical_map(request):
     """Function-based view wrapper for compatibility"""
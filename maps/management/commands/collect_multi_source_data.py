@@ -2,6 +2,7 @@
 Django management command to collect data from multiple sources
 """
 
+from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 import sys
@@ -12,6 +13,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from data_collectors.data_manager import DataCollectionManager
 from maps.models import Category, Location
+from maps.warmup import process_local_cache
 import json
 
 class Command(BaseCommand):
@@ -78,6 +80,7 @@ class Command(BaseCommand):
             )
         else:
             self.import_to_database(manager, options['clear_existing'])
+            self.warm_map_cache()
         
     def show_available_sources(self, manager):
         """Show available data sources"""
@@ -190,6 +193,17 @@ class Command(BaseCommand):
             self.style.SUCCESS(f'\n✓ Successfully imported {stats["locations_created"] + stats["locations_updated"]} locations')
         )
     
+    def warm_map_cache(self):
+        """Build the legacy map payloads now instead of on the first request"""
+        if process_local_cache():
+            self.stdout.write('\n[CACHE] Warm-up skipped: the cache backend is per process (locmem)')
+            return
+        self.stdout.write('\n[CACHE] Warming map cache...')
+        try:
+            call_command('warm_map_cache', legacy_only=True, stdout=self.stdout)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'[WARNING] Map cache warm-up failed: {e}'))
+    
     def get_category_color(self, category_name):
         """Get color for category based on name"""
         color_mapping = {
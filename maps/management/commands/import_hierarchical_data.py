@@ -5,11 +5,14 @@ Usage: python manage.py import_hierarchical_data <source_id> [options]
 
 import json
 import os
+from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.utils import timezone
+from maps.signals import batch_version_bumps
+from maps.warmup import process_local_cache
 from maps.hierarchical_models import (
-    Domain, HierarchicalCategory, HierarchicalLocation, DataImportLog
+    ClusterCell, Domain, HierarchicalCategory, HierarchicalLocation, DataImportLog, DataVersion
 )
 
 class Command(BaseCommand):
@@ -81,7 +84,8 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING('🔍 DRY RUN MODE - No changes will be made'))
         
         try:
-            with transaction.atomic():
+            # One data version bump per domain instead of one per saved row
+            with batch_version_bumps(), transaction.atomic():
                 result = self._import_data(data, mode, dry_run, batch_size)
                 
                 if dry_run:
@@ -98,6 +102,9 @@ class Command(BaseCommand):
         self._display_results(result, dry_run)
         
         if not dry_run:
+            self._report_cluster_index(data['domain_id'])
+            self.stdout.write(f"🔖 Data version: {DataVersion.current(data['domain_id'])}")
+            self._warm_map_cache(data['domain_id'])
             self.stdout.write(
                 self.style.SUCCESS(f'🎉 Import completed successfully!')
             )
@@ -257,7 +264,6 @@ class Command(BaseCommand):
                 'website': location_data['contact'].get('website', ''),
                 'source_name': location_data['metadata'].get('source', ''),
                 'detail_url': location_data['metadata'].get('detail_url', ''),
-                'raw_data': location_data
             }
             
             if not dry_run:
@@ -271,6 +277,7 @@ class Command(BaseCommand):
                         for key, value in location_info.items():
                             setattr(existing_location, key, value)
                         existing_location.save()
+                        existing_location.store_raw_data(location_data)
                         
                         # Add to category if not already associated
                         existing_location.categories.add(category)
@@ -279,6 +286,7 @@ class Command(BaseCommand):
                 else:
                     # Create new location
                     location = HierarchicalLocation.objects.create(**location_info)
+                    location.store_raw_data(location_data)
                     location.categories.add(category)
                     stats['locations_created'] += 1
                     stats['associations_created'] += 1
@@ -294,6 +302,21 @@ class Command(BaseCommand):
                     stats['locations_created'] += 1
                 stats['associations_created'] += 1
     
+    def _report_cluster_index(self, domain_id):
+        """The marker clusters were rebuilt when batch_version_bumps exited"""
+        cell_count = ClusterCell.objects.filter(domain__domain_id=domain_id).count()
+        self.stdout.write(f"🗺️ Cluster index rebuilt: {cell_count} cells")
+    
+    def _warm_map_cache(self, domain_id):
+        """Build the domain's API payloads now instead of on the first request"""
+        if process_local_cache():
+            self.stdout.write('🔥 Map cache warm-up skipped: the cache backend is per process (locmem)')
+            return
+        try:
+            call_command('warm_map_cache', domain_ids=[domain_id], stdout=self.stdout)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'⚠️ Map cache warm-up failed: {e}'))
+    
     def _get_category_color(self, category_id):
         """Get color for category"""
         colors = [
@@ -0,0 +1,50 @@
+"""
+Django Management Command to rebuild the denormalized domain memberships
+and recompute the location counters
+Usage: python manage.py recount_locations [domain_id ...]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from maps.counters import recount_domain
+from maps.memberships import rebuild_domain
+from maps.hierarchical_models import Domain
+from maps.signals import bump_domains
+
+
+class Command(BaseCommand):
+    help = 'Rebuild domain memberships and recount active categories/locations (repairs drift)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'domain_ids',
+            nargs='*',
+            help='Domains to recount (default: all domains)'
+        )
+
+    def handle(self, *args, **options):
+        domains = Domain.objects.order_by('domain_id')
+        if options['domain_ids']:
+            domains = domains.filter(domain_id__in=options['domain_ids'])
+            missing = set(options['domain_ids']) - set(domains.values_list('domain_id', flat=True))
+            if missing:
+                raise CommandError(f"Unknown domains: {', '.join(sorted(missing))}")
+
+        for domain in domains:
+            before = (domain.category_count, domain.location_count)
+            rebuild_domain(domain.pk)
+            recount_domain(domain.pk)
+            domain.refresh_from_db(fields=['category_count', 'location_count'])
+            after = (domain.category_count, domain.location_count)
+
+            if before == after:
+                status = 'unchanged'
+            else:
+                status = f'was {before[0]} categories / {before[1]} locations'
+            # Rebuilt memberships may differ even when the counts do not
+            bump_domains([domain.domain_id])
+            self.stdout.write(
+                f"🔢 {domain.domain_id}: {after[0]} categories, {after[1]} locations ({status})"
+            )
+
+        self.stdout.write(self.style.SUCCESS('Counters recounted'))
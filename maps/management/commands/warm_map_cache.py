@@ -0,0 +1,71 @@
+"""
+Django Management Command to precompute the cached map payloads
+Usage: python manage.py warm_map_cache [--domain domain_id ...] [--legacy-only]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from maps.hierarchical_models import Domain
+from maps.warmup import process_local_cache, warm_map_cache
+
+
+def format_size(size, unit):
+    if unit != 'bytes':
+        return f'{size} {unit}'
+    if size < 1024:
+        return f'{size} B'
+    if size < 1024 * 1024:
+        return f'{size / 1024:.1f} KB'
+    return f'{size / 1024 / 1024:.1f} MB'
+
+
+class Command(BaseCommand):
+    help = 'Build and cache the hot map API payloads of the current data versions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--domain',
+            action='append',
+            dest='domain_ids',
+            help='Only warm this domain (repeatable); skips the legacy map data'
+        )
+        parser.add_argument(
+            '--legacy-only',
+            action='store_true',
+            help='Only warm the legacy map data (Location/Category models)'
+        )
+
+    def handle(self, *args, **options):
+        domain_ids = options['domain_ids']
+        if domain_ids:
+            missing = set(domain_ids) - set(
+                Domain.objects.filter(domain_id__in=domain_ids).values_list('domain_id', flat=True)
+            )
+            if missing:
+                raise CommandError(f"Unknown domains: {', '.join(sorted(missing))}")
+
+        if process_local_cache():
+            self.stdout.write(self.style.WARNING(
+                'The cache backend is per process (locmem): other processes do not see these payloads'
+            ))
+
+        started = time.perf_counter()
+        total = count = 0
+        for artifact in warm_map_cache(
+            domain_ids=domain_ids,
+            hierarchical=not options['legacy_only'],
+            legacy=not domain_ids,
+        ):
+            if artifact.unit == 'bytes':
+                count += 1
+                total += artifact.size
+            self.stdout.write(
+                f'  {artifact.name:<56} {artifact.seconds * 1000:>9.1f} ms '
+                f'{format_size(artifact.size, artifact.unit):>14}'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Warmed {count} payloads ({format_size(total, "bytes")}) in {time.perf_counter() - started:.2f} s'
+        ))
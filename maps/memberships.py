@@ -0,0 +1,53 @@
+"""
+Denormalized DomainMembership rows, derived from the location/category m2m
+Rewritten per location from the signal handlers in maps.signals; bulk
+imports rebuild the touched domains once instead (see batch_version_bumps),
+and ``manage.py recount_locations`` rebuilds every domain.
+"""
+
+from django.db import transaction
+
+from .hierarchical_models import DomainMembership, HierarchicalLocation
+
+LocationCategory = HierarchicalLocation.categories.through
+
+# Locations per query (kept below SQLite's historical limit of 999 parameters)
+CHUNK_SIZE = 900
+
+
+def _build_rows(memberships):
+    """DomainMembership objects from through rows, one per (domain, location)"""
+    rows = memberships.order_by('hierarchicalcategory_id').values_list(
+        'hierarchicalcategory__domain_id', 'hierarchicallocation_id', 'hierarchicalcategory__category_id'
+    )
+
+    grouped = {}
+    for domain_pk, location_pk, category_id in rows.iterator(chunk_size=2000):
+        grouped.setdefault((domain_pk, location_pk), []).append(category_id)
+    return [
+        DomainMembership(domain_id=domain_pk, location_id=location_pk, category_ids=category_ids)
+        for (domain_pk, location_pk), category_ids in grouped.items()
+    ]
+
+
+def refresh_locations(location_pks):
+    """Rewrite the membership rows of the given locations"""
+    location_pks = list(set(location_pks))
+    with transaction.atomic():
+        for start in range(0, len(location_pks), CHUNK_SIZE):
+            chunk = location_pks[start:start + CHUNK_SIZE]
+            DomainMembership.objects.filter(location_id__in=chunk).delete()
+            DomainMembership.objects.bulk_create(
+                _build_rows(LocationCategory.objects.filter(hierarchicallocation_id__in=chunk)),
+                batch_size=1000
+            )
+
+
+def rebuild_domain(domain_pk):
+    """Rewrite every membership row of a domain"""
+    with transaction.atomic():
+        DomainMembership.objects.filter(domain_id=domain_pk).delete()
+        DomainMembership.objects.bulk_create(
+            _build_rows(LocationCategory.objects.filter(hierarchicalcategory__domain_id=domain_pk)),
+            batch_size=1000
+        )
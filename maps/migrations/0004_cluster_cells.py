@@ -0,0 +1,33 @@
+# Generated by Django 4.2.25 on 2026-10-17 00:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0003_remove_hierarchicalcategory_unique_category_per_domain_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClusterCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('cell_x', models.IntegerField()),
+                ('cell_y', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('latitude', models.FloatField(help_text='Centroid latitude')),
+                ('longitude', models.FloatField(help_text='Centroid longitude')),
+                ('category_counts', models.JSONField(default=dict, help_text='Location count per category_id')),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cluster_cells', to='maps.domain')),
+            ],
+            options={
+                'verbose_name': 'Cluster Cell',
+                'verbose_name_plural': 'Cluster Cells',
+                'indexes': [models.Index(fields=['domain', 'zoom', 'cell_x', 'cell_y'], name='maps_cluste_domain__992588_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.25 on 2026-10-17 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0005_data_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dataversion',
+            name='scope',
+            field=models.CharField(help_text='Domain ID or special scope', max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.25 on 2026-10-17 00:41
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_locations(apps, schema_editor):
+    Domain = apps.get_model('maps', 'Domain')
+    HierarchicalCategory = apps.get_model('maps', 'HierarchicalCategory')
+    HierarchicalLocation = apps.get_model('maps', 'HierarchicalLocation')
+
+    categories = HierarchicalCategory.objects.annotate(
+        active_locations=Count('locations', filter=Q(locations__is_active=True))
+    )
+    for category_pk, count in categories.values_list('pk', 'active_locations'):
+        HierarchicalCategory.objects.filter(pk=category_pk).update(location_count=count)
+
+    for domain in Domain.objects.all():
+        domain.location_count = HierarchicalLocation.objects.filter(
+            categories__domain=domain, is_active=True
+        ).distinct().count()
+        domain.category_count = HierarchicalCategory.objects.filter(domain=domain, is_active=True).count()
+        domain.save(update_fields=['location_count', 'category_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0006_data_version_scopes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='category_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Active categories'),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='location_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Active locations'),
+        ),
+        migrations.AddField(
+            model_name='hierarchicalcategory',
+            name='location_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Active locations'),
+        ),
+        migrations.RunPython(count_locations, migrations.RunPython.noop),
+    ]
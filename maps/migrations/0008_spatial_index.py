@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# Frozen copy of the maps.spatial DDL as of this migration. The runtime copy
+# is reinstalled after every migrate (MapsConfig.install_spatial_indexes).
+SPATIAL_TABLES = ('maps_hierarchicallocation', 'maps_location')
+
+
+def rtree_table(table):
+    return f'{table}_rtree'
+
+
+def spatial_index_sql(table):
+    rtree = rtree_table(table)
+    return [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, min_lat, max_lat, min_lng, max_lng)',
+        f'''CREATE TRIGGER IF NOT EXISTS {rtree}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {rtree} VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {rtree}_update AFTER UPDATE OF latitude, longitude ON {table} BEGIN
+            UPDATE {rtree} SET min_lat = new.latitude, max_lat = new.latitude,
+                min_lng = new.longitude, max_lng = new.longitude
+            WHERE id = new.id;
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {rtree}_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM {rtree} WHERE id = old.id;
+        END''',
+        f'''INSERT INTO {rtree}
+            SELECT id, latitude, latitude, longitude, longitude FROM {table}
+            WHERE id NOT IN (SELECT id FROM {rtree})''',
+        f'DELETE FROM {rtree} WHERE id NOT IN (SELECT id FROM {table})',
+    ]
+
+
+def create_spatial_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    existing = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for table in SPATIAL_TABLES:
+            if table in existing:
+                for statement in spatial_index_sql(table):
+                    cursor.execute(statement)
+
+
+def drop_spatial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in SPATIAL_TABLES:
+        rtree = rtree_table(table)
+        for suffix in ('insert', 'update', 'delete'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {rtree}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {rtree}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0007_location_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_spatial_indexes, drop_spatial_indexes),
+    ]
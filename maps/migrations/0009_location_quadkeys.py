@@ -0,0 +1,53 @@
+# Generated by Django 4.2.25 on 2026-10-17 01:20
+
+import math
+
+from django.db import migrations, models
+
+# Frozen copy of the maps.geo quadkey math as of this migration
+QUADKEY_ZOOM = 20
+MAX_MERCATOR_LAT = 85.0511287798
+
+
+def point_quadkey(lat, lng, zoom=QUADKEY_ZOOM):
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, float(lat)))
+    last = (1 << zoom) - 1
+    x = int((float(lng) + 180.0) / 360.0 * (1 << zoom))
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * (1 << zoom))
+    x, y = min(last, max(0, x)), min(last, max(0, y))
+    digits = []
+    for level in range(zoom, 0, -1):
+        mask = 1 << (level - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return ''.join(digits)
+
+
+def fill_quadkeys(apps, schema_editor):
+    for model_name in ('HierarchicalLocation', 'Location'):
+        model = apps.get_model('maps', model_name)
+        locations = [
+            model(pk=pk, quadkey=point_quadkey(latitude, longitude))
+            for pk, latitude, longitude in model.objects.values_list('pk', 'latitude', 'longitude')
+        ]
+        model.objects.bulk_update(locations, ['quadkey'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0008_spatial_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hierarchicallocation',
+            name='quadkey',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Tile quadkey of the coordinates, set on save()', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='quadkey',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Tile quadkey of the coordinates, set on save()', max_length=20),
+        ),
+        migrations.RunPython(fill_quadkeys, migrations.RunPython.noop),
+    ]
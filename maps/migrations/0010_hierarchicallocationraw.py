@@ -0,0 +1,52 @@
+# Generated by Django 4.2.25 on 2026-10-17 01:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_raw_data(apps, schema_editor):
+    HierarchicalLocation = apps.get_model('maps', 'HierarchicalLocation')
+    HierarchicalLocationRaw = apps.get_model('maps', 'HierarchicalLocationRaw')
+
+    rows = HierarchicalLocation.objects.exclude(raw_data=None).values_list('pk', 'raw_data')
+    batch = []
+    for location_pk, data in rows.iterator(chunk_size=2000):
+        batch.append(HierarchicalLocationRaw(location_id=location_pk, data=data))
+        if len(batch) >= 2000:
+            HierarchicalLocationRaw.objects.bulk_create(batch)
+            batch = []
+    HierarchicalLocationRaw.objects.bulk_create(batch)
+
+
+def restore_raw_data(apps, schema_editor):
+    HierarchicalLocation = apps.get_model('maps', 'HierarchicalLocation')
+    HierarchicalLocationRaw = apps.get_model('maps', 'HierarchicalLocationRaw')
+
+    for location_pk, data in HierarchicalLocationRaw.objects.values_list('location_id', 'data').iterator():
+        HierarchicalLocation.objects.filter(pk=location_pk).update(raw_data=data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0009_location_quadkeys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HierarchicalLocationRaw',
+            fields=[
+                ('location', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='raw', serialize=False, to='maps.hierarchicallocation')),
+                ('data', models.JSONField(help_text='Original raw data')),
+            ],
+            options={
+                'verbose_name': 'Hierarchical Location Raw Data',
+                'verbose_name_plural': 'Hierarchical Location Raw Data',
+            },
+        ),
+        migrations.RunPython(move_raw_data, restore_raw_data),
+        migrations.RemoveField(
+            model_name='hierarchicallocation',
+            name='raw_data',
+        ),
+    ]
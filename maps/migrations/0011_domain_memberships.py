@@ -0,0 +1,48 @@
+# Generated by Django 4.2.25 on 2026-10-17 02:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_memberships(apps, schema_editor):
+    HierarchicalLocation = apps.get_model('maps', 'HierarchicalLocation')
+    DomainMembership = apps.get_model('maps', 'DomainMembership')
+
+    rows = HierarchicalLocation.categories.through.objects.order_by('hierarchicalcategory_id').values_list(
+        'hierarchicalcategory__domain_id', 'hierarchicallocation_id', 'hierarchicalcategory__category_id'
+    )
+    grouped = {}
+    for domain_pk, location_pk, category_id in rows.iterator(chunk_size=2000):
+        grouped.setdefault((domain_pk, location_pk), []).append(category_id)
+    DomainMembership.objects.bulk_create(
+        [
+            DomainMembership(domain_id=domain_pk, location_id=location_pk, category_ids=category_ids)
+            for (domain_pk, location_pk), category_ids in grouped.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0010_hierarchicallocationraw'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category_ids', models.JSONField(default=list, help_text="category_id of each of the location's categories in the domain")),
+                ('domain', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='maps.domain')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='domain_memberships', to='maps.hierarchicallocation')),
+            ],
+            options={
+                'verbose_name': 'Domain Membership',
+                'verbose_name_plural': 'Domain Memberships',
+                'unique_together': {('domain', 'location')},
+            },
+        ),
+        migrations.RunPython(fill_memberships, migrations.RunPython.noop),
+    ]
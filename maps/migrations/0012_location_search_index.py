@@ -0,0 +1,103 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# Frozen copy of maps.search as of this migration: later changes to the
+# runtime index (columns, documents, normalization) must not change it.
+SEARCH_TABLES = ('maps_hierarchicallocation', 'maps_location')
+SEARCH_COLUMNS = ('name', 'address', 'city', 'postal_code', 'categories', 'description')
+CHUNK_SIZE = 900
+
+GERMAN_SPELLINGS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+WORD = re.compile(r'\w+')
+
+
+def fts_table(table):
+    return f'{table}_fts'
+
+
+def strip_accents(text):
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def index_text(text):
+    tokens = []
+    for word in WORD.findall(unicodedata.normalize('NFC', text or '').lower()):
+        normalized = strip_accents(word.translate(GERMAN_SPELLINGS))
+        tokens.append(normalized)
+        plain = strip_accents(word).replace('ß', 'ss')
+        if plain != normalized:
+            tokens.append(plain)
+    return ' '.join(tokens)
+
+
+def hierarchical_documents(apps, using):
+    model = apps.get_model('maps', 'HierarchicalLocation')
+    categories = {}
+    memberships = model.categories.through.objects.using(using).values_list(
+        'hierarchicallocation_id', 'hierarchicalcategory__name'
+    )
+    for pk, name in memberships.iterator(chunk_size=2000):
+        categories.setdefault(pk, []).append(name)
+
+    rows = model.objects.using(using).values_list('pk', 'name', 'street', 'city', 'postal_code', 'description')
+    for pk, name, street, city, postal_code, description in rows.iterator(chunk_size=2000):
+        yield pk, name, street, city, postal_code, ' '.join(categories.get(pk, ())), description
+
+
+def legacy_documents(apps, using):
+    model = apps.get_model('maps', 'Location')
+    rows = model.objects.using(using).values_list(
+        'pk', 'name', 'address', 'city', 'postal_code', 'category__name', 'description'
+    )
+    yield from rows.iterator(chunk_size=2000)
+
+
+DOCUMENT_BUILDERS = {
+    'maps_hierarchicallocation': hierarchical_documents,
+    'maps_location': legacy_documents,
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    existing = set(connection.introspection.table_names())
+    columns = ', '.join(SEARCH_COLUMNS)
+    placeholders = ', '.join(['%s'] * (len(SEARCH_COLUMNS) + 1))
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            if table not in existing:
+                continue
+            fts = fts_table(table)
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, tokenize = 'unicode61')")
+            cursor.execute(f'DELETE FROM {fts}')
+            documents = [
+                (pk, *(index_text(value) for value in values))
+                for pk, *values in DOCUMENT_BUILDERS[table](apps, connection.alias)
+            ]
+            for start in range(0, len(documents), CHUNK_SIZE):
+                cursor.executemany(
+                    f'INSERT INTO {fts}(rowid, {columns}) VALUES ({placeholders})',
+                    documents[start:start + CHUNK_SIZE]
+                )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in SEARCH_TABLES:
+        schema_editor.execute(f'DROP TABLE IF EXISTS {fts_table(table)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0011_domain_memberships'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
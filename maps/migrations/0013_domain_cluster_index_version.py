@@ -0,0 +1,18 @@
+# Generated by Django 4.2.25 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0012_location_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='cluster_index_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
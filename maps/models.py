@@ -1,9 +1,13 @@
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from .geo import QUADKEY_ZOOM, point_quadkey
+from .search import LocationManager
+
 # Import hierarchical models
 from .hierarchical_models import (
-    Domain, HierarchicalCategory, HierarchicalLocation, DataImportLog
+    Domain, HierarchicalCategory, HierarchicalLocation, HierarchicalLocationRaw, DomainMembership,
+    ClusterCell, DataVersion, DataImportLog
 )
 
 class Category(models.Model):
@@ -52,6 +56,13 @@ class Location(models.Model):
         validators=[MinValueValidator(-180), MaxValueValidator(180)],
         help_text='Longitude coordinate (-180 to 180)'
     )
+    quadkey = models.CharField(
+        max_length=QUADKEY_ZOOM,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text='Tile quadkey of the coordinates, set on save()'
+    )
     
     # Address information
     address = models.TextField()
@@ -87,6 +98,8 @@ class Location(models.Model):
         help_text='Link to hierarchical location if applicable'
     )
 
+    objects = LocationManager()
+
     class Meta:
         verbose_name = 'Location'
         verbose_name_plural = 'Locations'
@@ -96,12 +109,19 @@ class Location(models.Model):
             models.Index(fields=['latitude', 'longitude']),
         ]
 
+    def save(self, *args, **kwargs):
+        self.quadkey = point_quadkey(self.latitude, self.longitude)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} ({self.category.name})"
 
     @property
     def coordinates(self):
         """Return coordinates as [lat, lng] for JavaScript"""
+        if hasattr(self, 'lat'):
+            # Loaded through objects.float_coordinates()
+            return [self.lat, self.lng]
         return [float(self.latitude), float(self.longitude)]
 
 class MapConfiguration(models.Model):
@@ -0,0 +1,224 @@
+"""
+In-memory grid index for nearest-location and radius queries
+For each domain, the active locations are bucketed into CELL_DEGREES sized
+lat/lng cells. A k-nearest query scans rings of cells around the query
+point until no unscanned cell can hold a closer location; a radius query
+scans the cells of the circle's bounding box (see geo.radius_bbox).
+Candidates are ranked by the haversine term
+sin²(Δφ/2) + cos φ1 cos φ2 sin²(Δλ/2), which orders like the great-circle
+distance, with the per-location radians and cosines precomputed.
+
+Indexes are built lazily per process and keyed by the domain's DataVersion
+(like maps.category_index), so an import rebuilds them on next use.
+"""
+
+import heapq
+import math
+
+from .category_index import MATCH_ALL, MATCH_ANY
+from .geo import EARTH_RADIUS_KM, radius_bbox
+from .hierarchical_models import DataVersion, DomainMembership
+from .spatial import float_coordinates
+
+# ~11 km north-south; a few dozen locations per cell in dense regions
+CELL_DEGREES = 0.1
+GRID_COLUMNS = round(360 / CELL_DEGREES)
+GRID_ROWS = round(180 / CELL_DEGREES)
+
+_indexes = {}
+
+
+def cell_for(lat, lng):
+    """Grid cell (column, row) of a point; columns wrap at the antimeridian"""
+    column = int(math.floor((lng + 180.0) / CELL_DEGREES)) % GRID_COLUMNS
+    row = min(GRID_ROWS - 1, max(0, int(math.floor((lat + 90.0) / CELL_DEGREES))))
+    return column, row
+
+
+def haversine_term(radius_km):
+    """The ranking value of a distance (inverse of term_km)"""
+    if radius_km >= math.pi * EARTH_RADIUS_KM:
+        return 1.0
+    return math.sin(radius_km / (2 * EARTH_RADIUS_KM)) ** 2
+
+
+def term_km(term):
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, term)))
+
+
+def category_filter(category_ids, mode=MATCH_ANY):
+    """Predicate on a location's category ids, None when everything matches"""
+    if not category_ids:
+        return None
+    wanted = frozenset(category_ids)
+    if mode == MATCH_ALL:
+        return wanted.issubset
+    return lambda location_categories: not wanted.isdisjoint(location_categories)
+
+
+class NearbyIndex:
+    """Grid cell -> locations of one domain"""
+
+    def __init__(self, domain_id, version, points):
+        """``points``: (location pk, lat, lng, category ids) tuples"""
+        self.domain_id = domain_id
+        self.version = version
+        self.cells = {}
+        self.size = 0
+        for pk, lat, lng, category_ids in points:
+            if lat is None or lng is None:
+                continue
+            phi = math.radians(lat)
+            self.cells.setdefault(cell_for(lat, lng), []).append(
+                (pk, phi, math.radians(lng), math.cos(phi), tuple(category_ids))
+            )
+            self.size += 1
+
+    @classmethod
+    def build(cls, domain_id, version):
+        rows = DomainMembership.objects.filter(
+            domain__domain_id=domain_id, location__is_active=True
+        ).annotate(**float_coordinates('location__')).values_list('location_id', 'lat', 'lng', 'category_ids')
+        return cls(domain_id, version, rows.iterator(chunk_size=5000))
+
+    def nearest(self, lat, lng, k=None, radius_km=None, category_ids=(), mode=MATCH_ANY):
+        """
+        (location pk, distance in km) pairs, closest first: the ``k``
+        nearest locations, those within ``radius_km``, or the k nearest
+        within the radius. Category filtering works like CategoryIndex.match.
+        """
+        if k is None and radius_km is None:
+            raise ValueError('k or radius_km is required')
+        if k is not None and k < 1:
+            return []
+
+        search = _Search(lat, lng, k, radius_km, category_filter(category_ids, mode))
+        if k is None:
+            self._scan_radius(search)
+        else:
+            self._scan_rings(search)
+        return [(pk, term_km(term)) for term, pk in search.results()]
+
+    def _scan_radius(self, search):
+        min_lng, min_lat, max_lng, max_lat = radius_bbox(search.lat, search.lng, search.radius_km)
+        first_column, first_row = cell_for(min_lat, min_lng)
+        last_column, last_row = cell_for(max_lat, max_lng)
+        columns = (last_column - first_column) % GRID_COLUMNS + 1
+        if min_lng == -180.0 and max_lng == 180.0:
+            columns = GRID_COLUMNS
+
+        if columns * (last_row - first_row + 1) > len(self.cells):
+            # Fewer occupied cells than cells in the box
+            for (column, row), points in self.cells.items():
+                if first_row <= row <= last_row and (column - first_column) % GRID_COLUMNS < columns:
+                    search.scan(points)
+            return
+
+        for offset in range(columns):
+            column = (first_column + offset) % GRID_COLUMNS
+            for row in range(first_row, last_row + 1):
+                points = self.cells.get((column, row))
+                if points:
+                    search.scan(points)
+
+    def _scan_rings(self, search):
+        center_column, center_row = cell_for(search.lat, search.lng)
+        visited = set()
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 >= len(self.cells) or ring > max(GRID_COLUMNS // 2, GRID_ROWS):
+                # Cheaper to scan the remaining occupied cells than the rings
+                for cell, points in self.cells.items():
+                    if cell not in visited:
+                        search.scan(points)
+                return
+
+            for cell in ring_cells(center_column, center_row, ring):
+                if cell not in visited:
+                    visited.add(cell)
+                    points = self.cells.get(cell)
+                    if points:
+                        search.scan(points)
+
+            bound = ring_bound(search.lat, ring)
+            if bound > search.limit or (search.full() and bound >= search.worst()):
+                return
+            ring += 1
+
+
+def ring_cells(center_column, center_row, ring):
+    """Cells on the border of the square of ``ring`` cells around a center cell"""
+    for row in range(max(0, center_row - ring), min(GRID_ROWS - 1, center_row + ring) + 1):
+        if ring and abs(row - center_row) < ring:
+            offsets = (-ring, ring)
+        else:
+            offsets = range(-ring, ring + 1)
+        for offset in offsets:
+            yield (center_column + offset) % GRID_COLUMNS, row
+
+
+def ring_bound(lat, ring):
+    """
+    Lower bound of the haversine term of every point outside the cells of
+    ``ring`` around the cell of a point at ``lat``: at least ``ring`` cells
+    away north-south, or east-west at a latitude no closer to a pole than
+    the square reaches.
+    """
+    span = math.radians(ring * CELL_DEGREES)
+    north_south = math.sin(span / 2) ** 2
+    polemost = math.radians(min(90.0, abs(lat) + (ring + 1) * CELL_DEGREES))
+    east_west = (math.cos(polemost) * math.sin(min(span, math.pi) / 2)) ** 2
+    return min(north_south, east_west)
+
+
+class _Search:
+    """Best candidates of one query, kept as a max-heap of (-term, pk)"""
+
+    def __init__(self, lat, lng, k, radius_km, matches):
+        self.lat, self.lng = lat, lng
+        self.phi, self.lam, self.cos_phi = math.radians(lat), math.radians(lng), math.cos(math.radians(lat))
+        self.k = k
+        self.radius_km = radius_km
+        self.limit = haversine_term(radius_km) if radius_km is not None else 1.0
+        self.matches = matches
+        self.heap = []
+
+    def full(self):
+        return self.k is not None and len(self.heap) >= self.k
+
+    def worst(self):
+        return -self.heap[0][0]
+
+    def scan(self, points):
+        phi, lam, cos_phi, limit, k, matches = self.phi, self.lam, self.cos_phi, self.limit, self.k, self.matches
+        heap = self.heap
+        sin, push, replace = math.sin, heapq.heappush, heapq.heapreplace
+        for pk, point_phi, point_lam, point_cos, category_ids in points:
+            if matches is not None and not matches(category_ids):
+                continue
+            term = sin((point_phi - phi) / 2) ** 2 + cos_phi * point_cos * sin((point_lam - lam) / 2) ** 2
+            if term > limit:
+                continue
+            if k is None or len(heap) < k:
+                push(heap, (-term, pk))
+            elif term < -heap[0][0]:
+                replace(heap, (-term, pk))
+
+    def results(self):
+        """(term, pk) pairs, smallest first"""
+        return sorted((-negative, pk) for negative, pk in self.heap)
+
+
+def get_nearby_index(domain_id):
+    """Current NearbyIndex for a domain, rebuilt when its data version changes"""
+    version = DataVersion.current(domain_id)
+    index = _indexes.get(domain_id)
+    if index is not None and index.version == version:
+        return index
+
+    index = _indexes[domain_id] = NearbyIndex.build(domain_id, version)
+    return index
+
+
+def clear_nearby_indexes():
+    _indexes.clear()
@@ -0,0 +1,237 @@
+"""
+SQLite FTS5 full-text index for location models
+Each indexed table gets a ``<table>_fts`` FTS5 table with one document per
+row (rowid = row id): name, address, city, postal code, category names and
+description. Documents are normalized in Python (German spellings, see
+index_text()), so they cannot be kept in sync by triggers: the signal
+handlers in maps.signals rewrite them per location, and bulk imports
+rebuild the touched domains once (see batch_version_bumps).
+``objects.search()`` ranks matches with BM25 and falls back to icontains
+lookups on other databases.
+"""
+
+import re
+import unicodedata
+
+from django.db import connection, connections, models, transaction
+from django.db.models import Q
+
+from .spatial import SpatialQuerySet
+
+SEARCH_COLUMNS = ('name', 'address', 'city', 'postal_code', 'categories', 'description')
+# bm25() column weights, in SEARCH_COLUMNS order
+SEARCH_WEIGHTS = (10.0, 2.0, 4.0, 5.0, 3.0, 1.0)
+
+# Rows per query (kept below SQLite's historical limit of 999 parameters)
+CHUNK_SIZE = 900
+
+GERMAN_SPELLINGS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+WORD = re.compile(r'\w+')
+
+_available = {}
+
+
+def fts_table(table):
+    return f'{table}_fts'
+
+
+def _strip_accents(text):
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def _words(text):
+    return WORD.findall(unicodedata.normalize('NFC', text or '').lower())
+
+
+def normalize_word(word):
+    """München -> muenchen, Straße -> strasse, Café -> cafe"""
+    return _strip_accents(word.translate(GERMAN_SPELLINGS))
+
+
+def normalize_text(text):
+    """Words of ``text`` normalized and joined by single spaces"""
+    return ' '.join(normalize_word(word) for word in _words(text))
+
+
+def index_text(text):
+    """
+    Indexed form of a text: each word normalized, plus its plain ASCII
+    spelling where that differs (München -> "muenchen munchen"), so both
+    "Muenchen" and "Munchen" find it.
+    """
+    tokens = []
+    for word in _words(text):
+        normalized = normalize_word(word)
+        tokens.append(normalized)
+        plain = _strip_accents(word).replace('ß', 'ss')
+        if plain != normalized:
+            tokens.append(plain)
+    return ' '.join(tokens)
+
+
+def match_expression(text):
+    """FTS5 query matching every word of ``text`` as a prefix, None if it has no words"""
+    words = [normalize_word(word) for word in _words(text)]
+    if not words:
+        return None
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def _hierarchical_documents(model, pks):
+    categories = {}
+    memberships = model.categories.through.objects.filter(hierarchicallocation_id__in=pks).values_list(
+        'hierarchicallocation_id', 'hierarchicalcategory__name'
+    )
+    for pk, name in memberships:
+        categories.setdefault(pk, []).append(name)
+
+    rows = model._default_manager.filter(pk__in=pks).values_list(
+        'pk', 'name', 'street', 'city', 'postal_code', 'description'
+    )
+    for pk, name, street, city, postal_code, description in rows:
+        yield pk, name, street, city, postal_code, ' '.join(categories.get(pk, ())), description
+
+
+def _legacy_documents(model, pks):
+    rows = model._default_manager.filter(pk__in=pks).values_list(
+        'pk', 'name', 'address', 'city', 'postal_code', 'category__name', 'description'
+    )
+    for pk, name, address, city, postal_code, category, description in rows:
+        yield pk, name, address, city, postal_code, category, description
+
+
+# Indexed tables (model db_table values) and their document builders
+DOCUMENT_BUILDERS = {
+    'maps_hierarchicallocation': _hierarchical_documents,
+    'maps_location': _legacy_documents,
+}
+SEARCH_TABLES = tuple(DOCUMENT_BUILDERS)
+
+
+def search_index_sql(table):
+    columns = ', '.join(SEARCH_COLUMNS)
+    return f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table(table)} USING fts5({columns}, tokenize = 'unicode61')"
+
+
+def install_search_indexes(connection):
+    """Create the FTS5 tables (SQLite only, no-op elsewhere); fill them with index_locations()"""
+    if connection.vendor != 'sqlite':
+        return
+    existing = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            if table in existing:
+                cursor.execute(search_index_sql(table))
+    _available.clear()
+
+
+def has_search_index(using, table):
+    key = (using, table)
+    if key not in _available:
+        connection = connections[using]
+        _available[key] = (
+            connection.vendor == 'sqlite'
+            and fts_table(table) in connection.introspection.table_names()
+        )
+    return _available[key]
+
+
+def index_locations(model, pks=None, using='default'):
+    """
+    Rewrite the documents of the given rows (every row when ``pks`` is None).
+    Pks without a row any more lose their document.
+    """
+    table = model._meta.db_table
+    if not has_search_index(using, table):
+        return
+    fts = fts_table(table)
+    build = DOCUMENT_BUILDERS[table]
+    placeholders = ', '.join(['%s'] * (len(SEARCH_COLUMNS) + 1))
+    insert = f"INSERT INTO {fts}(rowid, {', '.join(SEARCH_COLUMNS)}) VALUES ({placeholders})"
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        if pks is None:
+            cursor.execute(f'DELETE FROM {fts}')
+            pks = model._default_manager.using(using).values_list('pk', flat=True).iterator(chunk_size=2000)
+        pks = list(pks)
+        for start in range(0, len(pks), CHUNK_SIZE):
+            chunk = pks[start:start + CHUNK_SIZE]
+            cursor.execute(
+                f"DELETE FROM {fts} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk
+            )
+            cursor.executemany(insert, [
+                (pk, *(index_text(value) for value in values))
+                for pk, *values in build(model, chunk)
+            ])
+
+
+def remove_locations(model, pks, using='default'):
+    table = model._meta.db_table
+    if not has_search_index(using, table):
+        return
+    pks = list(pks)
+    with connections[using].cursor() as cursor:
+        for start in range(0, len(pks), CHUNK_SIZE):
+            chunk = pks[start:start + CHUNK_SIZE]
+            cursor.execute(
+                f"DELETE FROM {fts_table(table)} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk
+            )
+
+
+def rebuild_domain(domain_pk):
+    """Rewrite the documents of a domain's locations and drop those of deleted locations"""
+    from .hierarchical_models import DomainMembership, HierarchicalLocation
+
+    table = HierarchicalLocation._meta.db_table
+    if not has_search_index(connection.alias, table):
+        return
+    index_locations(
+        HierarchicalLocation,
+        DomainMembership.objects.filter(domain_id=domain_pk).values_list('location_id', flat=True)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {fts_table(table)} WHERE rowid NOT IN (SELECT id FROM {table})')
+
+
+# Model fields matched by the fallback on databases without FTS5
+FALLBACK_FIELDS = {
+    'maps_hierarchicallocation': ('name', 'street', 'city', 'postal_code', 'categories__name', 'description'),
+    'maps_location': ('name', 'address', 'city', 'postal_code', 'category__name', 'description'),
+}
+
+
+class SearchQuerySet(models.QuerySet):
+    def search(self, text):
+        """
+        Rows matching every word of ``text`` (as a prefix), best match first.
+        With FTS5 the BM25 score is annotated as ``search_rank`` (lower is
+        better); a later order_by() replaces the ranking.
+        """
+        expression = match_expression(text)
+        if expression is None:
+            return self.none()
+
+        table = self.model._meta.db_table
+        if not has_search_index(self.db, table):
+            query = Q()
+            for word in _words(text):
+                query &= Q(*(Q(**{f'{field}__icontains': word}) for field in FALLBACK_FIELDS[table]), _connector=Q.OR)
+            return self.filter(query).distinct()
+
+        fts = fts_table(table)
+        weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+        # The FTS table has no model, extra() joins it on rowid
+        return self.extra(
+            tables=[fts],
+            where=[f'{fts}.rowid = {table}.id', f'{fts} MATCH %s'],
+            params=[expression],
+            select={'search_rank': f'bm25({fts}, {weights})'},
+            order_by=['search_rank'],
+        )
+
+
+class LocationQuerySet(SpatialQuerySet, SearchQuerySet):
+    """Bbox, coordinate and full-text lookups of the location models"""
+
+
+LocationManager = models.Manager.from_queryset(LocationQuerySet)
@@ -1,6 +1,14 @@
+from django.db.models import Count, Q
 from rest_framework import serializers
 from .models import Category, Location, MapConfiguration
 
+
+def with_location_counts(categories):
+    """Annotate the active location count CategorySerializer reads (one query instead of one per category)"""
+    return categories.annotate(
+        active_location_count=Count('locations', filter=Q(locations__is_active=True))
+    )
+
 class CategorySerializer(serializers.ModelSerializer):
     location_count = serializers.SerializerMethodField()
     
@@ -9,7 +17,10 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'color', 'icon', 'description', 'is_active', 'location_count']
     
     def get_location_count(self, obj):
-        return obj.locations.filter(is_active=True).count()
+        count = getattr(obj, 'active_location_count', None)
+        if count is None:
+            count = obj.locations.filter(is_active=True).count()
+        return count
 
 class LocationSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
@@ -27,10 +38,12 @@ class LocationSerializer(serializers.ModelSerializer):
         ]
 
 class LocationMinimalSerializer(serializers.ModelSerializer):
-    """Minimal serializer for map display"""
+    """Minimal serializer for map display, expects Location.objects.float_coordinates()"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     category_color = serializers.CharField(source='category.color', read_only=True)
     category_icon = serializers.CharField(source='category.icon', read_only=True)
+    latitude = serializers.FloatField(source='lat', read_only=True)
+    longitude = serializers.FloatField(source='lng', read_only=True)
     coordinates = serializers.ReadOnlyField()
     
     class Meta:
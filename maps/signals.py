@@ -0,0 +1,336 @@
+"""
+Signal handlers keeping derived map data in sync with the map models
+Every change to a domain's locations, categories or memberships bumps its
+DataVersion (and ALL_DOMAINS); changes to the legacy models bump LEGACY.
+Snapshots, tiles and ETags keyed by those versions are thereby invalidated;
+the tiles of older versions are removed from disk.
+The same handlers maintain the location counters (see maps.counters), the
+DomainMembership rows (see maps.memberships), the full-text documents
+(see maps.search) and, after the commit, the cluster cells (see
+maps.clustering).
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import clustering, counters, memberships, search, vector_tiles
+from .geo import point_quadkey
+from .hierarchical_models import (
+    DataVersion, Domain, HierarchicalCategory, HierarchicalLocation
+)
+from .models import Category, Location, MapConfiguration
+
+LocationCategory = HierarchicalLocation.categories.through
+
+_state = threading.local()
+
+
+def bump_scopes(scopes):
+    """Bump the data version of the given scopes (deferred inside batch_version_bumps)"""
+    scopes = {scope for scope in scopes if scope}
+    if not scopes:
+        return
+
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.update(scopes)
+        return
+
+    for scope in scopes:
+        transaction.on_commit(lambda scope=scope: _bump(scope))
+
+
+def _bump(scope):
+    version = DataVersion.bump(scope)
+    # Tiles of the older versions are unreachable now; requests never prune
+    vector_tiles.prune_tiles(scope, version)
+
+
+def bump_domains(domain_ids):
+    """Bump the given domains and the ALL_DOMAINS scope (inside batch_version_bumps, also recount them)"""
+    domain_ids = {domain_id for domain_id in domain_ids if domain_id}
+    if domain_ids:
+        bump_scopes(domain_ids | {DataVersion.ALL_DOMAINS})
+        if not batching():
+            _recluster_on_commit(domain_ids)
+
+
+def _recluster_on_commit(domain_ids):
+    """Rebuild the domains' cluster cells once the edit is committed, once per domain"""
+    pending = getattr(_state, 'recluster', None)
+    if pending is None:
+        pending = _state.recluster = set()
+    pending.update(domain_ids)
+
+    def recluster():
+        # Every edit of a transaction registers this; the first to run takes
+        # the lot. A rolled back edit leaves its domains for the next one.
+        domains, _state.recluster = _state.recluster, set()
+        if domains:
+            clustering.rebuild_cluster_indexes(domains)
+
+    transaction.on_commit(recluster)
+
+
+def batching():
+    return getattr(_state, 'pending', None) is not None
+
+
+@contextmanager
+def batch_version_bumps():
+    """
+    Collect version bumps and apply each affected scope once on exit.
+    Used by bulk imports so thousands of saves cost one bump per domain.
+    Location counters, memberships, search documents and cluster cells are
+    not maintained per row meanwhile; the affected domains are rebuilt once
+    on exit instead.
+    """
+    outer = not batching()
+    if outer:
+        _state.pending = set()
+    try:
+        yield
+    finally:
+        if outer:
+            pending, _state.pending = _state.pending, None
+            for domain in Domain.objects.filter(domain_id__in=pending):
+                memberships.rebuild_domain(domain.pk)
+                search.rebuild_domain(domain.pk)
+                counters.recount_domain(domain.pk)
+                clustering.rebuild_cluster_index(domain)
+            bump_scopes(pending)
+
+
+def _location_domain_ids(location_ids):
+    return set(
+        HierarchicalCategory.objects.filter(locations__in=location_ids)
+        .values_list('domain__domain_id', flat=True)
+        .distinct()
+    )
+
+
+@receiver(post_save, sender=Domain)
+@receiver(post_delete, sender=Domain)
+def domain_changed(sender, instance, **kwargs):
+    bump_domains([instance.domain_id])
+
+
+def _remember_is_active(instance):
+    # Previous is_active, so post_save can tell whether the counters change
+    if instance.pk and not batching():
+        instance._was_active = (
+            type(instance).objects.filter(pk=instance.pk).values_list('is_active', flat=True).first()
+        )
+
+
+@receiver(pre_save, sender=HierarchicalCategory)
+def category_saving(sender, instance, **kwargs):
+    _remember_is_active(instance)
+    # Previous domain and category_id, copied into DomainMembership rows,
+    # and name, indexed with the category's locations
+    if instance.pk:
+        instance._was_identity = (
+            HierarchicalCategory.objects.filter(pk=instance.pk)
+            .values_list('domain_id', 'domain__domain_id', 'category_id', 'name').first()
+        )
+
+
+@receiver(post_save, sender=HierarchicalCategory)
+@receiver(post_delete, sender=HierarchicalCategory)
+def category_changed(sender, instance, **kwargs):
+    try:
+        bump_domains([instance.domain.domain_id])
+    except Domain.DoesNotExist:
+        # Deleted together with its domain, which was bumped already
+        pass
+
+
+@receiver(post_save, sender=HierarchicalCategory)
+def category_saved(sender, instance, created, **kwargs):
+    if batching():
+        return
+    was_active = False if created else getattr(instance, '_was_active', instance.is_active)
+    if was_active != instance.is_active:
+        counters.category_activity_changed(instance.domain_id, instance.is_active)
+
+
+@receiver(post_save, sender=HierarchicalCategory)
+def category_identity_changed(sender, instance, created, **kwargs):
+    previous = instance.__dict__.pop('_was_identity', None)
+    if created or previous is None:
+        return
+    domain_pk, domain_id, category_id, name = previous
+    moved = domain_pk != instance.domain_id
+    renamed = name != instance.name
+    if not (moved or renamed or category_id != instance.category_id):
+        return
+
+    if moved:
+        # Moved to another domain: the old one loses the locations too
+        bump_domains([domain_id])
+    if batching():
+        return
+    location_pks = list(instance.locations.values_list('pk', flat=True))
+    if renamed:
+        search.index_locations(HierarchicalLocation, location_pks)
+    if moved or category_id != instance.category_id:
+        memberships.refresh_locations(location_pks)
+    if moved:
+        counters.recount_domain(domain_pk)
+        counters.recount_domain(instance.domain_id)
+
+
+@receiver(pre_delete, sender=HierarchicalCategory)
+def category_deleting(sender, instance, **kwargs):
+    if batching():
+        return
+    counters.category_deleting(instance.pk, instance.domain_id)
+    if instance.is_active:
+        counters.category_activity_changed(instance.domain_id, False)
+    instance._member_locations = list(instance.locations.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=HierarchicalCategory)
+def category_deleted(sender, instance, **kwargs):
+    location_pks = instance.__dict__.pop('_member_locations', None)
+    if location_pks:
+        memberships.refresh_locations(location_pks)
+        search.index_locations(HierarchicalLocation, location_pks)
+
+
+@receiver(pre_save, sender=HierarchicalLocation)
+def location_saving(sender, instance, **kwargs):
+    _remember_is_active(instance)
+
+
+@receiver(pre_save, sender=HierarchicalLocation)
+@receiver(pre_save, sender=Location)
+def fixture_location_saving(sender, instance, raw, **kwargs):
+    # loaddata saves raw, bypassing the save() that sets the quadkey
+    if raw:
+        instance.quadkey = point_quadkey(instance.latitude, instance.longitude)
+
+
+@receiver(post_save, sender=HierarchicalLocation)
+def location_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    bump_domains(_location_domain_ids([instance.pk]))
+
+    was_active = getattr(instance, '_was_active', instance.is_active)
+    if not batching() and was_active is not None and was_active != instance.is_active:
+        counters.location_activity_changed(instance.pk, instance.is_active)
+
+
+@receiver(post_save, sender=HierarchicalLocation)
+@receiver(post_save, sender=Location)
+def location_indexed(sender, instance, **kwargs):
+    # Batches only rebuild hierarchical domains, legacy rows are indexed right away
+    if sender is Location or not batching():
+        search.index_locations(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=HierarchicalLocation)
+@receiver(post_delete, sender=Location)
+def location_unindexed(sender, instance, **kwargs):
+    # Also while batching: a batch only rebuilds locations still in a domain
+    search.remove_locations(sender, [instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def legacy_category_indexed(sender, instance, created, **kwargs):
+    if not created:
+        search.index_locations(Location, instance.locations.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=HierarchicalLocation)
+def location_deleted(sender, instance, **kwargs):
+    # Memberships are gone after the delete, resolve domains first
+    bump_domains(_location_domain_ids([instance.pk]))
+    if instance.is_active and not batching():
+        counters.location_activity_changed(instance.pk, False)
+
+
+def _memberships(instance, reverse, pk_set):
+    """Existing (location pk, category pk) rows touched by an m2m remove/clear"""
+    if reverse:
+        rows = LocationCategory.objects.filter(hierarchicalcategory_id=instance.pk)
+        if pk_set is not None:
+            rows = rows.filter(hierarchicallocation_id__in=pk_set)
+    else:
+        rows = LocationCategory.objects.filter(hierarchicallocation_id=instance.pk)
+        if pk_set is not None:
+            rows = rows.filter(hierarchicalcategory_id__in=pk_set)
+    return list(rows.values_list('hierarchicallocation_id', 'hierarchicalcategory_id'))
+
+
+@receiver(m2m_changed, sender=LocationCategory)
+def location_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if reverse:
+        # instance is a HierarchicalCategory
+        bump_domains([instance.domain.domain_id])
+    elif action == 'pre_clear':
+        bump_domains(_location_domain_ids([instance.pk]))
+    else:
+        bump_domains(
+            HierarchicalCategory.objects.filter(pk__in=pk_set)
+            .values_list('domain__domain_id', flat=True)
+        )
+
+
+@receiver(m2m_changed, sender=LocationCategory)
+def location_categories_counted(sender, instance, action, reverse, pk_set, **kwargs):
+    if batching():
+        return
+
+    if action == 'post_add':
+        if reverse:
+            pairs = [(location_pk, instance.pk) for location_pk in pk_set]
+        else:
+            pairs = [(instance.pk, category_pk) for category_pk in pk_set]
+        counters.memberships_added(pairs)
+    elif action in ('pre_remove', 'pre_clear'):
+        # pk_set may name rows that do not exist; count what is actually removed
+        instance._removed_memberships = _memberships(instance, reverse, pk_set)
+    elif action in ('post_remove', 'post_clear'):
+        counters.memberships_removed(instance.__dict__.pop('_removed_memberships', []))
+
+
+@receiver(m2m_changed, sender=LocationCategory)
+def location_memberships_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if batching():
+        return
+
+    if reverse and action == 'pre_clear':
+        # instance is a HierarchicalCategory about to lose every location
+        instance._cleared_locations = list(instance.locations.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            location_pks = [instance.pk]
+        elif action == 'post_clear':
+            location_pks = instance.__dict__.pop('_cleared_locations', [])
+        else:
+            location_pks = pk_set
+        memberships.refresh_locations(location_pks)
+        # Documents carry the category names
+        search.index_locations(HierarchicalLocation, location_pks)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=MapConfiguration)
+@receiver(post_delete, sender=MapConfiguration)
+@receiver(m2m_changed, sender=MapConfiguration.categories.through)
+def legacy_data_changed(sender, action=None, **kwargs):
+    if action and not action.startswith('post_'):
+        return
+    bump_scopes([DataVersion.LEGACY])
@@ -0,0 +1,242 @@
+"""
+Materialized API payloads keyed by domain data version
+A snapshot is the serialized response body for one (domain, parameters)
+combination; bumping the domain's DataVersion makes old keys unreachable.
+Compressed encodings are stored next to the plain snapshot under their own
+keys, so repeated requests never recompress.
+
+``cached_response`` applies the same scheme to whole JSON views. Every
+lookup is counted per kind (see cache_stats()); the counters live in the
+process, next to the LocMemCache of the default settings.
+
+Misses are coalesced: concurrent requests for the same key wait for one
+build instead of each rebuilding (single_flight, per process). After a
+version bump, requests arriving while the new payload is being built get
+the previous one (stale-while-revalidate) rather than waiting; previous
+payloads are kept for STALE_TIMEOUT_FACTOR snapshot timeouts.
+"""
+
+import hashlib
+import json
+import threading
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .compression import compress
+from .hierarchical_models import DataVersion
+
+HIT, MISS, STALE = 'hits', 'misses', 'stale'
+
+# Longest a request waits for an identical in-flight build before building itself
+FLIGHT_WAIT_SECONDS = 30
+# Previous payloads (for stale-while-revalidate) outlive snapshots by this factor
+STALE_TIMEOUT_FACTOR = 7
+
+_stats = Counter()
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _digest(params):
+    return hashlib.sha1(json.dumps(params or {}, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def snapshot_key(kind, scope, params=None):
+    """Cache key for a payload of ``kind`` built from ``params`` at the scope's current version"""
+    version = DataVersion.current(scope)
+    return f'maps:snapshot:{kind}:{scope}:v{version}:{_digest(params)}'
+
+
+def latest_key(kind, scope, params=None):
+    """Cache key of the most recently built payload for ``params``, whatever its version"""
+    return f'maps:snapshot:{kind}:{scope}:latest:{_digest(params)}'
+
+
+def _timeout():
+    return getattr(settings, 'MAP_SNAPSHOT_TIMEOUT', 60 * 60 * 24)
+
+
+def _stale_timeout():
+    return _timeout() * STALE_TIMEOUT_FACTOR
+
+
+def _count(kind, outcome):
+    _stats[kind, outcome] += 1
+
+
+def cache_stats():
+    """{kind: {'hits': n, 'misses': n, 'stale': n}} of this process since the last reset"""
+    stats = {}
+    for (kind, outcome), count in sorted(_stats.items()):
+        stats.setdefault(kind, {HIT: 0, MISS: 0, STALE: 0})[outcome] = count
+    return stats
+
+
+def reset_cache_stats():
+    _stats.clear()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+def single_flight(key, build):
+    """
+    Call ``build()`` once for concurrent callers of the same key in this
+    process: the first caller builds, the others wait for its value. A
+    None value (or a failed build) is not shared, waiting callers then
+    build on their own. Returns (value, leader).
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(FLIGHT_WAIT_SECONDS) and flight.value is not None:
+            return flight.value, False
+        return build(), False
+
+    try:
+        flight.value = build()
+        return flight.value, True
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def building(key):
+    """Whether a single_flight() build of ``key`` is running in this process"""
+    return key in _flights
+
+
+def _get_or_build(key, build, kind, stale_key=None, count=True):
+    """
+    (value, outcome) for a cache key. Misses are built once per process
+    (single_flight); while that build runs, other requests get the previous
+    value stored under ``stale_key`` instead of waiting, if there is one.
+    ``build`` returning None means the result must not be cached. Nested
+    lookups pass ``count=False`` so a request is counted once.
+    """
+    def counted(outcome):
+        if count:
+            _count(kind, outcome)
+        return outcome
+
+    value = cache.get(key)
+    if value is not None:
+        return value, counted(HIT)
+
+    if stale_key is not None and building(key):
+        entry = cache.get(stale_key)
+        if entry is not None and entry[0] != key:
+            return entry[1], counted(STALE)
+
+    def build_and_store():
+        # A build that finished just before this one started already stored it
+        value = cache.get(key)
+        if value is None:
+            value = build()
+            if value is not None:
+                cache.set(key, value, _timeout())
+                if stale_key is not None:
+                    cache.set(stale_key, (key, value), _stale_timeout())
+        return value
+
+    value, _ = single_flight(key, build_and_store)
+    return value, counted(MISS)
+
+
+def cached_snapshot(kind, scope, params, build):
+    """
+    Return the snapshot bytes for (kind, scope, params), calling ``build``
+    to produce them on a miss. ``build`` must return bytes.
+    """
+    return _get_or_build(snapshot_key(kind, scope, params), build, kind, latest_key(kind, scope, params))[0]
+
+
+def cached_encoded_snapshot(kind, scope, params, build, encoding=None):
+    """
+    Like cached_snapshot, but return ``(body, uncompressed_size, stale)``
+    with the body in the given Content-Encoding ('gzip', 'br' or None for
+    identity). ``stale`` is True when the body was built for an older data
+    version and a rebuild is under way.
+    """
+    key = snapshot_key(kind, scope, params)
+    stale_key = latest_key(kind, scope, params)
+    if encoding is None:
+        body, outcome = _get_or_build(key, build, kind, stale_key)
+        return body, len(body), outcome == STALE
+
+    def build_encoded():
+        # Never compress a stale body under the current version
+        body, _ = _get_or_build(key, build, kind, count=False)
+        return compress(body, encoding), len(body)
+
+    (body, size), outcome = _get_or_build(
+        f'{key}:{encoding}', build_encoded, kind, f'{stale_key}:{encoding}'
+    )
+    return body, size, outcome == STALE
+
+
+def cached_response(kind, scopes_func, stale=False):
+    """
+    Decorate a read-only view so its successful GET responses are served
+    from the cache, keyed by the versions of ``scopes_func(request, *args,
+    **kwargs)`` (see maps.conditional), the path, the query string and the
+    Accept header. Concurrent misses run the view once. With ``stale``, the
+    previous body is served while that runs; meant for views with a few
+    fixed parameter sets, free-text or per-id keys would each keep one.
+    Responses carry ``X-Cache: HIT``, ``MISS`` or ``STALE``. Streaming
+    responses are passed through uncached.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            scopes = sorted(scopes_func(request, *args, **kwargs))
+            params = {
+                'path': request.path,
+                'query': sorted(request.GET.lists()),
+                'accept': request.META.get('HTTP_ACCEPT', ''),
+            }
+            key = snapshot_key(kind, scopes[0], {
+                **params, 'scopes': {scope: DataVersion.current(scope) for scope in scopes[1:]}
+            })
+            uncached = []
+
+            def build():
+                response = view_func(request, *args, **kwargs)
+                if not response.streaming and hasattr(response, 'render') and not response.is_rendered:
+                    # DRF responses are rendered late by the handler
+                    response.render()
+                if response.streaming or response.status_code != 200:
+                    uncached.append(response)
+                    return None
+                return response.content, response['Content-Type']
+
+            stale_key = latest_key(kind, scopes[0], params) if stale else None
+            entry, outcome = _get_or_build(key, build, kind, stale_key)
+            if entry is None:
+                response = uncached[0]
+                response['X-Cache'] = 'MISS'
+                return response
+
+            content, content_type = entry
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = {HIT: 'HIT', MISS: 'MISS', STALE: 'STALE'}[outcome]
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,177 @@
+"""
+SQLite R*Tree spatial index for location models
+Each indexed table gets a ``<table>_rtree`` virtual table holding one point
+box per row. Triggers keep it in sync with every insert, coordinate update
+and delete, including bulk_create() and queryset update()/delete(), which
+send no model signals. ``objects.in_bbox()`` answers bbox queries from the
+R*Tree and falls back to prefix ranges on the indexed quadkey column on
+other databases; ``objects.in_radius()`` prefilters the same way and cuts
+by great-circle distance. ``objects.float_coordinates()`` reads coordinates
+as floats cast in SQL, so read paths skip building a Decimal per value.
+"""
+
+import math
+
+from django.db import connections, models
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt, Substr
+
+from .geo import EARTH_RADIUS_KM, quadkey_ranges, radius_bbox
+
+# Tables mirrored into an R*Tree (model db_table values)
+SPATIAL_TABLES = ('maps_hierarchicallocation', 'maps_location')
+
+_available = {}
+
+
+def rtree_table(table):
+    return f'{table}_rtree'
+
+
+def spatial_index_sql(table):
+    """Statements creating (idempotently) the R*Tree of a table and its sync triggers"""
+    rtree = rtree_table(table)
+    return [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, min_lat, max_lat, min_lng, max_lng)',
+        f'''CREATE TRIGGER IF NOT EXISTS {rtree}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {rtree} VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {rtree}_update AFTER UPDATE OF latitude, longitude ON {table} BEGIN
+            UPDATE {rtree} SET min_lat = new.latitude, max_lat = new.latitude,
+                min_lng = new.longitude, max_lng = new.longitude
+            WHERE id = new.id;
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {rtree}_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM {rtree} WHERE id = old.id;
+        END''',
+        # Backfill rows the triggers missed (new install, or a migration that
+        # rebuilt the table and dropped its triggers)
+        f'''INSERT INTO {rtree}
+            SELECT id, latitude, latitude, longitude, longitude FROM {table}
+            WHERE id NOT IN (SELECT id FROM {rtree})''',
+        f'DELETE FROM {rtree} WHERE id NOT IN (SELECT id FROM {table})',
+    ]
+
+
+def install_spatial_indexes(connection):
+    """Create or repair the R*Tree indexes (SQLite only, no-op elsewhere)"""
+    if connection.vendor != 'sqlite':
+        return
+    existing = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for table in SPATIAL_TABLES:
+            if table in existing:
+                for statement in spatial_index_sql(table):
+                    cursor.execute(statement)
+    _available.clear()
+
+
+def has_spatial_index(using, table):
+    key = (using, table)
+    if key not in _available:
+        connection = connections[using]
+        _available[key] = (
+            connection.vendor == 'sqlite'
+            and rtree_table(table) in connection.introspection.table_names()
+        )
+    return _available[key]
+
+
+def bbox_query(bbox):
+    """Q object matching points inside (minLng, minLat, maxLng, maxLat) on the coordinate columns"""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    query = Q(latitude__gte=min_lat, latitude__lte=max_lat)
+    if min_lng > max_lng:
+        # bbox crosses the antimeridian
+        query &= Q(longitude__gte=min_lng) | Q(longitude__lte=max_lng)
+    else:
+        query &= Q(longitude__gte=min_lng, longitude__lte=max_lng)
+    return query
+
+
+def float_coordinates(prefix=''):
+    """``lat``/``lng`` float expressions for the coordinates of ``prefix`` (e.g. a relation path)"""
+    return {
+        'lat': Cast(f'{prefix}latitude', FloatField()),
+        'lng': Cast(f'{prefix}longitude', FloatField()),
+    }
+
+
+def distance_km(lat, lng, prefix=''):
+    """Great-circle distance (km) of the row's coordinates from a point, as geo.haversine_km in SQL"""
+    coordinates = float_coordinates(prefix)
+    phi = Radians(coordinates['lat'])
+    term = (
+        Power(Sin((phi - Value(math.radians(lat))) / 2), 2)
+        + Value(math.cos(math.radians(lat))) * Cos(phi)
+        * Power(Sin((Radians(coordinates['lng']) - Value(math.radians(lng))) / 2), 2)
+    )
+    # Rounding can push the term past 1, outside asin's domain
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(term), Value(1.0)), output_field=FloatField())
+
+
+def quadkey_query(bbox, field='quadkey'):
+    """Q object matching the quadkey prefix ranges covering a bbox (a superset of it)"""
+    query = Q()
+    for low, high in quadkey_ranges(bbox):
+        query |= Q(**{f'{field}__gte': low, f'{field}__lt': high})
+    return query
+
+
+def quadkey_prefix(zoom, field='quadkey'):
+    """Expression for the tile of a row at ``zoom``, e.g. to group rows by tile in SQL"""
+    return Substr(field, 1, zoom)
+
+
+def rtree_ids(table, bbox):
+    """Subquery of row ids whose R*Tree point lies in the bbox"""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    select = (
+        f'SELECT id FROM {rtree_table(table)} '
+        'WHERE max_lat >= %s AND min_lat <= %s AND max_lng >= %s AND min_lng <= %s'
+    )
+    if min_lng > max_lng:
+        # Crosses the antimeridian: two range scans, R*Tree cannot use OR
+        return RawSQL(
+            f'{select} UNION ALL {select}',
+            [min_lat, max_lat, min_lng, 180, min_lat, max_lat, -180, max_lng]
+        )
+    return RawSQL(select, [min_lat, max_lat, min_lng, max_lng])
+
+
+class SpatialQuerySet(models.QuerySet):
+    def in_bbox(self, bbox):
+        """
+        Rows inside (minLng, minLat, maxLng, maxLat); minLng > maxLng crosses
+        the antimeridian. The R*Tree (32-bit floats, rounded outwards) or the
+        quadkey ranges narrow the candidates, the exact column filter keeps
+        the result precise.
+        """
+        query = bbox_query(bbox)
+        table = self.model._meta.db_table
+        if has_spatial_index(self.db, table):
+            query &= Q(pk__in=rtree_ids(table, bbox))
+        else:
+            query &= quadkey_query(bbox)
+        return self.filter(query)
+
+    def in_radius(self, lat, lng, radius_km):
+        """
+        Rows within ``radius_km`` of a point, annotated with ``distance_km``.
+        in_bbox() of the circle's bounding box narrows the candidates through
+        the spatial index, the great-circle distance makes the exact cut.
+        """
+        return self.in_bbox(radius_bbox(lat, lng, radius_km)).annotate(
+            distance_km=distance_km(lat, lng)
+        ).filter(distance_km__lte=radius_km)
+
+    def float_coordinates(self):
+        """
+        Annotate ``lat``/``lng`` floats. Leave latitude/longitude out of
+        only() (or defer() them) so the Decimal columns are not loaded too.
+        """
+        return self.annotate(**float_coordinates())
+
+
+SpatialManager = models.Manager.from_queryset(SpatialQuerySet)
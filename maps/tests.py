@@ -1,3 +1,1635 @@
-from django.test import TestCase
+import gzip
+import json
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+from contextlib import ExitStack
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import serializers
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, reverse
+
+from .autocomplete import (
+    MAX_SCANNED_KEYS, AutocompleteIndex, clear_autocomplete_indexes, edits1, get_autocomplete_index
+)
+from .category_index import (
+    MATCH_ANY, bitset_from, bitset_members, clear_category_indexes, get_category_index
+)
+from .clustering import CLUSTER_MAX_ZOOM, cell_for, rebuild_cluster_index
+from .columnar import delta_decode
+from .compression import ENCODERS, negotiate_encoding
+from .conditional import domain_scopes, versioned_etag
+from .database import ReadDatabaseRouter, connection_pragmas, reading_database, use_read_database
+from .facets import parse_facets
+from .geo import (
+    MAX_ZOOM, haversine_km, parse_bbox, parse_zoom, point_quadkey, quadkey_ranges, quadkey_tile, radius_bbox,
+    snap_bbox_to_tiles, tile_quadkey
+)
+from .hierarchical_models import (
+    ClusterCell, DataVersion, Domain, DomainMembership, HierarchicalCategory, HierarchicalLocation,
+    HierarchicalLocationRaw
+)
+from .management.commands.import_hierarchical_data import Command as ImportCommand
+from .models import Category, Location, MapConfiguration
+from .nearby import NearbyIndex, clear_nearby_indexes
+from .search import index_text, match_expression, normalize_word
+from .signals import batch_version_bumps
+from .snapshots import (
+    building, cache_stats, cached_encoded_snapshot, cached_response, reset_cache_stats, snapshot_key
+)
+from .urls import urlpatterns as maps_urlpatterns
+from .vector_tiles import tile_cache_dir
+
+
+class HierarchicalDataMixin:
+    """Small Handwerk-like dataset shared by the hierarchical API tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.domain = Domain.objects.create(domain_id='handwerk', name='Handwerk')
+        cls.optiker = HierarchicalCategory.objects.create(
+            domain=cls.domain, category_id='optiker', name='Augenoptiker', color='#FF6B6B'
+        )
+        cls.kfz = HierarchicalCategory.objects.create(
+            domain=cls.domain, category_id='kfz', name='Kraftfahrzeugtechniker', color='#4ECDC4'
+        )
+        cls.berlin = cls.create_location('b1', 'Optik Berlin', 52.5200, 13.4050, 'Berlin', [cls.optiker])
+        cls.munich = cls.create_location('m1', 'KFZ München', 48.1351, 11.5820, 'München', [cls.kfz])
+        cls.hamburg = cls.create_location(
+            'h1', 'Optik & KFZ Hamburg', 53.5511, 9.9937, 'Hamburg', [cls.optiker, cls.kfz]
+        )
+
+    def setUp(self):
+        super().setUp()
+        # Snapshots, data versions and in-memory indexes outlive test transactions
+        cache.clear()
+        clear_category_indexes()
+        clear_autocomplete_indexes()
+        clear_nearby_indexes()
+
+    @classmethod
+    def create_location(cls, location_id, name, lat, lng, city, categories):
+        location = HierarchicalLocation.objects.create(
+            location_id=location_id, name=name, latitude=lat, longitude=lng, city=city,
+        )
+        location.store_raw_data({'source': 'test', 'location_id': location_id})
+        location.categories.add(*categories)
+        return location
+
+
+class GeoHelpersTests(TestCase):
+    def test_parse_bbox(self):
+        self.assertEqual(parse_bbox('13.0, 52.0,14.0,53.0'), (13.0, 52.0, 14.0, 53.0))
+        for value in ['1,2,3', 'a,b,c,d', '0,10,1,5', '0,-91,1,5']:
+            with self.assertRaises(ValueError):
+                parse_bbox(value)
+
+    def test_parse_zoom(self):
+        self.assertEqual(parse_zoom('12'), 12)
+        self.assertEqual(parse_zoom('12.7'), 12)
+        self.assertEqual(parse_zoom('-0.5'), 0)
+        self.assertEqual(parse_zoom('30'), MAX_ZOOM)
+        for value in ['x', 'nan', 'inf']:
+            with self.assertRaises(ValueError):
+                parse_zoom(value)
+
+    def test_snap_bbox_contains_original(self):
+        bbox = (13.3, 52.4, 13.5, 52.6)
+        snapped = snap_bbox_to_tiles(bbox, 10)
+        self.assertLessEqual(snapped[0], bbox[0])
+        self.assertLessEqual(snapped[1], bbox[1])
+        self.assertGreaterEqual(snapped[2], bbox[2])
+        self.assertGreaterEqual(snapped[3], bbox[3])
+        self.assertEqual(snap_bbox_to_tiles((13.31, 52.41, 13.49, 52.59), 10), snapped)
+
+
+class HierarchicalLocationsViewportTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def feature_ids(self, response):
+        return sorted(f['properties']['id'] for f in response.json()['features'])
+
+    def test_without_bbox_returns_whole_domain(self):
+        response = self.client.get(self.url, {'domain': 'handwerk'})
+        self.assertEqual(self.feature_ids(response), ['b1', 'h1', 'm1'])
+
+    def test_bbox_limits_features(self):
+        response = self.client.get(self.url, {'domain': 'handwerk', 'bbox': '9,52,14,54'})
+        self.assertEqual(self.feature_ids(response), ['b1', 'h1'])
+        self.assertEqual(response.json()['meta']['bbox'], [9.0, 52.0, 14.0, 54.0])
+
+    def test_zoom_snaps_bbox(self):
+        response = self.client.get(self.url, {'domain': 'handwerk', 'bbox': '13.3,52.4,13.5,52.6', 'zoom': 8})
+        meta = response.json()['meta']
+        self.assertEqual(meta['zoom'], 8)
+        self.assertEqual(self.feature_ids(response), ['b1'])
+        self.assertLessEqual(meta['bbox'][0], 13.3)
+
+    def test_fractional_zoom(self):
+        response = self.client.get(self.url, {'domain': 'handwerk', 'bbox': '13.3,52.4,13.5,52.6', 'zoom': 8.6})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['meta']['zoom'], 8)
+
+    def test_invalid_bbox_is_rejected(self):
+        response = self.client.get(self.url, {'domain': 'handwerk', 'bbox': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ClusterAPITests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/clusters/'
+
+    def test_rebuild_builds_every_zoom_level(self):
+        rebuild_cluster_index(self.domain)
+        world = ClusterCell.objects.get(domain=self.domain, zoom=0)
+        self.assertEqual(world.count, 3)
+        self.assertEqual(world.category_counts, {'optiker': 2, 'kfz': 2})
+        self.assertEqual(
+            set(ClusterCell.objects.values_list('zoom', flat=True)), set(range(CLUSTER_MAX_ZOOM + 1))
+        )
+
+    def test_cells_match_point_grid(self):
+        rebuild_cluster_index(self.domain)
+        for zoom in (CLUSTER_MAX_ZOOM, 6):
+            cells = set(ClusterCell.objects.filter(zoom=zoom).values_list('cell_x', 'cell_y'))
+            expected = {
+                cell_for(float(location.latitude), float(location.longitude), zoom)
+                for location in (self.berlin, self.munich, self.hamburg)
+            }
+            self.assertEqual(cells, expected)
+
+    def test_low_zoom_returns_clusters(self):
+        rebuild_cluster_index(self.domain)
+        response = self.client.get(self.url, {'domain': 'handwerk', 'z': 3})
+        data = response.json()
+        self.assertTrue(data['meta']['clustered'])
+        self.assertEqual(sum(f['properties']['count'] for f in data['features']), 3)
+
+    def test_cluster_query_does_not_touch_locations(self):
+        rebuild_cluster_index(self.domain)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'domain': 'handwerk', 'z': 5, 'bbox': '9,52,14,54'})
+        self.assertFalse([q for q in queries.captured_queries if 'maps_hierarchicallocation' in q['sql']])
+
+    def test_bbox_limits_clusters(self):
+        rebuild_cluster_index(self.domain)
+        response = self.client.get(self.url, {'domain': 'handwerk', 'z': 10, 'bbox': '11,47,12,49'})
+        features = response.json()['features']
+        self.assertEqual([f['properties']['count'] for f in features], [1])
+
+    def test_high_zoom_returns_individual_locations(self):
+        response = self.client.get(self.url, {'domain': 'handwerk', 'z': CLUSTER_MAX_ZOOM + 1, 'bbox': '9,53,10,54'})
+        data = response.json()
+        self.assertFalse(data['meta']['clustered'])
+        self.assertEqual([f['properties']['id'] for f in data['features']], ['h1'])
+        self.assertEqual(sorted(data['features'][0]['properties']['categories']), ['kfz', 'optiker'])
+
+    def test_requests_never_write_the_index(self):
+        # Never built: the individual locations, and no ClusterCell writes
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'domain': 'handwerk', 'z': 0})
+        self.assertFalse(response.json()['meta']['clustered'])
+        self.assertEqual(len(response.json()['features']), 3)
+        self.assertFalse([q for q in queries.captured_queries if not q['sql'].startswith('SELECT')])
+
+        rebuild_cluster_index(self.domain)
+        Domain.objects.filter(pk=self.domain.pk).update(cluster_index_version=1)
+        DataVersion.bump('handwerk')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'domain': 'handwerk', 'z': 0})
+        self.assertTrue(response.json()['meta']['clustered'])
+        self.assertFalse([q for q in queries.captured_queries if not q['sql'].startswith('SELECT')])
+
+    def test_index_follows_edits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.berlin.is_active = False
+            self.berlin.save()
+        self.domain.refresh_from_db()
+        self.assertEqual(self.domain.cluster_index_version, DataVersion.current('handwerk'))
+        response = self.client.get(self.url, {'domain': 'handwerk', 'z': 0})
+        self.assertEqual(response.json()['features'][0]['properties']['count'], 2)
+
+        # One rebuild per domain and commit, however many rows were edited
+        with mock.patch('maps.clustering.rebuild_cluster_index', wraps=rebuild_cluster_index) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.munich.categories.remove(self.kfz)
+                self.hamburg.categories.remove(self.kfz)
+        self.assertEqual(rebuild.call_count, 1)
+        response = self.client.get(self.url, {'domain': 'handwerk', 'z': 0})
+        self.assertEqual(response.json()['features'][0]['properties']['categories'], {'optiker': 1})
+
+    def test_rebuild_tolerates_memberships_out_of_sync(self):
+        DomainMembership.objects.filter(location=self.berlin).delete()
+        rebuild_cluster_index(self.domain)
+        world = ClusterCell.objects.get(domain=self.domain, zoom=0)
+        self.assertEqual(world.count, 2)
+
+    def test_domain_is_required(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+
+def read_varint(data, pos):
+    """Read one protobuf varint, returns (value, next position)"""
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def decode_protobuf(data):
+    """Minimal protobuf decoder: list of (field_number, value) pairs"""
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        if key & 0x7 == 0:
+            value, pos = read_varint(data, pos)
+        else:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.append((key >> 3, value))
+    return fields
+
+
+def decode_packed(data):
+    """Decode a packed repeated varint field"""
+    values = []
+    pos = 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+class VectorTileTests(HierarchicalDataMixin, TestCase):
+    # z=4 tile covering Berlin, Hamburg and Munich
+    url = '/api/hierarchical/tiles/4/8/5.pbf'
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        settings_override = override_settings(VECTOR_TILE_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def decode_layers(self, data):
+        layers = {}
+        for field, layer in decode_protobuf(data):
+            self.assertEqual(field, 3)
+            layer_fields = decode_protobuf(layer)
+            name = next(v for f, v in layer_fields if f == 1).decode()
+            keys = [v.decode() for f, v in layer_fields if f == 3]
+            values = [decode_protobuf(v)[0][1].decode() for f, v in layer_fields if f == 4]
+            features = []
+            for f, feature in layer_fields:
+                if f != 2:
+                    continue
+                tags = decode_packed(next(v for n, v in decode_protobuf(feature) if n == 2))
+                features.append({keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])})
+            layers[name] = features
+        return layers
+
+    def test_one_layer_per_category(self):
+        response = self.client.get(self.url, {'domain': 'handwerk'})
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        layers = self.decode_layers(response.content)
+        self.assertEqual(sorted(layers), ['kfz', 'optiker'])
+        self.assertEqual(sorted(f['location_id'] for f in layers['optiker']), ['b1', 'h1'])
+        self.assertEqual(sorted(f['location_id'] for f in layers['kfz']), ['h1', 'm1'])
+        self.assertEqual(layers['kfz'][0]['color'], '#4ECDC4')
+
+    def test_tiles_are_cached_per_data_version(self):
+        self.client.get(self.url, {'domain': 'handwerk'})
+        cached = tile_cache_dir() / 'handwerk' / 'v1' / '4' / '8' / '5.pbf'
+        self.assertTrue(cached.exists())
+
+        # Pruned by the bump, not by the next request
+        with self.captureOnCommitCallbacks(execute=True):
+            self.domain.save()
+        self.assertFalse(cached.exists())
+        self.client.get(self.url, {'domain': 'handwerk'})
+        self.assertTrue((tile_cache_dir() / 'handwerk' / 'v2' / '4' / '8' / '5.pbf').exists())
+
+    def test_tile_is_served_when_it_cannot_be_stored(self):
+        with mock.patch('maps.vector_tiles.Path.write_bytes', side_effect=FileNotFoundError):
+            response = self.client.get(self.url, {'domain': 'handwerk'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(self.decode_layers(response.content)), ['kfz', 'optiker'])
+        self.assertEqual(list((tile_cache_dir() / 'handwerk' / 'v1' / '4' / '8').iterdir()), [])
+
+    def test_empty_tile(self):
+        response = self.client.get('/api/hierarchical/tiles/6/0/0.pbf', {'domain': 'handwerk'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+
+    def test_out_of_range_tile(self):
+        response = self.client.get('/api/hierarchical/tiles/2/4/0.pbf', {'domain': 'handwerk'})
+        self.assertEqual(response.status_code, 404)
+
+
+class SnapshotInvalidationTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def get_names(self):
+        response = self.client.get(self.url, {'domain': 'handwerk'})
+        return sorted(f['properties']['name'] for f in response.json()['features'])
+
+    def test_warm_request_skips_orm(self):
+        self.client.get(self.url, {'domain': 'handwerk'})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'domain': 'handwerk'})
+        self.assertEqual(len(response.json()['features']), 3)
+
+    def test_location_save_invalidates(self):
+        self.get_names()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.berlin.name = 'Optik Berlin Mitte'
+            self.berlin.save()
+        self.assertIn('Optik Berlin Mitte', self.get_names())
+
+    def test_membership_changes_invalidate(self):
+        self.get_names()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.munich.categories.remove(self.kfz)
+        self.assertNotIn('KFZ München', self.get_names())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.kfz.locations.add(self.munich)
+        self.assertIn('KFZ München', self.get_names())
+
+    def test_category_change_bumps_its_domain(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.kfz.color = '#000000'
+            self.kfz.save()
+        self.assertEqual(DataVersion.current('handwerk'), 2)
+
+    def test_batched_bumps_apply_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with batch_version_bumps():
+                for location in (self.berlin, self.munich, self.hamburg):
+                    location.save()
+        self.assertEqual(DataVersion.current('handwerk'), 2)
+
+
+class LocationPayloadTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def test_default_features_are_lean(self):
+        response = self.client.get(self.url, {'domain': 'handwerk', 'bbox': '11,47,12,49'})
+        properties = response.json()['features'][0]['properties']
+        self.assertEqual(properties, {'id': 'm1', 'name': 'KFZ München', 'categories': ['kfz']})
+
+    def test_list_query_never_reads_raw_data(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'domain': 'handwerk', 'fields': 'all'})
+        self.assertFalse([q for q in queries.captured_queries if 'raw_data' in q['sql']])
+
+    def test_fields_projection(self):
+        response = self.client.get(self.url, {
+            'domain': 'handwerk', 'bbox': '11,47,12,49', 'fields': 'city,address,category_details'
+        })
+        properties = response.json()['features'][0]['properties']
+        self.assertEqual(properties['city'], 'München')
+        self.assertEqual(properties['address'], 'München, Germany')
+        self.assertEqual(properties['category']['color'], '#4ECDC4')
+        self.assertNotIn('phone', properties)
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get(self.url, {'domain': 'handwerk', 'fields': 'raw_data'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail_endpoint(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url + 'h1/', {'domain': 'handwerk'})
+        # data version (response cache key), location joined with its raw data,
+        # categories, their domains
+        self.assertEqual(len(queries.captured_queries), 4)
+        properties = response.json()['properties']
+        self.assertEqual(properties['raw_data'], {'source': 'test', 'location_id': 'h1'})
+        self.assertEqual(sorted(c['id'] for c in properties['categories']), ['kfz', 'optiker'])
+        self.assertEqual(self.client.get(self.url + 'missing/').status_code, 404)
+
+
+class RawDataTests(HierarchicalDataMixin, TestCase):
+    def test_raw_data_lives_in_side_table(self):
+        columns = [column.name for column in connection.introspection.get_table_description(
+            connection.cursor(), HierarchicalLocation._meta.db_table
+        )]
+        self.assertNotIn('raw_data', columns)
+        self.assertEqual(
+            HierarchicalLocationRaw.objects.get(location=self.berlin).data,
+            {'source': 'test', 'location_id': 'b1'}
+        )
+
+    def test_store_raw_data(self):
+        self.berlin.store_raw_data({'source': 'update'})
+        self.assertEqual(HierarchicalLocation.objects.get(pk=self.berlin.pk).raw_data, {'source': 'update'})
+        self.berlin.store_raw_data(None)
+        self.assertIsNone(HierarchicalLocation.objects.get(pk=self.berlin.pk).raw_data)
+        self.assertEqual(HierarchicalLocationRaw.objects.count(), 2)
+
+    def test_deleting_location_deletes_raw_data(self):
+        self.munich.delete()
+        self.assertFalse(HierarchicalLocationRaw.objects.filter(location_id=self.munich.pk).exists())
+
+
+class StreamingGeoJSONTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def test_stream_matches_buffered_response(self):
+        params = {'domain': 'handwerk', 'fields': 'city,category_details'}
+        buffered = self.client.get(self.url, params).json()
+        response = self.client.get(self.url, {**params, 'stream': '1'})
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(streamed, buffered)
+
+    def test_stream_chunks(self):
+        from .hierarchical_views_new import HierarchicalLocationsAPI
+
+        pieces = list(HierarchicalLocationsAPI().stream_geojson('handwerk', [], None, None, chunk_size=2))
+        # opening, two feature chunks, closing meta
+        self.assertEqual(len(pieces), 4)
+        data = json.loads(b''.join(pieces))
+        self.assertEqual(data['meta']['total_locations'], 3)
+        self.assertEqual(len(data['features']), 3)
+
+
+
+class ResponseCacheTests(HierarchicalDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        reset_cache_stats()
+
+    def test_hits_until_data_changes(self):
+        url = '/api/hierarchical/categories/'
+        first = self.client.get(url, {'domain': 'handwerk'})
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(url, {'domain': 'handwerk'})
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.client.get(url, {'domain': 'other'})['X-Cache'], 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.kfz.refresh_from_db()
+            self.kfz.name = 'KFZ-Technik'
+            self.kfz.save()
+        response = self.client.get(url, {'domain': 'handwerk'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('KFZ-Technik', [c['name'] for c in response.json()['categories']])
+        self.assertEqual(cache_stats()['categories'], {'hits': 1, 'misses': 3, 'stale': 0})
+
+    def test_legacy_endpoints_and_stats(self):
+        category = Category.objects.create(name='Cafe', slug='cafe')
+        self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/api/categories/', HTTP_ACCEPT='text/html')['X-Cache'], 'MISS')
+        with self.captureOnCommitCallbacks(execute=True):
+            Location.objects.create(name='Cafe 1', slug='cafe-1', category=category, latitude=21.0, longitude=105.8)
+        self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'MISS')
+        # Not found is not cached
+        self.assertEqual(self.client.get('/api/locations/missing/').status_code, 404)
+        self.assertEqual(self.client.get('/api/locations/missing/')['X-Cache'], 'MISS')
+
+        stats = self.client.get('/api/cache-stats/').json()
+        self.assertEqual(stats['backend'], 'locmem')
+        self.assertEqual(stats['kinds']['legacy-categories'], {'hits': 1, 'misses': 3, 'stale': 0})
+        self.assertEqual((stats['hits'], stats['misses']), (1, 5))
+
+    def test_backends_configured(self):
+        from django.conf import settings
+
+        self.assertEqual(set(settings.MAP_CACHE_BACKENDS), {'locmem', 'file', 'redis'})
+        self.assertEqual(settings.CACHES['default']['BACKEND'], settings.MAP_CACHE_BACKENDS['locmem']['BACKEND'])
+
+
+
+def run_concurrently(func, threads=8):
+    """Call ``func()`` from several threads released at once, return the results in thread order"""
+    barrier = threading.Barrier(threads)
+    results = [None] * threads
+    errors = []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = func()
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join(10)
+    if errors:
+        raise errors[0]
+    return results
+
+
+class SingleFlightTests(HierarchicalDataMixin, TestCase):
+    """Concurrent misses build once; rebuilds after a bump serve the previous body"""
+
+    def setUp(self):
+        super().setUp()
+        reset_cache_stats()
+        # Versions are read through the cache, so the threads need no database
+        DataVersion.current('handwerk')
+        self.factory = RequestFactory()
+
+    def slow_build(self, calls, body=b'payload'):
+        def build():
+            calls.append(threading.get_ident())
+            time.sleep(0.2)
+            return body
+        return build
+
+    def test_concurrent_misses_build_once(self):
+        calls = []
+        build = self.slow_build(calls)
+        results = run_concurrently(lambda: cached_encoded_snapshot('geojson', 'handwerk', {}, build))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [(b'payload', 7, False)] * 8)
+
+        calls.clear()
+        results = run_concurrently(lambda: cached_encoded_snapshot('geojson', 'handwerk', {}, build, 'gzip'))
+        self.assertEqual(calls, [])
+        self.assertEqual(len({body for body, _, _ in results}), 1)
+        self.assertEqual(gzip.decompress(results[0][0]), b'payload')
+
+    def test_compressed_miss_counts_once(self):
+        # The plain body looked up while compressing is not counted again
+        cached_encoded_snapshot('geojson', 'handwerk', {}, lambda: b'payload', 'gzip')
+        cached_encoded_snapshot('geojson', 'handwerk', {}, lambda: b'payload', 'gzip')
+        self.assertEqual(cache_stats()['geojson'], {'hits': 1, 'misses': 1, 'stale': 0})
+
+    def test_stale_entries_expire(self):
+        with mock.patch('maps.snapshots.cache.set') as cache_set:
+            cached_encoded_snapshot('geojson', 'handwerk', {}, lambda: b'v1')
+        timeouts = [call.args[2] for call in cache_set.call_args_list]
+        self.assertTrue(timeouts and all(timeouts))
+
+    def test_stale_body_while_rebuilding(self):
+        cached_encoded_snapshot('geojson', 'handwerk', {}, lambda: b'v1')
+        DataVersion.bump('handwerk')
+        release = threading.Event()
+
+        def build():
+            release.wait(5)
+            return b'v2'
+
+        leader = threading.Thread(target=cached_encoded_snapshot, args=('geojson', 'handwerk', {}, build))
+        leader.start()
+        key = snapshot_key('geojson', 'handwerk', {})
+        while not building(key):
+            time.sleep(0.001)
+        self.assertEqual(cached_encoded_snapshot('geojson', 'handwerk', {}, build), (b'v1', 2, True))
+        release.set()
+        leader.join(5)
+        self.assertEqual(cached_encoded_snapshot('geojson', 'handwerk', {}, build), (b'v2', 2, False))
+        self.assertEqual(cache_stats()['geojson'], {'hits': 1, 'misses': 2, 'stale': 1})
+
+    def test_cached_view_coalesces_and_serves_stale_without_etag(self):
+        calls = []
+        release = threading.Event()
+        release.set()
+
+        @versioned_etag(domain_scopes)
+        @cached_response('test', domain_scopes, stale=True)
+        def view(request):
+            calls.append(threading.get_ident())
+            time.sleep(0.2)
+            release.wait(5)
+            return JsonResponse({'calls': len(calls)})
+
+        request = self.factory.get('/test/', {'domain': 'handwerk'})
+        responses = run_concurrently(lambda: view(request))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({r.content for r in responses}, {b'{"calls": 1}'})
+        self.assertTrue(all(r['X-Cache'] == 'MISS' and r.has_header('ETag') for r in responses))
+
+        DataVersion.bump('handwerk')
+        release.clear()
+        leader = threading.Thread(target=view, args=(request,))
+        leader.start()
+        while len(calls) < 2:
+            time.sleep(0.001)
+        stale = view(request)
+        self.assertEqual((stale['X-Cache'], stale.content), ('STALE', b'{"calls": 1}'))
+        self.assertFalse(stale.has_header('ETag'))
+        release.set()
+        leader.join(5)
+        fresh = view(request)
+        self.assertEqual((fresh['X-Cache'], fresh.content), ('HIT', b'{"calls": 2}'))
+
+
+class WarmMapCacheTests(HierarchicalDataMixin, TestCase):
+    def warm(self, *args):
+        out = StringIO()
+        call_command('warm_map_cache', *args, stdout=out)
+        return out.getvalue()
+
+    def test_warmed_payloads_are_hits(self):
+        output = self.warm()
+        for artifact in ('domains', 'handwerk categories', 'handwerk geojson gzip', 'handwerk cluster index',
+                         'handwerk search index', 'map-data', 'map-config'):
+            self.assertIn(artifact, output)
+        self.domain.refresh_from_db()
+        self.assertEqual(self.domain.cluster_index_version, DataVersion.current('handwerk'))
+
+        reset_cache_stats()
+        # The requests the shipped pages send; Accept: */* is part of the response cache key
+        for url, params in [
+            ('/api/hierarchical/domains/', {}),
+            ('/api/hierarchical/categories/', {'domain': 'handwerk'}),
+            ('/api/map-data/', {}),
+            ('/api/map-config/', {}),
+        ]:
+            self.assertEqual(self.client.get(url, params, HTTP_ACCEPT='*/*')['X-Cache'], 'HIT')
+        with self.assertNumQueries(0):
+            self.client.get(
+                '/api/hierarchical/locations/',
+                {'domain': 'handwerk', 'fields': 'address,phone,email,website,category_details'},
+                HTTP_ACCEPT_ENCODING='gzip'
+            )
+        self.assertEqual(cache_stats()['geojson'], {'hits': 1, 'misses': 0, 'stale': 0})
+
+    def test_imports_skip_process_local_cache(self):
+        out = StringIO()
+        ImportCommand(stdout=out)._warm_map_cache('handwerk')
+        self.assertIn('skipped', out.getvalue())
+        self.assertNotIn('handwerk geojson', out.getvalue())
+
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            out = StringIO()
+            ImportCommand(stdout=out)._warm_map_cache('handwerk')
+        self.assertIn('handwerk geojson', out.getvalue())
+
+    def test_domain_option(self):
+        output = self.warm('--domain', 'handwerk')
+        self.assertIn('handwerk geojson', output)
+        self.assertNotIn('map-data', output)
+        with self.assertRaises(CommandError):
+            self.warm('--domain', 'missing')
+
+    def test_missing_search_documents_are_indexed(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM maps_hierarchicallocation_fts')
+        self.assertFalse(HierarchicalLocation.objects.search('optik').exists())
+        self.warm('--domain', 'handwerk')
+        self.assertEqual(HierarchicalLocation.objects.search('optik').count(), 2)
+
+
+class ConditionalGetTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def test_matching_etag_returns_not_modified(self):
+        response = self.client.get(self.url, {'domain': 'handwerk'})
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'domain': 'handwerk'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in queries.captured_queries if 'maps_hierarchicallocation' in q['sql']])
+
+    def test_etag_depends_on_parameters(self):
+        first = self.client.get(self.url, {'domain': 'handwerk'})['ETag']
+        second = self.client.get(self.url, {'domain': 'handwerk', 'fields': 'city'})['ETag']
+        self.assertNotEqual(first, second)
+
+    def test_data_change_changes_etag(self):
+        etag = self.client.get(self.url, {'domain': 'handwerk'})['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.berlin.save()
+        response = self.client.get(self.url, {'domain': 'handwerk'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_domain_list_revalidates(self):
+        etag = self.client.get('/api/hierarchical/domains/')['ETag']
+        response = self.client.get('/api/hierarchical/domains/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_legacy_map_data_uses_legacy_scope(self):
+        etag = self.client.get('/api/map-data/')['ETag']
+        self.assertEqual(self.client.get('/api/map-data/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Cafe', slug='cafe')
+        self.assertEqual(self.client.get('/api/map-data/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CompressedSnapshotTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(negotiate_encoding('identity'), None)
+        self.assertEqual(negotiate_encoding('gzip;q=0, deflate'), None)
+        self.assertEqual(negotiate_encoding(''), None)
+        self.assertEqual(negotiate_encoding('*'), 'br' if 'br' in ENCODERS else 'gzip')
+
+    def test_gzip_response(self):
+        plain = self.client.get(self.url, {'domain': 'handwerk'})
+        response = self.client.get(self.url, {'domain': 'handwerk'}, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['X-Uncompressed-Length'], str(len(plain.content)))
+        self.assertEqual(response['X-Compressed-Length'], str(len(response.content)))
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+    def test_encoded_snapshot_is_reused(self):
+        self.client.get(self.url, {'domain': 'handwerk'}, HTTP_ACCEPT_ENCODING='gzip')
+        with mock.patch('maps.snapshots.compress') as compress, self.assertNumQueries(0):
+            response = self.client.get(self.url, {'domain': 'handwerk'}, HTTP_ACCEPT_ENCODING='gzip')
+        compress.assert_not_called()
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['features']), 3)
+
+    def test_weak_etag_revalidates(self):
+        etag = self.client.get(self.url, {'domain': 'handwerk'}, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        response = self.client.get(
+            self.url, {'domain': 'handwerk'}, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class ColumnarFormatTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def test_columnar_matches_geojson(self):
+        params = {'domain': 'handwerk', 'fields': 'city'}
+        features = self.client.get(self.url, params).json()['features']
+        data = self.client.get(self.url, {**params, 'format': 'columnar'}).json()
+
+        self.assertEqual(data['format'], 'columnar')
+        self.assertEqual(data['meta']['total_locations'], 3)
+        lats = delta_decode(data['lat'], data['precision'])
+        lngs = delta_decode(data['lng'], data['precision'])
+        dictionary = data['category_dictionary']
+        for i, feature in enumerate(features):
+            properties = feature['properties']
+            lng, lat = feature['geometry']['coordinates']
+            self.assertEqual(data['ids'][i], properties['id'])
+            self.assertEqual(data['names'][i], properties['name'])
+            self.assertAlmostEqual(lats[i], lat, places=5)
+            self.assertAlmostEqual(lngs[i], lng, places=5)
+            self.assertEqual([dictionary[index]['id'] for index in data['categories'][i]], properties['categories'])
+            self.assertEqual(data['properties']['city'][i], properties['city'])
+
+    def test_category_dictionary_is_shared(self):
+        data = self.client.get(self.url, {'domain': 'handwerk', 'format': 'columnar'}).json()
+        self.assertEqual(sorted(c['id'] for c in data['category_dictionary']), ['kfz', 'optiker'])
+        self.assertEqual(
+            {c['id']: c['color'] for c in data['category_dictionary']},
+            {'optiker': '#FF6B6B', 'kfz': '#4ECDC4'}
+        )
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get(self.url, {'domain': 'handwerk', 'format': 'csv'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_legacy_map_data_columnar(self):
+        cafe = Category.objects.create(name='Cafe', slug='cafe', color='#123456')
+        Location.objects.create(name='Cafe Hanoi', slug='cafe-hanoi', category=cafe,
+                                latitude=21.0285, longitude=105.8542, address='Hoan Kiem')
+
+        data = self.client.get('/api/map-data/', {'format': 'columnar'}).json()
+        self.assertEqual(data['names'], ['Cafe Hanoi'])
+        self.assertEqual(delta_decode(data['lat'], data['precision']), [21.0285])
+        self.assertEqual(data['category_dictionary'][data['categories'][0][0]]['color'], '#123456')
+        self.assertEqual(data['total_locations'], 1)
+
+
+class CategoryFilterTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def ids(self, params):
+        response = self.client.get(self.url, {'domain': 'handwerk', **params})
+        self.assertEqual(response.status_code, 200)
+        return sorted(f['properties']['id'] for f in response.json()['features'])
+
+    def test_bitset_round_trip(self):
+        positions = [0, 7, 8, 63, 64, 1000, 1000]
+        self.assertEqual(bitset_from(positions), sum(1 << p for p in set(positions)))
+        self.assertEqual(bitset_members(bitset_from(positions)), [0, 7, 8, 63, 64, 1000])
+        self.assertEqual(bitset_from([]), 0)
+
+    def test_parameter_spellings(self):
+        self.assertEqual(self.ids({'categories[]': ['optiker']}), ['b1', 'h1'])
+        self.assertEqual(self.ids({'categories[0]': 'kfz'}), ['h1', 'm1'])
+        self.assertEqual(self.ids({'categories': 'kfz,optiker'}), ['b1', 'h1', 'm1'])
+
+    def test_match_all(self):
+        params = {'categories[0]': 'optiker', 'categories[1]': 'kfz'}
+        self.assertEqual(self.ids(params), ['b1', 'h1', 'm1'])
+        self.assertEqual(self.ids({**params, 'category_mode': 'all'}), ['h1'])
+        response = self.client.get(self.url, {'domain': 'handwerk', 'category_mode': 'none'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_does_not_join_memberships(self):
+        get_category_index('handwerk')
+        with CaptureQueriesContext(connection) as queries:
+            self.ids({'categories[]': ['kfz']})
+        location_queries = [q['sql'] for q in queries.captured_queries if 'maps_hierarchicallocation' in q['sql']]
+        self.assertTrue(location_queries)
+        self.assertFalse([sql for sql in location_queries if 'DISTINCT' in sql])
+
+    def test_index_follows_data_version(self):
+        index = get_category_index('handwerk')
+        self.assertEqual(index.location_pks(['kfz']), sorted([self.munich.pk, self.hamburg.pk]))
+        self.assertEqual(index.location_pks(['unknown']), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.berlin.categories.add(self.kfz)
+        self.assertEqual(self.ids({'categories[]': ['kfz'], 'category_mode': 'all'}), ['b1', 'h1', 'm1'])
+
+
+class LocationCounterTests(HierarchicalDataMixin, TestCase):
+    def assertCounts(self, domain, optiker, kfz):
+        self.domain.refresh_from_db()
+        self.optiker.refresh_from_db()
+        self.kfz.refresh_from_db()
+        self.assertEqual(
+            (self.domain.location_count, self.optiker.location_count, self.kfz.location_count),
+            (domain, optiker, kfz)
+        )
+
+    def test_initial_counts(self):
+        self.assertCounts(3, 2, 2)
+        self.assertEqual(self.domain.category_count, 2)
+        self.assertEqual(self.domain.total_locations, 3)
+
+    def test_membership_changes(self):
+        self.hamburg.categories.remove(self.kfz)
+        self.assertCounts(3, 2, 1)
+        self.munich.categories.clear()
+        self.assertCounts(2, 2, 0)
+        self.kfz.locations.add(self.munich, self.berlin)
+        self.assertCounts(3, 2, 2)
+        # Removing something that is not a member changes nothing
+        self.munich.categories.remove(self.optiker)
+        self.assertCounts(3, 2, 2)
+
+    def test_activity_and_deletes(self):
+        self.hamburg.is_active = False
+        self.hamburg.save()
+        self.assertCounts(2, 1, 1)
+        self.hamburg.is_active = True
+        self.hamburg.save()
+        self.assertCounts(3, 2, 2)
+
+        self.berlin.delete()
+        self.assertCounts(2, 1, 2)
+
+        self.kfz.delete()
+        self.domain.refresh_from_db()
+        self.assertEqual((self.domain.location_count, self.domain.category_count), (1, 1))
+
+    def test_batched_changes_are_recounted(self):
+        with batch_version_bumps():
+            self.munich.categories.add(self.optiker)
+            self.berlin.is_active = False
+            self.berlin.save()
+            # Not adjusted per row while batching
+            self.assertCounts(3, 2, 2)
+        self.assertCounts(2, 2, 2)
+
+    def test_recount_command_repairs_drift(self):
+        Domain.objects.filter(pk=self.domain.pk).update(location_count=99, category_count=0)
+        HierarchicalCategory.objects.filter(pk=self.kfz.pk).update(location_count=0)
+
+        out = StringIO()
+        call_command('recount_locations', 'handwerk', stdout=out)
+        self.assertCounts(3, 2, 2)
+        self.assertEqual(self.domain.category_count, 2)
+        self.assertIn('was 0 categories / 99 locations', out.getvalue())
+
+    def test_domain_list_reads_counters(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/hierarchical/domains/')
+        domain = response.json()['domains'][0]
+        self.assertEqual((domain['category_count'], domain['location_count']), (2, 3))
+        self.assertFalse([q for q in queries.captured_queries if 'maps_hierarchicallocation' in q['sql']])
+
+
+class DomainMembershipTests(HierarchicalDataMixin, TestCase):
+    def memberships(self, domain=None):
+        return dict(
+            DomainMembership.objects.filter(domain=domain or self.domain)
+            .values_list('location__location_id', 'category_ids')
+        )
+
+    def test_one_row_per_domain_and_location(self):
+        self.assertEqual(self.memberships(), {'b1': ['optiker'], 'm1': ['kfz'], 'h1': ['optiker', 'kfz']})
+
+    def test_membership_changes(self):
+        self.hamburg.categories.remove(self.optiker)
+        self.munich.categories.clear()
+        self.assertEqual(self.memberships(), {'b1': ['optiker'], 'h1': ['kfz']})
+        self.kfz.locations.add(self.berlin)
+        self.optiker.locations.clear()
+        self.assertEqual(self.memberships(), {'b1': ['kfz'], 'h1': ['kfz']})
+        self.optiker.locations.add(self.munich)
+        self.assertEqual(self.memberships(), {'b1': ['kfz'], 'h1': ['kfz'], 'm1': ['optiker']})
+
+    def test_category_moves_and_deletes(self):
+        other = Domain.objects.create(domain_id='gesundheit', name='Gesundheit')
+        self.optiker.domain = other
+        self.optiker.save()
+        self.assertEqual(self.memberships(), {'m1': ['kfz'], 'h1': ['kfz']})
+        self.assertEqual(self.memberships(other), {'b1': ['optiker'], 'h1': ['optiker']})
+
+        self.kfz.delete()
+        self.assertEqual(self.memberships(), {})
+
+    def test_batch_rebuilds_once(self):
+        with batch_version_bumps():
+            self.munich.categories.add(self.optiker)
+            self.berlin.delete()
+            # Not rewritten per row while batching
+            self.assertEqual(self.memberships()['m1'], ['kfz'])
+        self.assertEqual(self.memberships(), {'m1': ['optiker', 'kfz'], 'h1': ['optiker', 'kfz']})
+
+    def test_recount_command_rebuilds_memberships(self):
+        DomainMembership.objects.all().delete()
+        call_command('recount_locations', stdout=StringIO())
+        self.assertEqual(len(self.memberships()), 3)
+
+    def test_reads_skip_the_category_join(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/hierarchical/clusters/', {'domain': 'handwerk', 'z': CLUSTER_MAX_ZOOM + 1})
+            self.client.get('/api/hierarchical/locations/h1/', {'domain': 'handwerk'})
+        lookups = [q['sql'] for q in queries.captured_queries if 'maps_domainmembership' in q['sql']]
+        self.assertEqual(len(lookups), 2)
+        for sql in lookups:
+            self.assertNotIn('DISTINCT', sql)
+            self.assertNotIn('maps_hierarchicallocation_categories', sql)
+
+
+class ReadDatabaseTests(SimpleTestCase):
+    def test_reads_are_routed_only_inside_reading_database(self):
+        router = ReadDatabaseRouter()
+        self.assertIsNone(router.db_for_read(HierarchicalLocation))
+        with reading_database():
+            self.assertEqual(router.db_for_read(HierarchicalLocation), 'readonly')
+            location = HierarchicalLocation()
+            location._state.db = 'readonly'
+            self.assertEqual(router.db_for_write(HierarchicalLocation, instance=location), 'default')
+        self.assertIsNone(router.db_for_read(HierarchicalLocation))
+        self.assertFalse(router.allow_migrate('readonly', 'maps'))
+
+    def test_reads_inside_a_transaction_stay_on_default(self):
+        with mock.patch.object(connections['default'], 'in_atomic_block', True), reading_database():
+            self.assertIsNone(ReadDatabaseRouter().db_for_read(HierarchicalLocation))
+
+    @override_settings(MAPS_READ_DATABASE='missing')
+    def test_falls_back_to_default_without_alias(self):
+        with reading_database():
+            self.assertEqual(ReadDatabaseRouter().db_for_read(HierarchicalLocation), 'default')
+
+    def test_read_alias_is_query_only(self):
+        self.assertNotIn('query_only', connection_pragmas('default'))
+        self.assertEqual(connection_pragmas('readonly')['query_only'], 'ON')
+        self.assertEqual(connection_pragmas('readonly')['journal_mode'], 'WAL')
+
+    def test_streaming_content_is_read_inside_the_block(self):
+        from django.http import StreamingHttpResponse
+
+        router = ReadDatabaseRouter()
+
+        def chunks():
+            for _ in range(2):
+                yield router.db_for_read(HierarchicalLocation) or 'default'
+
+        view = use_read_database(lambda request: StreamingHttpResponse(chunks()))
+        response = view(None)
+        self.assertEqual(b''.join(response.streaming_content), b'readonlyreadonly')
+
+
+class SQLitePragmaTests(TestCase):
+    def test_connection_profile_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -65536)
+
+
+class SpatialIndexTests(HierarchicalDataMixin, TestCase):
+    def rtree_ids(self, table='maps_hierarchicallocation'):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {table}_rtree ORDER BY id')
+            return [row[0] for row in cursor.fetchall()]
+
+    def ids(self, bbox):
+        return sorted(HierarchicalLocation.objects.in_bbox(bbox).values_list('location_id', flat=True))
+
+    def test_rtree_follows_writes(self):
+        self.assertEqual(self.rtree_ids(), sorted([self.berlin.pk, self.munich.pk, self.hamburg.pk]))
+
+        created = HierarchicalLocation.objects.bulk_create([
+            HierarchicalLocation(location_id='k1', name='Köln', latitude=50.9375, longitude=6.9603),
+        ])
+        self.assertIn(created[0].pk, self.rtree_ids())
+        self.assertEqual(self.ids((6, 50, 7.5, 51.5)), ['k1'])
+
+        HierarchicalLocation.objects.filter(location_id='k1').update(latitude=48.1, longitude=11.5)
+        self.assertEqual(self.ids((6, 50, 7.5, 51.5)), [])
+        self.assertEqual(self.ids((11, 47, 12, 49)), ['k1', 'm1'])
+
+        self.munich.delete()
+        self.assertNotIn(self.munich.pk, self.rtree_ids())
+
+    def test_in_bbox_uses_rtree(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.ids((9, 52, 14, 54)), ['b1', 'h1'])
+        self.assertIn('maps_hierarchicallocation_rtree', queries.captured_queries[-1]['sql'])
+
+    def test_antimeridian_and_radius(self):
+        HierarchicalLocation.objects.create(location_id='f1', name='Suva', latitude=-18.14, longitude=178.44)
+        HierarchicalLocation.objects.create(location_id='s1', name='Apia', latitude=-13.83, longitude=-171.76)
+        self.assertEqual(self.ids((170, -20, -170, -10)), ['f1', 's1'])
+
+        bbox = radius_bbox(-18.14, 179.9, 200)
+        self.assertGreater(bbox[0], bbox[2])
+        self.assertEqual(self.ids(bbox), ['f1'])
+
+        near_suva = HierarchicalLocation.objects.in_radius(-18.14, 179.9, 200)
+        self.assertEqual([location.location_id for location in near_suva], ['f1'])
+        self.assertAlmostEqual(near_suva[0].distance_km, haversine_km(-18.14, 179.9, -18.14, 178.44), places=3)
+
+    def test_radius_cuts_bbox_corners(self):
+        # Potsdam is inside the bbox of a 25 km circle around Berlin, but 27.2 km away
+        HierarchicalLocation.objects.create(location_id='p1', name='Potsdam', latitude=52.3906, longitude=13.0645)
+        self.assertEqual(self.ids(radius_bbox(52.52, 13.405, 25)), ['b1', 'p1'])
+        with CaptureQueriesContext(connection) as queries:
+            ids = list(HierarchicalLocation.objects.in_radius(52.52, 13.405, 25).values_list('location_id', flat=True))
+        self.assertEqual(ids, ['b1'])
+        self.assertIn('maps_hierarchicallocation_rtree', queries.captured_queries[-1]['sql'])
+        self.assertEqual(HierarchicalLocation.objects.in_radius(52.52, 13.405, 28).count(), 2)
+
+    def test_legacy_locations(self):
+        cafe = Category.objects.create(name='Cafe', slug='cafe')
+        Location.objects.create(name='Cafe Hanoi', slug='cafe-hanoi', category=cafe,
+                                latitude=21.0285, longitude=105.8542, address='Hoan Kiem')
+        self.assertEqual(len(self.rtree_ids('maps_location')), 1)
+        self.assertEqual(Location.objects.in_bbox((105, 20, 106, 22)).count(), 1)
+        self.assertEqual(Location.objects.in_bbox((100, 20, 105, 22)).count(), 0)
+
+
+class QuadkeyTests(HierarchicalDataMixin, TestCase):
+    def test_quadkey_math(self):
+        self.assertEqual(tile_quadkey(3, 5, 3), '213')
+        self.assertEqual(quadkey_tile('213'), (3, 5, 3))
+        quadkey = point_quadkey(52.52, 13.405)
+        self.assertEqual(len(quadkey), 20)
+        self.assertEqual(quadkey[:12], tile_quadkey(*cell_for(52.52, 13.405, 10), 12))
+
+    def test_ranges_cover_bbox(self):
+        bbox = (13.3, 52.4, 13.5, 52.6)
+        ranges = quadkey_ranges(bbox)
+        self.assertLessEqual(len(ranges), 32)
+        self.assertTrue(any(low <= point_quadkey(52.52, 13.405) < high for low, high in ranges))
+        self.assertFalse(any(low <= point_quadkey(48.137, 11.575) < high for low, high in ranges))
+        self.assertEqual(quadkey_ranges((-180, -90, 180, 90)), [('00', '334')])
+
+    def test_save_sets_quadkey(self):
+        self.assertEqual(self.berlin.quadkey, point_quadkey(52.52, 13.405))
+        self.berlin.latitude, self.berlin.longitude = 48.137, 11.575
+        self.berlin.save()
+        self.berlin.refresh_from_db()
+        self.assertEqual(self.berlin.quadkey, point_quadkey(48.137, 11.575))
+
+        cafe = Category.objects.create(name='Cafe', slug='cafe')
+        location = Location.objects.create(name='Cafe Hanoi', slug='cafe-hanoi', category=cafe,
+                                           latitude=21.0285, longitude=105.8542, address='Hoan Kiem')
+        self.assertEqual(location.quadkey, point_quadkey(21.0285, 105.8542))
+
+    def test_fixture_rows_get_quadkey(self):
+        HierarchicalLocation.objects.filter(pk=self.munich.pk).update(quadkey='')
+        self.munich.refresh_from_db()
+        data = serializers.serialize('json', [self.munich])
+        for obj in serializers.deserialize('json', data):
+            obj.save()
+        self.munich.refresh_from_db()
+        self.assertEqual(self.munich.quadkey, point_quadkey(48.1351, 11.5820))
+
+    def test_in_bbox_without_rtree_uses_quadkey_ranges(self):
+        with mock.patch('maps.spatial.has_spatial_index', return_value=False):
+            with CaptureQueriesContext(connection) as queries:
+                ids = sorted(HierarchicalLocation.objects.in_bbox((9, 52, 14, 54)).values_list('location_id', flat=True))
+        self.assertEqual(ids, ['b1', 'h1'])
+        self.assertIn('"quadkey" >=', queries.captured_queries[-1]['sql'])
+        self.assertNotIn('_rtree', queries.captured_queries[-1]['sql'])
+
+
+class FloatCoordinateTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/locations/'
+
+    def test_features_read_float_projection(self):
+        with CaptureQueriesContext(connection) as queries:
+            features = self.client.get(self.url, {'domain': 'handwerk'}).json()['features']
+        coordinates = {f['properties']['id']: f['geometry']['coordinates'] for f in features}
+        self.assertEqual(coordinates['b1'], [13.405, 52.52])
+
+        location_queries = [q['sql'] for q in queries.captured_queries if 'FROM "maps_hierarchicallocation"' in q['sql']]
+        self.assertTrue(location_queries)
+        for sql in location_queries:
+            self.assertIn('CAST("maps_hierarchicallocation"."latitude" AS real)', sql)
+            self.assertNotIn('"maps_hierarchicallocation"."latitude",', sql)
+
+    def test_coordinates_property(self):
+        projected = HierarchicalLocation.objects.float_coordinates().get(pk=self.berlin.pk)
+        self.assertIsInstance(projected.lat, float)
+        self.assertEqual(projected.coordinates, [52.52, 13.405])
+        self.assertEqual(HierarchicalLocation.objects.get(pk=self.berlin.pk).coordinates, [52.52, 13.405])
+
+    def test_legacy_map_data_floats(self):
+        cafe = Category.objects.create(name='Cafe', slug='cafe')
+        Location.objects.create(name='Cafe Hanoi', slug='cafe-hanoi', category=cafe,
+                                latitude=21.0285, longitude=105.8542, address='Hoan Kiem')
+        location = self.client.get('/api/map-data/').json()['locations'][0]
+        self.assertEqual((location['latitude'], location['longitude']), (21.0285, 105.8542))
+        self.assertEqual(location['coordinates'], [21.0285, 105.8542])
+
+
+class SearchAPITests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/search/'
+
+    def test_matches_name_and_address(self):
+        data = self.client.get(self.url, {'q': 'hamburg', 'domain': 'handwerk'}).json()
+        self.assertEqual([l['location_id'] for l in data['locations']], ['h1'])
+        location = data['locations'][0]
+        self.assertEqual(location['address'], 'Hamburg, Germany')
+        self.assertEqual((location['latitude'], location['longitude']), (53.5511, 9.9937))
+        self.assertEqual(sorted(c['category_id'] for c in location['categories']), ['kfz', 'optiker'])
+
+        self.assertEqual(len(self.client.get(self.url, {'q': 'München'}).json()['locations']), 1)
+        self.assertEqual(self.client.get(self.url, {'q': 'optik', 'domain': 'other'}).json()['locations'], [])
+
+    def test_limit(self):
+        self.assertEqual(self.client.get(self.url, {'q': 'optik', 'limit': 'abc'}).status_code, 400)
+        self.assertEqual(len(self.client.get(self.url, {'q': 'optik', 'limit': 1}).json()['locations']), 1)
+        self.assertEqual(self.client.get(self.url, {'q': 'optik', 'limit': -5}).json()['locations'], [])
+        self.assertEqual(len(self.client.get(self.url, {'q': 'optik', 'limit': 10 ** 9}).json()['locations']), 2)
+
+
+class FullTextSearchTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/search/'
+
+    def search(self, q, **params):
+        locations = self.client.get(self.url, {'q': q, **params}).json()['locations']
+        return [location['location_id'] for location in locations]
+
+    def test_german_normalization(self):
+        self.assertEqual(normalize_word('straße'), 'strasse')
+        self.assertEqual(index_text('München Café'), 'muenchen munchen cafe')
+        self.assertEqual(match_expression('Köln  "Dom"'), '"koeln"* "dom"*')
+        self.assertIsNone(match_expression(' - '))
+
+    def test_spelling_variants_and_prefixes(self):
+        for q in ('München', 'muenchen', 'Munchen', 'münch', 'KFZ Mün'):
+            self.assertEqual(self.search(q), ['m1'], q)
+        self.assertEqual(self.search('augenopt'), ['b1', 'h1'])
+
+    def test_ranking_and_domain_filter(self):
+        other = Domain.objects.create(domain_id='gesundheit', name='Gesundheit')
+        clinic = HierarchicalCategory.objects.create(domain=other, category_id='klinik', name='Klinik')
+        clinic_location = self.create_location('c1', 'Klinik Mitte', 52.52, 13.40, 'Potsdam', [clinic])
+        clinic_location.description = 'Nahe Berlin'
+        clinic_location.save()
+
+        self.assertEqual(self.search('berlin'), ['b1', 'c1'])
+        self.assertEqual(self.search('berlin', domain='handwerk'), ['b1'])
+        self.assertEqual(self.search('berlin', domain='gesundheit'), ['c1'])
+
+    def test_index_follows_changes(self):
+        # Version bumps run on commit; they invalidate the cached responses
+        with self.captureOnCommitCallbacks(execute=True):
+            self.optiker.refresh_from_db()
+            self.optiker.name = 'Brillenmacher'
+            self.optiker.save()
+        self.assertEqual(self.search('brillen'), ['b1', 'h1'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hamburg.categories.remove(self.optiker)
+        self.assertEqual(self.search('brillen'), ['b1'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.berlin.street = 'Hauptstraße 1'
+            self.berlin.save()
+        self.assertEqual(self.search('hauptstrasse'), ['b1'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.berlin.delete()
+        self.assertEqual(self.search('hauptstrasse'), [])
+
+        with self.captureOnCommitCallbacks(execute=True), batch_version_bumps():
+            self.munich.name = 'Werkstatt Süd'
+            self.munich.save()
+            self.kfz.locations.add(self.create_location('n1', 'Neue Werkstatt', 50.0, 8.0, 'Mainz', []))
+        self.assertEqual(sorted(self.search('werkstatt')), ['m1', 'n1'])
+
+    def test_legacy_search_filter(self):
+        cafe = Category.objects.create(name='Café', slug='cafe')
+        for slug, name in (('a', 'Kaffeehaus'), ('b', 'Bäckerei Müller')):
+            Location.objects.create(name=name, slug=slug, category=cafe, latitude=21.0, longitude=105.8,
+                                    address='Hoan Kiem', city='Hanoi')
+        slugs = [l['slug'] for l in self.client.get('/api/locations/', {'search': 'baeckerei'}).json()]
+        self.assertEqual(slugs, ['b'])
+        slugs = [l['slug'] for l in self.client.get('/api/locations/', {'search': 'cafe'}).json()]
+        self.assertEqual(sorted(slugs), ['a', 'b'])
+
+
+
+
+class FacetTests(HierarchicalDataMixin, TestCase):
+    def test_search_facets_count_every_match(self):
+        other = Domain.objects.create(domain_id='gesundheit', name='Gesundheit')
+        clinic = HierarchicalCategory.objects.create(domain=other, category_id='klinik', name='Klinik')
+        self.create_location('c1', 'Optik Klinik', 52.5, 13.4, 'Berlin', [clinic, self.optiker])
+
+        data = self.client.get('/api/hierarchical/search/', {'q': 'optik', 'limit': 1, 'facets': 'all'}).json()
+        self.assertEqual(len(data['locations']), 1)
+        facets = data['facets']
+        self.assertEqual(facets['city'], [{'value': 'Berlin', 'count': 2}, {'value': 'Hamburg', 'count': 1}])
+        self.assertEqual([(f['id'], f['count']) for f in facets['domain']], [('handwerk', 3), ('gesundheit', 1)])
+        self.assertEqual(
+            [(f['domain_id'], f['name'], f['count']) for f in facets['category']],
+            [('handwerk', 'Augenoptiker', 3), ('gesundheit', 'Klinik', 1), ('handwerk', 'Kraftfahrzeugtechniker', 1)]
+        )
+
+        data = self.client.get('/api/hierarchical/search/', {'q': 'optik', 'domain': 'gesundheit', 'facets': 'domain'}).json()
+        self.assertEqual(data['facets'], {'domain': [{'id': 'gesundheit', 'name': 'Gesundheit', 'count': 1}]})
+        self.assertNotIn('facets', self.client.get('/api/hierarchical/search/', {'q': 'optik'}).json())
+
+    def test_locations_api_facets_in_few_queries(self):
+        from .hierarchical_views_new import HierarchicalLocationsAPI
+
+        url = '/api/hierarchical/locations/'
+        params = {'domain': 'handwerk', 'categories': 'kfz', 'facets': 'category,city'}
+        with self.assertNumQueries(2):
+            facets = HierarchicalLocationsAPI().build_facets('handwerk', ['kfz'], None, MATCH_ANY, ['category', 'city'])
+        self.assertEqual([(f['id'], f['count']) for f in facets['category']], [('kfz', 2), ('optiker', 1)])
+        self.assertEqual(self.client.get(url, params).json()['facets'], facets)
+        self.assertEqual(self.client.get(url, {**params, 'format': 'columnar'}).json()['facets'], facets)
+        streamed = json.loads(b''.join(self.client.get(url, {**params, 'stream': 1}).streaming_content))
+        self.assertEqual(streamed['facets'], facets)
+
+        self.assertEqual(self.client.get(url, {'domain': 'handwerk', 'facets': 'color'}).status_code, 400)
+        self.assertEqual(parse_facets('1'), ['category', 'city', 'domain'])
+
+
+class AutocompleteTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/autocomplete/'
+
+    def complete(self, q, **params):
+        response = self.client.get(self.url, {'q': q, 'domain': 'handwerk', **params})
+        self.assertEqual(response.status_code, 200)
+        return [(s['text'], s['type'], s['fuzzy']) for s in response.json()['suggestions']]
+
+    def test_word_start_prefixes(self):
+        self.assertEqual(self.complete('ham'), [
+            ('Hamburg', 'city', False), ('Optik & KFZ Hamburg', 'name', False),
+        ])
+        self.assertEqual(self.complete('Mün'), [('München', 'city', False), ('KFZ München', 'name', False)])
+        self.assertEqual(self.complete('muench'), self.complete('münch'))
+
+    def test_postal_codes_and_counts(self):
+        for location, postal_code in ((self.berlin, '10115'), (self.hamburg, '20095')):
+            location.refresh_from_db()
+            location.postal_code = postal_code
+            location.save()
+        self.create_location('b2', 'Optik Mitte', 52.53, 13.41, 'Berlin', [self.optiker])
+
+        data = self.client.get(self.url, {'q': 'ber', 'domain': 'handwerk'}).json()
+        self.assertEqual(data['suggestions'][0], {'text': 'Berlin', 'type': 'city', 'count': 2, 'fuzzy': False})
+        self.assertEqual(self.complete('101'), [('10115', 'postal_code', False)])
+
+    def test_typo_suggestions(self):
+        self.assertEqual(self.complete('hambrug'), [('Hamburg', 'city', True), ('Optik & KFZ Hamburg', 'name', True)])
+        self.assertEqual(self.complete('munchen', limit=1), [('München', 'city', True)])
+        self.assertEqual(self.complete('xyzzy'), [])
+        self.assertIn('hamburg', edits1('hambrug', 'abcdghmru'))
+
+    def test_rebuilt_after_import_and_validation(self):
+        index = get_autocomplete_index('handwerk')
+        self.assertIs(get_autocomplete_index('handwerk'), index)
+        with self.captureOnCommitCallbacks(execute=True), batch_version_bumps():
+            self.create_location('d1', 'Optik Dresden', 51.05, 13.74, 'Dresden', [self.optiker])
+        self.assertEqual(self.complete('dres'), [('Dresden', 'city', False), ('Optik Dresden', 'name', False)])
+
+        self.assertEqual(self.client.get(self.url, {'q': 'ber'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'q': 'ber', 'domain': 'handwerk', 'limit': 'x'}).status_code, 400)
+        self.assertEqual(self.complete(''), [])
+
+    def test_prefixes_with_many_keys_rank_every_match(self):
+        # More keys than one lookup scans, the best term sorting last
+        terms = {('name', f'zahnarzt {i:04d}'): (f'Zahnarzt {i:04d}', 1) for i in range(MAX_SCANNED_KEYS + 100)}
+        terms['name', 'zahnzentrum'] = ('Zahnzentrum', 40)
+        terms['city', 'zahna'] = ('Zahna', 5)
+        index = AutocompleteIndex('handwerk', 1, terms)
+        self.assertIn('zahn', index.top)
+        for prefix in ('z', 'zahn', 'zahna', 'zahnarzt 05', 'zahnz'):
+            start, end = index.prefix_range(prefix)
+            expected = sorted(set(index.ranks[start:end]))[:10]
+            matches = [s['text'] for s in index.complete(prefix) if not s['fuzzy']]
+            self.assertEqual(matches, [index.suggestions[rank]['text'] for rank in expected])
+        self.assertEqual([s['text'] for s in index.complete('zahn', limit=2)], ['Zahnzentrum', 'Zahna'])
+
+
+
+class NearbyTests(HierarchicalDataMixin, TestCase):
+    url = '/api/hierarchical/nearby/'
+    # Potsdam
+    point = {'lat': 52.3906, 'lng': 13.0645}
+
+    def nearby(self, **params):
+        response = self.client.get(self.url, {'domain': 'handwerk', **self.point, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(f['properties']['id'], f['properties']['distance_km']) for f in response.json()['features']]
+
+    def test_nearest_k_and_radius(self):
+        self.assertAlmostEqual(haversine_km(52.52, 13.405, 48.1351, 11.582), 504.2, places=0)
+        nearest = self.nearby(k=2)
+        self.assertEqual([location_id for location_id, _ in nearest], ['b1', 'h1'])
+        self.assertAlmostEqual(nearest[0][1], haversine_km(52.3906, 13.0645, 52.52, 13.405), places=3)
+
+        self.assertEqual([i for i, _ in self.nearby(radius_km=300)], ['b1', 'h1'])
+        self.assertEqual([i for i, _ in self.nearby(radius_km=1000, k=1)], ['b1'])
+        self.assertEqual(len(self.nearby(radius_km=20000)), 3)
+        self.assertEqual(self.nearby(radius_km=10), [])
+
+    def test_category_filter_and_fields(self):
+        self.assertEqual([i for i, _ in self.nearby(categories='kfz')], ['h1', 'm1'])
+        self.assertEqual([i for i, _ in self.nearby(categories='kfz,optiker', category_mode='all')], ['h1'])
+        feature = self.client.get(self.url, {'domain': 'handwerk', **self.point, 'k': 1, 'fields': 'city'}).json()
+        self.assertEqual(feature['features'][0]['properties']['city'], 'Berlin')
+        self.assertEqual(feature['features'][0]['geometry']['coordinates'], [13.405, 52.52])
+
+    def test_follows_data_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_location('p1', 'Optik Potsdam', 52.40, 13.06, 'Potsdam', [self.optiker])
+        self.assertEqual(self.nearby(k=1)[0][0], 'p1')
+        with self.captureOnCommitCallbacks(execute=True):
+            HierarchicalLocation.objects.get(location_id='p1').delete()
+        self.assertEqual(self.nearby(k=1)[0][0], 'b1')
+
+    def test_index_matches_brute_force(self):
+        rng = random.Random(7)
+        points = [(pk, rng.uniform(-89, 89), rng.uniform(-180, 180), ['a'] if pk % 3 else ['b'])
+                  for pk in range(2000)]
+        index = NearbyIndex('test', 1, points)
+        for lat, lng in ((0, 179.99), (88.5, 0), (-45, -100), (52.5, 13.4)):
+            expected = sorted((haversine_km(lat, lng, p_lat, p_lng), pk) for pk, p_lat, p_lng, _ in points)
+            self.assertEqual([pk for pk, _ in index.nearest(lat, lng, k=5)], [pk for _, pk in expected[:5]])
+            within = [pk for distance, pk in expected if distance <= 800]
+            self.assertEqual([pk for pk, _ in index.nearest(lat, lng, radius_km=800)], within)
+            only_b = [pk for _, pk in expected if pk % 3 == 0][:3]
+            self.assertEqual([pk for pk, _ in index.nearest(lat, lng, k=3, category_ids=['b'])], only_b)
+
+    def test_validation(self):
+        for params in ({'lat': 52}, {'lat': 95, 'lng': 13}, {'lat': 52, 'lng': 13, 'k': 0},
+                       {'lat': 52, 'lng': 13, 'radius_km': -1}, {'lat': 'x', 'lng': 13}):
+            self.assertEqual(self.client.get(self.url, {'domain': 'handwerk', **params}).status_code, 400, params)
+        self.assertEqual(self.client.get(self.url, {'lat': 52, 'lng': 13}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'domain': 'nope', 'lat': 52, 'lng': 13}).status_code, 404)
+
+
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def query_shape(sql):
+    """SQL with literals replaced by ?, so per-row repeats of a query compare equal"""
+    return SQL_LITERALS.sub('?', sql)
+
+
+def query_report(queries):
+    """
+    One line per distinct query shape with its count. Shapes run more than
+    once are marked +, the usual sign of an N+1.
+    """
+    lines = []
+    for shape, count in Counter(query_shape(q['sql']) for q in queries).most_common():
+        lines.append(f"{'+' if count > 1 else ' '} {count}x {shape}")
+    return '\n'.join(lines)
+
+
+class CaptureAllQueries:
+    """
+    CaptureQueriesContext over every database alias the test may use (the
+    map API reads through MAPS_READ_DATABASE). Aliases sharing a connection
+    count once.
+    """
+
+    def __init__(self, aliases=None):
+        self.aliases = aliases
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        self._contexts = {}
+        for alias in connections:
+            if self.aliases is not None and alias not in self.aliases:
+                continue
+            db = connections[alias]
+            if id(db) not in self._contexts:
+                self._contexts[id(db)] = self._stack.enter_context(CaptureQueriesContext(db))
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stack.__exit__(*exc_info)
+
+    def by_alias(self):
+        return {context.connection.alias: context.captured_queries for context in self._contexts.values()}
+
+    @property
+    def captured_queries(self):
+        return [query for queries in self.by_alias().values() for query in queries]
+
+    def __len__(self):
+        return len(self.captured_queries)
+
+
+def url_names(patterns, namespace=''):
+    """Qualified names of every named URL pattern, recursing into includes"""
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            prefix = f'{namespace}{pattern.namespace}:' if pattern.namespace else namespace
+            names |= url_names(pattern.url_patterns, prefix)
+        elif pattern.name:
+            names.add(f'{namespace}{pattern.name}')
+    return names
+
+
+# Maximum queries per endpoint on QueryBudgetTests' dataset (a cold request:
+# caches, data versions, category indexes and the cluster index are empty). The dataset has
+# several rows per table, so a per-row query breaks the budget.
+EndpointBudget = namedtuple('EndpointBudget', 'queries kwargs params', defaults=(None, None))
+QUERY_BUDGETS = {
+    'map_view': EndpointBudget(0),
+    'embed_map_view': EndpointBudget(2),
+    'embed_debug_view': EndpointBudget(0),
+    'embed_test_view': EndpointBudget(0),
+    'upload_geojson': EndpointBudget(3),
+    'data_collection': EndpointBudget(0),
+    'collection_sources': EndpointBudget(0),
+    'collection_stats': EndpointBudget(3),
+    'cache_stats': EndpointBudget(0),
+    'api-root': EndpointBudget(0),
+    'category-list': EndpointBudget(2),
+    'category-detail': EndpointBudget(2, {'slug': 'cafe'}),
+    'location-list': EndpointBudget(2),
+    'location-detail': EndpointBudget(2, {'slug': 'cafe-1'}),
+    'map_data': EndpointBudget(3),
+    'map_config': EndpointBudget(3),
+    'map_config_named': EndpointBudget(3, {'config_name': 'default'}),
+    'hierarchical_map_view': EndpointBudget(3),
+    'hierarchical_locations_api': EndpointBudget(4, params={'domain': 'handwerk'}),
+    'hierarchical_location_detail_api': EndpointBudget(4, {'location_id': 'b1'}),
+    'hierarchical_categories_api': EndpointBudget(2, params={'domain': 'handwerk'}),
+    'hierarchical_search_api': EndpointBudget(3, params={'q': 'o', 'domain': 'handwerk'}),
+    'hierarchical_autocomplete_api': EndpointBudget(2, params={'q': 'fra', 'domain': 'handwerk'}),
+    'hierarchical_domains_api': EndpointBudget(2),
+    'hierarchical_clusters_api': EndpointBudget(10, params={'domain': 'handwerk', 'z': 3}),
+    'hierarchical_nearby_api': EndpointBudget(5, params={'domain': 'handwerk', 'lat': 50, 'lng': 8, 'k': 5}),
+    'hierarchical_tiles_api': EndpointBudget(5, {'z': 0, 'x': 0, 'y': 0}, {'domain': 'handwerk'}),
+    'hierarchical:map': EndpointBudget(3),
+    'hierarchical:hierarchical_map': EndpointBudget(3),
+    'hierarchical:api_locations': EndpointBudget(4, params={'domain': 'handwerk'}),
+    'hierarchical:api_location_detail': EndpointBudget(4, {'location_id': 'b1'}),
+    'hierarchical:api_categories': EndpointBudget(2, params={'domain': 'handwerk'}),
+    'hierarchical:api_search': EndpointBudget(3, params={'q': 'o'}),
+    'hierarchical:api_autocomplete': EndpointBudget(2, params={'q': 'fra', 'domain': 'handwerk'}),
+    'hierarchical:api_domains': EndpointBudget(2),
+    'hierarchical:api_clusters': EndpointBudget(10, params={'domain': 'handwerk', 'z': 3}),
+    'hierarchical:api_nearby': EndpointBudget(5, params={'domain': 'handwerk', 'lat': 50, 'lng': 8, 'k': 5}),
+    'hierarchical:api_tiles': EndpointBudget(5, {'z': 0, 'x': 0, 'y': 0}, {'domain': 'handwerk'}),
+    'hierarchical:legacy_map': EndpointBudget(3),
+    'hierarchical:legacy_api': EndpointBudget(4, params={'domain': 'handwerk'}),
+}
+QUERY_BUDGET_EXEMPT = {
+    'collect_data_ajax',  # POST only
+    'admin_map_view',  # maps/admin_map.html is not part of the repository
+}
+
+
+class QueryBudgetTests(HierarchicalDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(4):
+            cls.create_location(f'x{i}', f'Optik {i}', 50.0 + i, 8.0 + i, 'Frankfurt', [cls.optiker, cls.kfz])
+
+        config = MapConfiguration.objects.create(name='default', is_default=True)
+        for name in ('Cafe', 'Bakery', 'Pharmacy'):
+            category = Category.objects.create(name=name, slug=name.lower())
+            config.categories.add(category)
+            for i in range(3):
+                Location.objects.create(
+                    name=f'{name} {i}', slug=f'{name.lower()}-{i}', category=category,
+                    latitude=21.0 + i / 100, longitude=105.8 + i / 100, address='Hoan Kiem', city='Hanoi'
+                )
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        settings_override = override_settings(VECTOR_TILE_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def cold_start(self):
+        """Forget everything an earlier request cached"""
+        cache.clear()
+        clear_category_indexes()
+        clear_autocomplete_indexes()
+        clear_nearby_indexes()
+        ClusterCell.objects.all().delete()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_every_endpoint_has_a_budget(self):
+        names = url_names(maps_urlpatterns) - QUERY_BUDGET_EXEMPT
+        self.assertEqual(names, set(QUERY_BUDGETS))
+
+    def test_endpoints_stay_within_budget(self):
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(name):
+                url = reverse(name, kwargs=budget.kwargs)
+                self.cold_start()
+                # Inside the test transaction the reads stay on default; see ReadDatabaseQueryTests
+                with CaptureAllQueries(self.databases) as queries:
+                    response = self.client.get(url, budget.params or {})
+                self.assertLess(response.status_code, 400, url)
+                # SQL time is in the failure report only: it depends on the machine
+                sql_ms = sum(float(q['time']) for q in queries.captured_queries) * 1000
+                self.assertLessEqual(
+                    len(queries), budget.queries,
+                    f'{url}: {len(queries)} queries ({sql_ms:.0f} ms of SQL), budget {budget.queries}\n'
+                    f'{query_report(queries.captured_queries)}'
+                )
+
+    def test_report_marks_repeated_queries(self):
+        report = query_report([
+            {'sql': 'SELECT 1 FROM a WHERE id = 3'},
+            {'sql': 'SELECT 1 FROM a WHERE id = 4'},
+            {'sql': "SELECT name FROM b WHERE slug = 'x'"},
+        ])
+        self.assertEqual(report.splitlines(), [
+            '+ 2x SELECT ? FROM a WHERE id = ?',
+            '  1x SELECT name FROM b WHERE slug = ?',
+        ])
+
+
+class ReadDatabaseQueryTests(TransactionTestCase):
+    """Outside a test transaction, so the map API reads really use the read alias"""
+    databases = {'default', 'readonly'}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        domain = Domain.objects.create(domain_id='handwerk', name='Handwerk')
+        optiker = HierarchicalCategory.objects.create(domain=domain, category_id='optiker', name='Augenoptiker')
+        for i in range(3):
+            location = HierarchicalLocation.objects.create(
+                location_id=f'o{i}', name=f'Optik {i}', latitude=50 + i, longitude=8 + i, city='Frankfurt'
+            )
+            location.categories.add(optiker)
+
+    def test_reads_are_counted_on_the_read_alias(self):
+        with CaptureAllQueries(self.databases) as queries:
+            response = self.client.get(reverse('hierarchical_locations_api'), {'domain': 'handwerk'})
+        self.assertEqual(len(response.json()['features']), 3)
+        by_alias = queries.by_alias()
+        self.assertEqual(by_alias['default'], [])
+        self.assertTrue(by_alias['readonly'])
+        self.assertLessEqual(len(queries), QUERY_BUDGETS['hierarchical_locations_api'].queries)
+
+    def test_legacy_api_reads_use_the_read_alias(self):
+        category = Category.objects.create(name='Cafe', slug='cafe')
+        Location.objects.create(name='Cafe 1', slug='cafe-1', category=category, latitude=21, longitude=105.8)
+        for name in ('category-list', 'location-list'):
+            with self.subTest(name), CaptureAllQueries(self.databases) as queries:
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(queries.by_alias()['default'], [])
+            self.assertTrue(queries.by_alias()['readonly'])
@@ -31,4 +31,5 @@ urlpatterns = [
     path('api/collect-data/', views.collect_data_ajax, name='collect_data_ajax'),
     path('api/collection-sources/', views.get_collection_sources, name='collection_sources'),
     path('api/collection-stats/', views.get_collection_stats, name='collection_stats'),
+    path('api/cache-stats/', views.get_cache_stats, name='cache_stats'),
 ] + map_urlpatterns  # Add hierarchical map URLs
\ No newline at end of file
@@ -0,0 +1,210 @@
+"""
+Mapbox Vector Tile (MVT) encoding for hierarchical locations
+Small in-tree protobuf writer, no native dependencies.
+Spec: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+
+from .geo import lat_to_tile_y, lng_to_tile_x, tile_bounds
+from .hierarchical_models import DataVersion, HierarchicalLocation
+from .spatial import float_coordinates
+
+TILE_EXTENT = 4096
+# Points up to this many extent units outside the tile are still encoded,
+# so symbols on tile edges are not clipped
+TILE_BUFFER = 64
+
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+# Protobuf wire types
+WIRE_VARINT = 0
+WIRE_LENGTH_DELIMITED = 2
+
+# MVT geometry
+GEOM_POINT = 1
+CMD_MOVE_TO = 1
+
+
+# Protobuf writer
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field_number, wire_type):
+    return _varint((field_number << 3) | wire_type)
+
+
+def _uint_field(field_number, value):
+    return _key(field_number, WIRE_VARINT) + _varint(value)
+
+
+def _bytes_field(field_number, payload):
+    return _key(field_number, WIRE_LENGTH_DELIMITED) + _varint(len(payload)) + payload
+
+
+def _string_field(field_number, value):
+    return _bytes_field(field_number, value.encode('utf-8'))
+
+
+def _packed_field(field_number, values):
+    return _bytes_field(field_number, b''.join(_varint(v) for v in values))
+
+
+# MVT encoding
+
+class TileLayer:
+    """One MVT layer: point features plus deduplicated key/value tables"""
+
+    def __init__(self, name, extent=TILE_EXTENT):
+        self.name = name
+        self.extent = extent
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def _index(self, table, item):
+        index = table.get(item)
+        if index is None:
+            index = table[item] = len(table)
+        return index
+
+    def add_point(self, feature_id, x, y, properties):
+        """Add a point in tile coordinates with string properties"""
+        tags = []
+        for key, value in properties.items():
+            tags.append(self._index(self.keys, key))
+            tags.append(self._index(self.values, str(value)))
+
+        geometry = [(CMD_MOVE_TO & 0x7) | (1 << 3), _zigzag(x), _zigzag(y)]
+
+        feature = (
+            _uint_field(1, feature_id)
+            + _packed_field(2, tags)
+            + _uint_field(3, GEOM_POINT)
+            + _packed_field(4, geometry)
+        )
+        self.features.append(feature)
+
+    def encode(self):
+        payload = bytearray(_uint_field(15, 2) + _string_field(1, self.name))
+        for feature in self.features:
+            payload += _bytes_field(2, feature)
+        for key in self.keys:
+            payload += _string_field(3, key)
+        for value in self.values:
+            payload += _bytes_field(4, _string_field(1, value))
+        payload += _uint_field(5, self.extent)
+        return bytes(payload)
+
+
+def encode_tile(layers):
+    """Serialize layers into an MVT tile (empty layers are skipped)"""
+    return b''.join(_bytes_field(3, layer.encode()) for layer in layers if layer.features)
+
+
+def build_tile(domain, z, x, y):
+    """
+    Encode one tile of a domain's active locations.
+
+    One layer per HierarchicalCategory (named by category_id); each feature
+    carries category_id, color and location_id attributes.
+    """
+    min_lng, min_lat, max_lng, max_lat = tile_bounds(x, y, z)
+    buffer_lng = (max_lng - min_lng) * TILE_BUFFER / TILE_EXTENT
+    buffer_lat = (max_lat - min_lat) * TILE_BUFFER / TILE_EXTENT
+
+    in_tile = HierarchicalLocation.objects.in_bbox((
+        max(-180.0, min_lng - buffer_lng), max(-90.0, min_lat - buffer_lat),
+        min(180.0, max_lng + buffer_lng), min(90.0, max_lat + buffer_lat),
+    ))
+    memberships = domain.memberships.filter(
+        location__is_active=True,
+        location__in=in_tile.values('pk'),
+    ).annotate(
+        **float_coordinates('location__')
+    ).values_list(
+        'location_id', 'location__location_id', 'lat', 'lng', 'category_ids'
+    ).order_by('location_id')
+    colors = dict(domain.categories.values_list('category_id', 'color'))
+
+    layers = {}
+    for pk, location_id, lat, lng, category_ids in memberships:
+        tile_x = round((lng_to_tile_x(lng, z) - x) * TILE_EXTENT)
+        tile_y = round((lat_to_tile_y(lat, z) - y) * TILE_EXTENT)
+        for category_id in category_ids:
+            layer = layers.get(category_id)
+            if layer is None:
+                layer = layers[category_id] = TileLayer(category_id)
+            layer.add_point(pk, tile_x, tile_y, {
+                'category_id': category_id,
+                'color': colors.get(category_id) or '#3388ff',
+                'location_id': location_id,
+            })
+
+    return encode_tile(layer for _, layer in sorted(layers.items()))
+
+
+# Disk cache
+
+def tile_cache_dir():
+    return Path(getattr(settings, 'VECTOR_TILE_CACHE_DIR', Path(settings.BASE_DIR) / 'cache' / 'tiles'))
+
+
+def prune_tiles(domain_id, version):
+    """Remove a domain's cached tiles of data versions before ``version``"""
+    domain_dir = tile_cache_dir() / domain_id
+    if not domain_dir.is_dir():
+        return
+    for stale in domain_dir.iterdir():
+        name = stale.name
+        if name.startswith('v') and name[1:].isdigit() and int(name[1:]) < version:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+def get_tile(domain, z, x, y):
+    """
+    Return tile bytes, served from the disk cache when possible.
+
+    Tiles live under <cache>/<domain_id>/v<data version>/z/x/y.pbf; older
+    versions are pruned when the version is bumped (see maps.signals), not
+    here. A tile that cannot be stored is still returned.
+    """
+    version = DataVersion.current(domain.domain_id)
+    path = tile_cache_dir() / domain.domain_id / f'v{version}' / str(z) / str(x) / f'{y}.pbf'
+
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    data = build_tile(domain, z, x, y)
+
+    # Write then rename so concurrent readers never see a partial tile
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        # e.g. the version directory was pruned meanwhile by a bump
+        tmp_path.unlink(missing_ok=True)
+
+    return data
@@ -1,19 +1,29 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.utils.text import slugify
 from django.core.files.storage import default_storage
 from django.core.management import call_command
+from django.db.models import Prefetch
 from django.http import JsonResponse
+from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.db.models import Count, Q
 from rest_framework import generics, viewsets, filters
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Category, Location, MapConfiguration
-from .serializers import CategorySerializer, LocationSerializer, LocationMinimalSerializer, MapConfigurationSerializer
+from .serializers import (
+    CategorySerializer, LocationSerializer, LocationMinimalSerializer, MapConfigurationSerializer,
+    with_location_counts
+)
 from .forms import GeoJSONUploadForm
+from .columnar import ColumnarBuilder
+from .conditional import legacy_scopes, versioned_etag
+from .database import use_read_database
+from .signals import batch_version_bumps
+from .snapshots import cache_stats, cached_response
 import json
 import os
 import sys
@@ -28,33 +38,54 @@ try:
 except ImportError:
     DataCollectionManager = None
 
+@method_decorator(use_read_database, name='dispatch')
+@method_decorator(cached_response('legacy-categories', legacy_scopes), name='dispatch')
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for categories"""
-    queryset = Category.objects.filter(is_active=True)
+    queryset = with_location_counts(Category.objects.filter(is_active=True))
     serializer_class = CategorySerializer
     lookup_field = 'slug'
 
+class FullTextSearchFilter(filters.SearchFilter):
+    """?search= answered from the full-text index (see maps.search), best match first"""
+    
+    def filter_queryset(self, request, queryset, view):
+        terms = ' '.join(self.get_search_terms(request))
+        if not terms:
+            return queryset
+        return queryset.search(terms)
+
+@method_decorator(use_read_database, name='dispatch')
+@method_decorator(cached_response('legacy-locations', legacy_scopes), name='dispatch')
 class LocationViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for locations with filtering"""
     queryset = Location.objects.filter(is_active=True).select_related('category')
     serializer_class = LocationSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter]
     filterset_fields = ['category', 'city', 'country', 'featured']
     search_fields = ['name', 'address', 'city', 'description']
     lookup_field = 'slug'
 
+@use_read_database
+@versioned_etag(legacy_scopes)
+@cached_response('map-data', legacy_scopes, stale=True)
 @api_view(['GET'])
 def map_data(request):
     """
     API endpoint to get all map data for frontend
     Optimized for map display with minimal data
+
+    format=columnar returns parallel arrays plus a category dictionary
+    (see maps.columnar) instead of serialized locations
     """
     # Get query parameters
     category_ids = request.GET.getlist('category')
     featured_only = request.GET.get('featured', 'false').lower() == 'true'
     
     # Filter locations
-    locations = Location.objects.filter(is_active=True).select_related('category')
+    locations = Location.objects.filter(is_active=True).select_related('category').defer(
+        'latitude', 'longitude'
+    ).float_coordinates()
     
     if category_ids:
         locations = locations.filter(category__id__in=category_ids)
@@ -63,13 +94,31 @@ def map_data(request):
         locations = locations.filter(featured=True)
     
     # Get categories
-    categories = Category.objects.filter(is_active=True)
+    categories = with_location_counts(Category.objects.filter(is_active=True))
     if category_ids:
         categories = categories.filter(id__in=category_ids)
     
+    categories_data = CategorySerializer(categories, many=True).data
+    
+    if request.GET.get('format') == 'columnar':
+        builder = ColumnarBuilder()
+        for category in categories_data:
+            builder.category_index(category['id'], category)
+        
+        rows = locations.values_list(
+            'id', 'name', 'lat', 'lng',
+            'category_id', 'category__name', 'category__color', 'category__icon'
+        )
+        for pk, name, latitude, longitude, category_id, category_name, color, icon in rows:
+            category_index = builder.category_index(category_id, {
+                'id': category_id, 'name': category_name, 'color': color, 'icon': icon
+            })
+            builder.add(pk, name, latitude, longitude, [category_index])
+        
+        return Response(builder.payload(total_locations=len(builder)))
+    
     # Serialize data
     locations_data = LocationMinimalSerializer(locations, many=True).data
-    categories_data = CategorySerializer(categories, many=True).data
     
     # Group locations by category for frontend
     locations_by_category = {}
@@ -86,15 +135,21 @@ def map_data(request):
         'total_locations': len(locations_data)
     })
 
+@use_read_database
+@versioned_etag(legacy_scopes)
+@cached_response('map-config', legacy_scopes)
 @api_view(['GET'])
 def map_config(request, config_name=None):
     """Get map configuration"""
+    configs = MapConfiguration.objects.prefetch_related(
+        Prefetch('categories', queryset=with_location_counts(Category.objects.all()))
+    )
     if config_name:
-        config = get_object_or_404(MapConfiguration, name=config_name)
+        config = get_object_or_404(configs, name=config_name)
     else:
-        config = MapConfiguration.objects.filter(is_default=True).first()
+        config = configs.filter(is_default=True).first()
         if not config:
-            config = MapConfiguration.objects.first()
+            config = configs.first()
     
     if not config:
         # Return default configuration
@@ -119,10 +174,7 @@ def embed_map_view(request):
         from .hierarchical_models import Domain, HierarchicalCategory
         
         # Get hierarchical data
-        domains = Domain.objects.filter(is_active=True).annotate(
-            category_count=Count('categories', filter=Q(categories__is_active=True)),
-            location_count=Count('categories__locations', filter=Q(categories__is_active=True))
-        ).order_by('name')
+        domains = Domain.objects.filter(is_active=True).order_by('name')
         
         # Get default domain (first one)
         domain = domains.first()
@@ -134,8 +186,6 @@ def embed_map_view(request):
         if domain:
             categories = HierarchicalCategory.objects.filter(
                 domain=domain, is_active=True
-            ).annotate(
-                location_count=Count('locations', filter=Q(locations__is_active=True))
             ).order_by('name')
             
             # Prepare categories data for JavaScript
@@ -215,6 +265,10 @@ def upload_geojson(request):
                 
                 if result['success']:
                     messages.success(request, f"Successfully imported {result['imported']} locations!")
+                    try:
+                        call_command('warm_map_cache', legacy_only=True, stdout=StringIO())
+                    except Exception as e:
+                        messages.warning(request, f"Map cache warm-up failed: {e}")
                     if result['skipped'] > 0:
                         messages.warning(request, f"Skipped {result['skipped']} invalid features.")
                 else:
@@ -238,6 +292,7 @@ def upload_geojson(request):
         'stats': stats
     })
 
+@batch_version_bumps()
 def process_geojson_upload(file_path, category_name, category_color, clear_existing):
     """Process uploaded GeoJSON file"""
     try:
@@ -337,7 +392,7 @@ def data_collection_interface(request):
     """Show data collection interface"""
     if not DataCollectionManager:
         messages.error(request, "Data collection system not available")
-        return redirect('map')
+        return redirect('map_view')
     
     manager = DataCollectionManager()
     interface_data = manager.get_user_selection_interface()
@@ -458,6 +513,8 @@ def get_collection_sources(request):
         })
 
 
+@use_read_database
+@cached_response('collection-stats', legacy_scopes)
 @api_view(['GET'])
 def get_collection_stats(request):
     """API endpoint to get current database stats"""
@@ -490,3 +547,18 @@ def get_collection_stats(request):
             'success': False,
             'error': str(e)
         })
+
+
+@api_view(['GET'])
+def get_cache_stats(request):
+    """Hit/miss counters of the map API response cache, per payload kind (this process only)"""
+    kinds = cache_stats()
+    hits = sum(counts['hits'] for counts in kinds.values())
+    misses = sum(counts['misses'] for counts in kinds.values())
+    return Response({
+        'backend': getattr(settings, 'MAP_CACHE_BACKEND', None),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        'kinds': kinds,
+    })
@@ -0,0 +1,137 @@
+"""
+Cache warm-up after a data refresh
+warm_map_cache() sends the requests the shipped pages make without a
+viewport, so their payloads are built and stored (see maps.snapshots)
+before the first visitor asks for them: the domain list, each domain's
+categories, the location payload of hierarchical_map.html in every
+Content-Encoding, and the legacy map data and config. Going through the
+views keeps the cache keys identical to those of live requests (browsers
+send ``Accept: */*``). Viewport requests (clusters, the map controls'
+location list) carry the visitor's bbox, so instead of their responses the
+indexes behind them are completed: cluster cells for domains that never had
+them (maps.clustering) and missing full-text documents (maps.search).
+
+Run by ``manage.py warm_map_cache``. The import commands call it when they
+finish unless the cache is process-local (locmem), where they would only
+fill their own process; the GeoJSON upload runs in a web process and
+always does.
+"""
+
+import logging
+import time
+from collections import namedtuple
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from . import search
+from .clustering import ensure_cluster_index
+from .compression import ENCODERS
+from .hierarchical_models import Domain, DomainMembership, HierarchicalLocation
+
+logger = logging.getLogger(__name__)
+
+# Location payloads requested without a viewport: label -> query parameters
+LOCATION_QUERIES = {
+    # hierarchical_map.html
+    'geojson': {'fields': 'address,phone,email,website,category_details'},
+}
+
+# size is in bytes, or in index entries (search documents, cluster cells)
+Artifact = namedtuple('Artifact', 'name seconds size unit')
+
+_factory = RequestFactory()
+
+
+def process_local_cache():
+    """Whether cached payloads are only visible to this process (LocMemCache)"""
+    return isinstance(caches['default'], LocMemCache)
+
+
+def _warm(name, path, params=None, **headers):
+    """Request ``path`` like a browser would; None when the view did not answer 200"""
+    request = _factory.get(path, params or {}, HTTP_ACCEPT='*/*', **headers)
+    match = resolve(path)
+    start = time.perf_counter()
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    seconds = time.perf_counter() - start
+    if response.status_code != 200:
+        logger.warning('Cache warm-up of %s failed with status %s', name, response.status_code)
+        return None
+    return Artifact(name, seconds, len(response.content), 'bytes')
+
+
+def _index_search(domain):
+    """Index the domain's locations that have no full-text document yet"""
+    table = HierarchicalLocation._meta.db_table
+    if not search.has_search_index(connection.alias, table):
+        return None
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT COUNT(*) FROM {DomainMembership._meta.db_table} m '
+            f'LEFT JOIN {search.fts_table(table)} f ON f.rowid = m.location_id '
+            'WHERE m.domain_id = %s AND f.rowid IS NULL',
+            [domain.pk]
+        )
+        missing = cursor.fetchone()[0]
+    if missing:
+        search.rebuild_domain(domain.pk)
+    documents = DomainMembership.objects.filter(domain=domain).count()
+    return Artifact(f'{domain.domain_id} search index', time.perf_counter() - start, documents, 'documents')
+
+
+def _index_clusters(domain):
+    """Build the domain's cluster cells if they were never built"""
+    start = time.perf_counter()
+    ensure_cluster_index(domain)
+    cells = domain.cluster_cells.count()
+    return Artifact(f'{domain.domain_id} cluster index', time.perf_counter() - start, cells, 'cells')
+
+
+def _warm_domain(domain):
+    domain_id = domain.domain_id
+    yield _index_search(domain)
+    yield _index_clusters(domain)
+    yield _warm(f'{domain_id} categories', reverse('hierarchical_categories_api'), {'domain': domain_id})
+
+    locations = reverse('hierarchical_locations_api')
+    for label, query in LOCATION_QUERIES.items():
+        params = {'domain': domain_id, **query}
+        yield _warm(f'{domain_id} {label}', locations, params)
+        for encoding in ENCODERS:
+            yield _warm(f'{domain_id} {label} {encoding}', locations, params, HTTP_ACCEPT_ENCODING=encoding)
+
+
+def _warm_legacy():
+    map_data = reverse('map_data')
+    # static/js/map.js
+    yield _warm('map-data', map_data)
+    yield _warm('map-config', reverse('map_config'))
+
+
+def _payloads(domain_ids, hierarchical, legacy):
+    if hierarchical:
+        yield _warm('domains', reverse('hierarchical_domains_api'))
+        domains = Domain.objects.order_by('domain_id')
+        if domain_ids is not None:
+            domains = domains.filter(domain_id__in=domain_ids)
+        for domain in domains:
+            yield from _warm_domain(domain)
+    if legacy:
+        yield from _warm_legacy()
+
+
+def warm_map_cache(domain_ids=None, hierarchical=True, legacy=True):
+    """
+    Build the hot payloads of the current data versions, yielding an
+    Artifact per payload as it is stored. ``domain_ids`` limits the
+    hierarchical domains (default: every domain); the domain list is
+    rebuilt with them.
+    """
+    return (artifact for artifact in _payloads(domain_ids, hierarchical, legacy) if artifact is not None)
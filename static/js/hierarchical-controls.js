@@ -10,9 +10,17 @@ class HierarchicalMapControls {
             position: 'topright',
             apiEndpoint: '/api/hierarchical/locations/',
             domainsEndpoint: '/api/hierarchical/domains/',
+            clustersEndpoint: '/api/hierarchical/clusters/',
+            detailEndpoint: '/api/hierarchical/locations/',  // + <location_id>/ for popups
+            listFields: 'address',     // Extra properties requested for the location list
+            responseFormat: 'columnar', // 'columnar' (compact parallel arrays) or 'geojson'
             autoLoad: true,
             collapsible: true,
             showStats: true,
+            viewportFiltering: true,   // Only load locations inside the visible map area
+            viewportPadding: 0.25,     // Extra margin around the viewport to load ahead
+            refetchDelay: 300,         // Debounce (ms) before refetching after a pan/zoom
+            useClusters: true,         // Draw server-side clusters at low zoom levels
             ...options
         };
         
@@ -26,6 +34,15 @@ class HierarchicalMapControls {
         this.selectedDomain = null;
         this.selectedCategories = new Set();
         this.visibleLocations = new Set();
+        this.loadedBounds = null;
+        this.loadedZoom = null;
+        this.loadedCategories = null;  // Category filter of the last load, null = all
+        this.refetchTimer = null;
+        
+        // Server-side clusters (low zoom levels)
+        this.clusters = [];
+        this.clusterMaxZoom = null;  // Learned from the clusters endpoint
+        this.clusteredLocationCount = 0;
         
         // UI elements
         this.controlContainer = null;
@@ -38,6 +55,11 @@ class HierarchicalMapControls {
         this.createControlUI();
         this.addToMap();
         
+        if (this.options.viewportFiltering) {
+            this.onMapMoveEnd = () => this.scheduleViewportRefetch();
+            this.map.on('moveend', this.onMapMoveEnd);
+        }
+        
         if (this.options.autoLoad) {
             this.loadDomains();
         }
@@ -326,31 +348,142 @@ class HierarchicalMapControls {
         
         // Load locations immediately
         setTimeout(() => {
-            this.loadLocations();
+            this.refreshData();
         }, 100);
     }
     
+    scheduleViewportRefetch() {
+        if (!this.selectedDomain) return;
+        
+        clearTimeout(this.refetchTimer);
+        this.refetchTimer = setTimeout(() => {
+            // Skip the request while the viewport stays inside what is already loaded
+            if (this.isViewportLoaded()) {
+                return;
+            }
+            this.refreshData();
+        }, this.options.refetchDelay);
+    }
+    
+    isClusteredZoom(zoom) {
+        return this.options.useClusters && this.clusterMaxZoom !== null && zoom <= this.clusterMaxZoom;
+    }
+    
+    isViewportLoaded() {
+        if (!this.loadedBounds || !this.loadedBounds.contains(this.map.getBounds())) {
+            return false;
+        }
+        
+        // Clusters change with every zoom level, individual locations do not
+        const zoom = this.map.getZoom();
+        return this.isClusteredZoom(zoom)
+            ? zoom === this.loadedZoom
+            : !this.isClusteredZoom(this.loadedZoom);
+    }
+    
+    refreshData() {
+        const zoom = this.map.getZoom();
+        const mayCluster = this.options.useClusters &&
+            (this.clusterMaxZoom === null || zoom <= this.clusterMaxZoom);
+        
+        return mayCluster ? this.loadClusters() : this.loadLocations();
+    }
+    
+    async loadClusters() {
+        if (!this.selectedDomain) return;
+        
+        try {
+            const zoom = this.map.getZoom();
+            const params = new URLSearchParams({
+                domain: this.selectedDomain,
+                z: zoom,
+                bbox: this.getViewportParams().bbox
+            });
+            
+            const response = await fetch(`${this.options.clustersEndpoint}?${params}`);
+            const data = await response.json();
+            
+            if (!data.meta) return;
+            
+            this.clusterMaxZoom = data.meta.cluster_max_zoom;
+            if (!data.meta.clustered) {
+                // Zoomed in past the clustering threshold
+                return this.loadLocations();
+            }
+            
+            this.clearMapLayers();
+            this.locations.clear();
+            this.visibleLocations.clear();
+            this.loadedCategories = null;
+            this.clusters = data.features;
+            
+            const bbox = data.meta.bbox;
+            this.loadedBounds = bbox
+                ? L.latLngBounds([bbox[1], bbox[0]], [bbox[3], bbox[2]])
+                : null;
+            this.loadedZoom = zoom;
+            
+            this.updateMapLayers();
+            this.updateLocationSummary();
+            console.log(`Clusters loaded: ${this.clusters.length} at zoom ${zoom}`);
+        } catch (error) {
+            console.error('Error loading clusters:', error);
+            this.showError('Unable to load cluster data');
+        }
+    }
+    
+    getViewportParams() {
+        const bounds = this.map.getBounds().pad(this.options.viewportPadding);
+        const west = Math.max(-180, bounds.getWest());
+        const east = Math.min(180, bounds.getEast());
+        const south = Math.max(-90, bounds.getSouth());
+        const north = Math.min(90, bounds.getNorth());
+        
+        return {
+            bbox: [west, south, east, north].map(v => v.toFixed(5)).join(','),
+            zoom: this.map.getZoom()
+        };
+    }
+    
     async loadLocations() {
         if (!this.selectedDomain) return;
         
         try {
-            const categoryIds = Array.from(this.selectedCategories);
             const params = new URLSearchParams({
                 domain: this.selectedDomain,
-                ...categoryIds.reduce((acc, id, index) => {
-                    acc[`categories[${index}]`] = id;
-                    return acc;
-                }, {})
+                format: this.options.responseFormat,
+                ...(this.options.listFields ? { fields: this.options.listFields } : {}),
+                ...(this.options.viewportFiltering ? this.getViewportParams() : {})
             });
             
+            // With every category selected the unfiltered (cached) domain payload is used
+            const filtered = this.selectedCategories.size < this.categories.size;
+            const loadedCategories = filtered ? new Set(this.selectedCategories) : null;
+            if (filtered) {
+                this.selectedCategories.forEach(id => params.append('categories[]', id));
+            }
+            
             const response = await fetch(`${this.options.apiEndpoint}?${params}`);
             const data = await response.json();
             
-            if (data.features) {
-                this.processLocations(data.features);
+            const columnar = data.format === 'columnar';
+            if (columnar || data.features) {
+                const bbox = data.meta && data.meta.bbox;
+                this.loadedBounds = bbox
+                    ? L.latLngBounds([bbox[1], bbox[0]], [bbox[3], bbox[2]])
+                    : null;
+                this.loadedZoom = this.map.getZoom();
+                this.loadedCategories = loadedCategories;
+                this.clusters = [];
+                
+                if (columnar) {
+                    this.processColumnarLocations(data);
+                } else {
+                    this.processLocations(data.features);
+                }
                 this.updateMapLayers();
                 this.updateLocationSummary();
-                console.log(`Locations loaded: ${data.features.length}, Visible locations: ${this.visibleLocations.size}`);
+                console.log(`Locations loaded: ${this.locations.size}, Visible locations: ${this.visibleLocations.size}`);
             }
         } catch (error) {
             console.error('Error loading locations:', error);
@@ -368,8 +501,7 @@ class HierarchicalMapControls {
             const props = feature.properties;
             const coords = feature.geometry.coordinates;
             
-            // Store location data
-            this.locations.set(props.id, {
+            this.storeLocation({
                 id: props.id,
                 name: props.name,
                 address: props.address,
@@ -377,25 +509,103 @@ class HierarchicalMapControls {
                 email: props.email,
                 website: props.website,
                 coordinates: [coords[1], coords[0]], // [lat, lng]
-                categories: props.categories || [],
+                categories: this.resolveCategories(props.categories || []),
                 feature: feature
             });
+        });
+    }
+    
+    processColumnarLocations(data) {
+        // Parallel arrays: coordinates are delta encoded integers, categories
+        // are indexes into data.category_dictionary (see maps/columnar.py)
+        this.clearMapLayers();
+        this.locations.clear();
+        this.visibleLocations.clear();
+        
+        const scale = Math.pow(10, data.precision);
+        const properties = data.properties || {};
+        const column = (name, index) => properties[name] ? properties[name][index] : undefined;
+        let lat = 0;
+        let lng = 0;
+        
+        for (let i = 0; i < data.ids.length; i++) {
+            lat += data.lat[i];
+            lng += data.lng[i];
             
-            // Check if location should be visible
-            const hasVisibleCategory = props.categories.some(cat => 
-                this.selectedCategories.has(cat.id)
-            );
+            this.storeLocation({
+                id: data.ids[i],
+                name: data.names[i],
+                address: column('address', i),
+                phone: column('phone', i),
+                email: column('email', i),
+                website: column('website', i),
+                coordinates: [lat / scale, lng / scale],
+                categories: data.categories[i].map(index => data.category_dictionary[index])
+            });
+        }
+    }
+    
+    storeLocation(location) {
+        // Contact details arrive with the popup detail request
+        location.detailLoaded = false;
+        this.locations.set(location.id, location);
+        
+        // Check if location should be visible
+        const hasVisibleCategory = location.categories.some(cat => 
+            this.selectedCategories.has(cat.id)
+        );
+        
+        if (hasVisibleCategory) {
+            this.visibleLocations.add(location.id);
+        }
+    }
+    
+    resolveCategories(categories) {
+        // Lean features carry category ids; look up name/color from the loaded categories
+        return categories.map(category => {
+            if (typeof category !== 'string') return category;
             
-            if (hasVisibleCategory) {
-                this.visibleLocations.add(props.id);
-            }
+            const known = this.categories.get(category);
+            return {
+                id: category,
+                name: known ? known.name : category,
+                color: known ? known.color : '#3388ff'
+            };
         });
     }
     
+    async loadLocationDetail(location, marker) {
+        if (location.detailLoaded) return;
+        
+        try {
+            const params = new URLSearchParams({ domain: this.selectedDomain });
+            const url = `${this.options.detailEndpoint}${encodeURIComponent(location.id)}/?${params}`;
+            const response = await fetch(url);
+            if (!response.ok) return;
+            
+            const props = (await response.json()).properties;
+            Object.assign(location, {
+                address: props.address,
+                phone: props.phone,
+                email: props.email,
+                website: props.website,
+                detailLoaded: true
+            });
+            marker.setPopupContent(this.createPopupContent(location));
+        } catch (error) {
+            console.error('Error loading location details:', error);
+        }
+    }
+    
     updateMapLayers() {
         // Clear existing layers
         this.clearMapLayers();
         
+        if (this.clusters.length) {
+            this.renderClusters();
+            return;
+        }
+        
         console.log(`updateMapLayers: ${this.selectedCategories.size} selected categories, ${this.visibleLocations.size} visible locations`);
         
         // Create layer groups for each category
@@ -422,9 +632,10 @@ class HierarchicalMapControls {
                 fillOpacity: 0.7
             });
             
-            // Add popup
+            // Add popup; full details are fetched when it opens
             const popupContent = this.createPopupContent(location);
             marker.bindPopup(popupContent);
+            marker.on('popupopen', () => this.loadLocationDetail(location, marker));
             
             // Add to appropriate layer groups
             location.categories.forEach(category => {
@@ -439,11 +650,65 @@ class HierarchicalMapControls {
         console.log(`Markers added to map: ${markersAdded}`);
     }
     
+    renderClusters() {
+        const layerGroup = L.layerGroup().addTo(this.map);
+        this.layerGroups.set('__clusters__', layerGroup);
+        this.clusteredLocationCount = 0;
+        
+        this.clusters.forEach(feature => {
+            const props = feature.properties;
+            const [lng, lat] = feature.geometry.coordinates;
+            
+            // Count only selected categories; locations in several categories are capped by the cell total
+            let count = 0;
+            let topCategoryId = null;
+            let topCount = 0;
+            Object.entries(props.categories || {}).forEach(([categoryId, categoryCount]) => {
+                if (!this.selectedCategories.has(categoryId)) return;
+                count += categoryCount;
+                if (categoryCount > topCount) {
+                    topCount = categoryCount;
+                    topCategoryId = categoryId;
+                }
+            });
+            count = Math.min(count, props.count);
+            if (count === 0) return;
+            
+            this.clusteredLocationCount += count;
+            
+            const marker = L.circleMarker([lat, lng], {
+                radius: Math.min(30, 8 + Math.log2(count) * 3),
+                fillColor: this.categories.get(topCategoryId)?.color || '#3388ff',
+                color: '#fff',
+                weight: 2,
+                opacity: 0.9,
+                fillOpacity: 0.6
+            });
+            
+            if (count > 1) {
+                marker.bindTooltip(`${count}`, {
+                    permanent: true,
+                    direction: 'center',
+                    className: 'cluster-count'
+                });
+            }
+            
+            // Zoom into the cluster
+            marker.on('click', () => {
+                this.map.setView([lat, lng], Math.min(this.map.getZoom() + 2, this.clusterMaxZoom + 1));
+            });
+            
+            layerGroup.addLayer(marker);
+        });
+        
+        console.log(`Clusters drawn for ${this.clusteredLocationCount} locations`);
+    }
+    
     createPopupContent(location) {
         return `
             <div class="location-popup">
                 <h4>${location.name}</h4>
-                <p><strong>Address:</strong><br>${location.address}</p>
+                <p><strong>Address:</strong><br>${location.address || ''}</p>
                 ${location.phone ? `<p><strong>Phone:</strong> ${location.phone}</p>` : ''}
                 ${location.email ? `<p><strong>Email:</strong> ${location.email}</p>` : ''}
                 ${location.website ? `<p><strong>Website:</strong> <a href="${location.website}" target="_blank">Visit</a></p>` : ''}
@@ -463,12 +728,23 @@ class HierarchicalMapControls {
             this.selectedCategories.delete(categoryId);
         }
         
+        if (this.needsCategoryReload()) {
+            this.refreshData();
+            return;
+        }
+        
         // Update visible locations and map
         this.updateVisibleLocations();
         this.updateMapLayers();
         this.updateLocationSummary();
     }
     
+    needsCategoryReload() {
+        // Locations were loaded for a category subset that misses a selected category
+        if (!this.loadedCategories || this.clusters.length) return false;
+        return Array.from(this.selectedCategories).some(id => !this.loadedCategories.has(id));
+    }
+    
     updateVisibleLocations() {
         this.visibleLocations.clear();
         
@@ -494,6 +770,10 @@ class HierarchicalMapControls {
         });
         
         console.log(`Select All: ${this.selectedCategories.size} categories selected`);
+        if (this.needsCategoryReload()) {
+            this.refreshData();
+            return;
+        }
         this.updateVisibleLocations();
         console.log(`After updateVisibleLocations: ${this.visibleLocations.size} locations visible`);
         this.updateMapLayers();
@@ -519,8 +799,13 @@ class HierarchicalMapControls {
         const visibleSpan = this.controlContainer.querySelector('.visible-count');
         const totalSpan = this.controlContainer.querySelector('.total-count');
         
-        visibleSpan.textContent = this.visibleLocations.size;
-        totalSpan.textContent = this.locations.size;
+        if (this.clusters.length) {
+            visibleSpan.textContent = this.clusteredLocationCount;
+            totalSpan.textContent = this.clusters.reduce((sum, cluster) => sum + cluster.properties.count, 0);
+        } else {
+            visibleSpan.textContent = this.visibleLocations.size;
+            totalSpan.textContent = this.locations.size;
+        }
         
         // Update location list
         this.updateLocationList();
@@ -540,6 +825,11 @@ class HierarchicalMapControls {
         
         console.log(`updateLocationList: ${this.visibleLocations.size} visible locations, ${this.locations.size} total locations`);
         
+        if (this.clusters.length) {
+            locationList.innerHTML = '<div class="loading-message">Zoom in to see individual locations</div>';
+            return;
+        }
+        
         if (this.visibleLocations.size === 0) {
             locationList.innerHTML = '<div class="loading-message">No locations available for selected categories</div>';
             return;
@@ -630,7 +920,9 @@ class HierarchicalMapControls {
         const domainCount = this.domains.size;
         const categoryCount = this.categories.size;
         const selectedCategoryCount = this.selectedCategories.size;
-        const visibleLocationCount = this.visibleLocations.size;
+        const visibleLocationCount = this.clusters.length
+            ? this.clusteredLocationCount
+            : this.visibleLocations.size;
         
         statsDiv.innerHTML = `
             <small>
@@ -687,6 +979,9 @@ class HierarchicalMapControls {
     }
     
     clearLocations() {
+        this.loadedBounds = null;
+        this.loadedZoom = null;
+        this.clusters = [];
         this.locations.clear();
         this.visibleLocations.clear();
         this.clearMapLayers();
@@ -749,6 +1044,10 @@ class HierarchicalMapControls {
     }
     
     destroy() {
+        clearTimeout(this.refetchTimer);
+        if (this.onMapMoveEnd) {
+            this.map.off('moveend', this.onMapMoveEnd);
+        }
         if (this.leafletControl) {
             this.map.removeControl(this.leafletControl);
         }
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Shared helpers for the performance benchmarks
+Runs Django against a separate SQLite file seeded with synthetic locations,
+so the development database is never touched.
+"""
+
+import atexit
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(PROJECT_ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mapproject.settings')
+
+import django
+
+# Rough bounding box of Germany
+LAT_RANGE = (47.3, 55.0)
+LNG_RANGE = (5.9, 15.0)
+CITIES = ['Berlin', 'Hamburg', 'München', 'Köln', 'Frankfurt', 'Stuttgart', 'Düsseldorf', 'Leipzig']
+
+
+def benchmark_db(name, path=None):
+    """
+    SQLite file of a benchmark run: ``path`` when given (kept), otherwise
+    ``bench_<name>.sqlite3`` in the temp directory, deleted with its WAL
+    files when the run ends.
+    """
+    if path:
+        return path
+    db_path = Path(tempfile.gettempdir()) / f'bench_{name}.sqlite3'
+    atexit.register(_remove_db, db_path)
+    return str(db_path)
+
+
+def _remove_db(db_path):
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        Path(f'{db_path}{suffix}').unlink(missing_ok=True)
+
+
+def setup_django(db_path):
+    """Point the default database (and the read-only alias) at ``db_path`` and run migrations"""
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connections
+
+    for alias in connections:
+        connections[alias].close()
+        connections[alias].settings_dict['NAME'] = str(db_path)
+    connection = connections['default']
+    call_command('migrate', verbosity=0)
+    return connection
+
+
+def seed_locations(count, domain_id='bench', categories=20, seed=42):
+    """
+    Create one domain with ``categories`` categories and ``count`` locations.
+    Each location belongs to one or two categories. Skipped if already seeded.
+    """
+    from maps.geo import point_quadkey
+    from maps.memberships import rebuild_domain
+    from maps.search import rebuild_domain as rebuild_search_domain
+    from maps.hierarchical_models import (
+        Domain, HierarchicalCategory, HierarchicalLocation, HierarchicalLocationRaw
+    )
+
+    domain, _ = Domain.objects.get_or_create(domain_id=domain_id, defaults={'name': 'Benchmark'})
+    existing = HierarchicalLocation.objects.filter(location_id__startswith=f'{domain_id}-').count()
+    if existing >= count:
+        return domain
+
+    rng = random.Random(seed)
+    category_objects = [
+        HierarchicalCategory.objects.get_or_create(
+            domain=domain, category_id=f'cat-{i}',
+            defaults={'name': f'Category {i}', 'color': '#%06x' % rng.randrange(0xFFFFFF)}
+        )[0]
+        for i in range(categories)
+    ]
+
+    through = HierarchicalLocation.categories.through
+    batch = 5000
+    for start in range(existing, count, batch):
+        # bulk_create() skips save(), so set the quadkey here
+        points = [
+            (round(rng.uniform(*LAT_RANGE), 7), round(rng.uniform(*LNG_RANGE), 7))
+            for _ in range(start, min(start + batch, count))
+        ]
+        locations = [
+            HierarchicalLocation(
+                location_id=f'{domain_id}-{i}',
+                name=f'Location {i}',
+                slug=f'location-{i}',
+                latitude=lat,
+                longitude=lng,
+                quadkey=point_quadkey(lat, lng),
+                street=f'Hauptstraße {i % 200}',
+                city=rng.choice(CITIES),
+                postal_code=f'{rng.randrange(10000, 99999)}',
+            )
+            for i, (lat, lng) in enumerate(points, start)
+        ]
+        HierarchicalLocation.objects.bulk_create(locations)
+        created = HierarchicalLocation.objects.filter(
+            location_id__in=[location.location_id for location in locations]
+        ).values_list('id', 'location_id')
+        HierarchicalLocationRaw.objects.bulk_create([
+            HierarchicalLocationRaw(
+                location_id=location_pk,
+                data={'id': location_id, 'source': 'benchmark', 'payload': 'x' * 400},
+            )
+            for location_pk, location_id in created
+        ])
+        memberships = []
+        for location_pk, _ in created:
+            for category in rng.sample(category_objects, rng.choice((1, 1, 2))):
+                memberships.append(through(hierarchicallocation_id=location_pk, hierarchicalcategory_id=category.pk))
+        through.objects.bulk_create(memberships)
+
+    # bulk_create() sends no m2m signals either
+    rebuild_domain(domain.pk)
+    rebuild_search_domain(domain.pk)
+    return domain
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """Best wall time of ``repeat`` runs, returns (seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Benchmark: autocomplete lookups in the in-memory index vs. an FTS5 query
+Builds the AutocompleteIndex of the seeded domain once, then times what a
+search box sends while typing: short prefixes, full words, postal codes and
+typos. The FTS5 column shows the same text as a search() query (first 10
+rows) for comparison.
+
+Usage:
+    python tests/performance/benchmark_autocomplete.py [--locations 100000]
+"""
+
+import argparse
+import time
+
+from bench_utils import benchmark_db, seed_locations, setup_django, timed
+
+QUERIES = ['b', 'be', 'ber', 'Stuttgart', 'Location 47', '543', 'Muenchn', 'Locatoin 12', 'xyzzy']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'autocomplete_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    domain = seed_locations(args.locations)
+
+    from maps.autocomplete import get_autocomplete_index
+    from maps.hierarchical_models import HierarchicalLocation
+
+    start = time.perf_counter()
+    index = get_autocomplete_index(domain.domain_id)
+    print(f'Index build: {(time.perf_counter() - start) * 1000:.0f} ms, '
+          f'{len(index.suggestions)} terms, {len(index.keys)} keys')
+
+    def fts(query):
+        return list(HierarchicalLocation.objects.search(query).values_list('pk', flat=True)[:10])
+
+    print(f"\n{'query':<14} {'index µs':>9} {'FTS5 µs':>9} {'hits':>5} {'fuzzy':>6}")
+    for query in QUERIES:
+        index_time, suggestions = timed(index.complete, query, repeat=20)
+        fts_time, _ = timed(fts, query, repeat=5)
+        fuzzy = sum(1 for suggestion in suggestions if suggestion['fuzzy'])
+        print(f'{query:<14} {index_time * 1e6:>9.0f} {fts_time * 1e6:>9.0f} {len(suggestions):>5} {fuzzy:>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Benchmark: domain lookups via the category join vs. the DomainMembership table
+Times counting and listing the locations of a domain, and fetching the ones
+in a city sized viewport, once through the location/category m2m with
+DISTINCT and once as a range scan over DomainMembership.
+
+Usage:
+    python tests/performance/benchmark_domain_memberships.py [--locations 100000]
+"""
+
+import argparse
+
+from bench_utils import benchmark_db, seed_locations, setup_django, timed
+
+CITY_BBOX = (13.2, 52.4, 13.6, 52.6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'memberships_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    connection = setup_django(db_path)
+    domain = seed_locations(args.locations)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    from maps.hierarchical_models import DomainMembership, HierarchicalLocation
+
+    def join_locations():
+        return HierarchicalLocation.objects.filter(categories__domain=domain, is_active=True).distinct()
+
+    def membership_rows():
+        return DomainMembership.objects.filter(domain=domain, location__is_active=True)
+
+    in_city = HierarchicalLocation.objects.in_bbox(CITY_BBOX).values('pk')
+    cases = [
+        ('count: join + DISTINCT', lambda: join_locations().count()),
+        ('count: memberships', lambda: membership_rows().count()),
+        ('ids: join + DISTINCT', lambda: len(list(join_locations().values_list('location_id', flat=True)))),
+        ('ids: memberships', lambda: len(list(membership_rows().values_list('location__location_id', flat=True)))),
+        ('city: join + DISTINCT', lambda: len(list(join_locations().filter(pk__in=in_city).values_list('pk', flat=True)))),
+        ('city: memberships', lambda: len(list(membership_rows().filter(location__in=in_city).values_list('location_id', flat=True)))),
+    ]
+
+    print(f"\n{'case':<26} {'rows':>8} {'ms':>9}")
+    for name, func in cases:
+        seconds, rows = timed(func, repeat=5)
+        print(f'{name:<26} {rows:>8} {seconds * 1000:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
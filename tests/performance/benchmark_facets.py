@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Benchmark: facet counts, one COUNT query per facet vs. maps.facets
+Times category, city and domain counts of search matches and of a whole
+domain, once as a GROUP BY query per facet and once with facet_counts()
+(one query joined to DomainMembership, counted in a single pass).
+
+Usage:
+    python tests/performance/benchmark_facets.py [--locations 100000]
+"""
+
+import argparse
+
+from bench_utils import benchmark_db, seed_locations, setup_django, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'facets_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    domain = seed_locations(args.locations)
+
+    from django.db.models import Count
+    from maps.facets import FACETS, facet_counts
+    from maps.hierarchical_models import HierarchicalLocation
+
+    def per_facet(locations):
+        locations = locations.order_by()
+        return {
+            facet: list(locations.values(column).annotate(count=Count('pk', distinct=True)))
+            for facet, column in (
+                ('category', 'categories__category_id'),
+                ('city', 'city'),
+                ('domain', 'categories__domain__domain_id'),
+            )
+        }
+
+    matches = {
+        'search "stutt"': HierarchicalLocation.objects.search('stutt'),
+        'search "location 1"': HierarchicalLocation.objects.search('location 1'),
+        'whole domain': HierarchicalLocation.objects.filter(domain_memberships__domain=domain),
+    }
+
+    print(f"\n{'match':<22} {'rows':>7} {'per facet ms':>13} {'one pass ms':>12}")
+    for name, locations in matches.items():
+        rows = locations.count()
+        separate_time, _ = timed(per_facet, locations, repeat=3)
+        single_time, _ = timed(facet_counts, locations, FACETS, repeat=3)
+        print(f'{name:<22} {rows:>7} {separate_time * 1000:>13.1f} {single_time * 1000:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Benchmark: coordinate serialization via Decimal vs. the SQL float projection
+Times reading every coordinate pair as Decimal and converting with float()
+against casting in SQL, then the end-to-end GeoJSON and columnar builds of
+HierarchicalLocationsAPI.
+
+Usage:
+    python tests/performance/benchmark_float_coordinates.py [--locations 100000]
+"""
+
+import argparse
+
+from bench_utils import benchmark_db, seed_locations, setup_django, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'coordinates_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    seed_locations(args.locations)
+
+    from django.db.models import FloatField
+    from django.db.models.functions import Cast
+    from maps.hierarchical_models import HierarchicalLocation
+    from maps.hierarchical_views_new import HierarchicalLocationsAPI
+
+    def decimal_rows():
+        rows = HierarchicalLocation.objects.values_list('latitude', 'longitude')
+        return [[float(lng), float(lat)] for lat, lng in rows.iterator(chunk_size=2000)]
+
+    def float_rows():
+        rows = HierarchicalLocation.objects.values_list(
+            Cast('latitude', FloatField()), Cast('longitude', FloatField())
+        )
+        return [[lng, lat] for lat, lng in rows.iterator(chunk_size=2000)]
+
+    api = HierarchicalLocationsAPI()
+    cases = [
+        ('rows: Decimal + float()', decimal_rows),
+        ('rows: SQL float cast', float_rows),
+        ('build_geojson', lambda: api.build_geojson('bench', [], None, None)),
+        ('build_columnar', lambda: api.build_columnar('bench', [], None, None)),
+    ]
+
+    api.build_geojson('bench', [], None, None)  # warm the category index
+    print(f"\n{'case':<26} {'ms':>9}")
+    for name, func in cases:
+        seconds, _ = timed(func, repeat=3)
+        print(f'{name:<26} {seconds * 1000:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Benchmark: size and scan speed of the HierarchicalLocation table
+Reports the bytes SQLite stores for the location table (and the raw data
+side table when present), a full table scan and the columnar map payload.
+
+Usage:
+    python tests/performance/benchmark_location_table.py [--locations 100000]
+"""
+
+import argparse
+
+from bench_utils import benchmark_db, seed_locations, setup_django, timed
+
+
+def table_sizes(connection):
+    """table name -> bytes, from SQLite's dbstat virtual table"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name, SUM(pgsize) FROM dbstat "
+            "WHERE name LIKE 'maps_hierarchicallocation%' GROUP BY name ORDER BY name"
+        )
+        return dict(cursor.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'location_table_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    connection = setup_django(db_path)
+    seed_locations(args.locations)
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM')
+
+    from maps.hierarchical_views_new import HierarchicalLocationsAPI
+
+    print(f"\n{'table':<40} {'MB':>8}")
+    for name, size in table_sizes(connection).items():
+        if name in ('maps_hierarchicallocation', 'maps_hierarchicallocationraw'):
+            print(f'{name:<40} {size / 1e6:>8.1f}')
+
+    def full_scan():
+        # No index covers name, so every row of the table is read
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM maps_hierarchicallocation WHERE name LIKE '%9%'")
+            return cursor.fetchone()[0]
+
+    api = HierarchicalLocationsAPI()
+    api.build_columnar('bench', [], None, None)  # warm the category index
+    print(f"\n{'case':<26} {'ms':>9}")
+    for name, func in [
+        ('full table scan', full_scan),
+        ('build_columnar', lambda: api.build_columnar('bench', [], None, None)),
+    ]:
+        seconds, _ = timed(func, repeat=5)
+        print(f'{name:<26} {seconds * 1000:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Benchmark: nearest-location queries, table scan vs. the in-memory grid index
+Times k-nearest and radius queries at random points once the way a view
+without an index would do it (read every coordinate of the domain and rank
+by haversine in Python) and once through NearbyIndex.nearest(). Radius
+queries are also timed through objects.in_radius() (R*Tree prefilter, exact
+distance cut in SQL).
+
+Usage:
+    python tests/performance/benchmark_nearby.py [--locations 100000]
+"""
+
+import argparse
+import random
+import time
+
+from bench_utils import LAT_RANGE, LNG_RANGE, benchmark_db, seed_locations, setup_django, timed
+
+QUERIES = [('k=1', {'k': 1}), ('k=10', {'k': 10}), ('k=100', {'k': 100}),
+           ('r=5 km', {'radius_km': 5}), ('r=25 km', {'radius_km': 25}), ('k=10 r=50 km', {'k': 10, 'radius_km': 50})]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--points', type=int, default=20, help='Query points per row')
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'nearby_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    domain = seed_locations(args.locations)
+
+    from maps.geo import haversine_km
+    from maps.nearby import get_nearby_index
+    from maps.spatial import float_coordinates
+
+    from maps.hierarchical_models import HierarchicalLocation
+
+    def sql_radius(lat, lng, k=None, radius_km=None):
+        rows = HierarchicalLocation.objects.filter(
+            is_active=True, pk__in=domain.memberships.values('location_id')
+        ).in_radius(lat, lng, radius_km).order_by('distance_km').values_list('pk', 'distance_km')
+        return list(rows[:k] if k else rows)
+
+    def scan(lat, lng, k=None, radius_km=None):
+        rows = domain.memberships.filter(location__is_active=True).annotate(
+            **float_coordinates('location__')
+        ).values_list('location_id', 'lat', 'lng')
+        ranked = sorted((haversine_km(lat, lng, p_lat, p_lng), pk) for pk, p_lat, p_lng in rows)
+        if radius_km is not None:
+            ranked = [row for row in ranked if row[0] <= radius_km]
+        return ranked[:k] if k else ranked
+
+    start = time.perf_counter()
+    index = get_nearby_index(domain.domain_id)
+    print(f'Index build: {(time.perf_counter() - start) * 1000:.0f} ms, {len(index.cells)} cells')
+
+    rng = random.Random(5)
+    points = [(rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE)) for _ in range(args.points)]
+
+    print(f"\n{'query':<14} {'scan ms':>9} {'R*Tree ms':>10} {'index ms':>9} {'rows':>6}")
+    for name, params in QUERIES:
+        scan_time, _ = timed(lambda: [scan(lat, lng, **params) for lat, lng in points[:3]], repeat=1)
+        sql = '-'
+        if params.get('radius_km'):
+            sql_time, _ = timed(lambda: [sql_radius(lat, lng, **params) for lat, lng in points], repeat=3)
+            sql = f'{sql_time / len(points) * 1000:.2f}'
+        index_time, results = timed(lambda: [index.nearest(lat, lng, **params) for lat, lng in points], repeat=3)
+        print(f'{name:<14} {scan_time / 3 * 1000:>9.1f} {sql:>10} {index_time / len(points) * 1000:>9.3f} '
+              f'{sum(len(r) for r in results) / len(points):>6.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Benchmark: map API requests with a cold and a warm response cache
+Times each read endpoint once right after the cache is cleared and then
+while its response is cached (keyed by data version, see maps.snapshots),
+for the configured MAP_CACHE_BACKEND.
+
+Usage:
+    python tests/performance/benchmark_response_cache.py [--locations 100000]
+"""
+
+import argparse
+
+from bench_utils import benchmark_db, seed_locations, setup_django, timed
+
+ENDPOINTS = [
+    ('domains', '/api/hierarchical/domains/', {}),
+    ('categories', '/api/hierarchical/categories/', {'domain': 'bench'}),
+    ('search', '/api/hierarchical/search/', {'q': 'stutt', 'domain': 'bench'}),
+    ('clusters z=10', '/api/hierarchical/clusters/', {'domain': 'bench', 'z': 10, 'bbox': '8,48,10,50'}),
+    ('clusters z=16', '/api/hierarchical/clusters/', {'domain': 'bench', 'z': 16, 'bbox': '9.1,48.7,9.3,48.8'}),
+    ('nearby', '/api/hierarchical/nearby/', {'domain': 'bench', 'lat': 48.78, 'lng': 9.18, 'k': 50}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'response_cache_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    seed_locations(args.locations)
+
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.test import Client
+
+    client = Client(SERVER_NAME='localhost')
+
+    def cold(url, params):
+        cache.clear()
+        return client.get(url, params)
+
+    print(f"\nbackend: {settings.MAP_CACHE_BACKEND}")
+    print(f"{'endpoint':<16} {'cold ms':>9} {'warm ms':>9} {'bytes':>9}")
+    for name, url, params in ENDPOINTS:
+        # Per-process indexes (nearby, category) are built once up front
+        client.get(url, params)
+        cold_time, response = timed(cold, url, params, repeat=3)
+        client.get(url, params)
+        warm_time, response = timed(client.get, url, params, repeat=20)
+        assert response['X-Cache'] == 'HIT'
+        print(f'{name:<16} {cold_time * 1000:>9.2f} {warm_time * 1000:>9.2f} {len(response.content):>9}')
+
+
+if __name__ == '__main__':
+    main()
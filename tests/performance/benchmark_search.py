@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Benchmark: location search via icontains vs. the FTS5 index
+Times typeahead-style queries (growing prefixes of a name, a city, a
+category) once as the old name/street/city icontains scan and once through
+objects.search() with BM25 ranking, both limited to the first 20 rows.
+
+Usage:
+    python tests/performance/benchmark_search.py [--locations 100000]
+"""
+
+import argparse
+
+from bench_utils import benchmark_db, seed_locations, setup_django, timed
+
+QUERIES = ['Loc', 'Stutt', 'Category 7', 'Location 12', 'Location 4711', 'Hauptstraße 17 Köln', '5432']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'search_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    seed_locations(args.locations)
+
+    from django.db.models import Q
+    from maps.hierarchical_models import HierarchicalLocation
+
+    def icontains(query):
+        return list(HierarchicalLocation.objects.filter(
+            Q(name__icontains=query) | Q(street__icontains=query) | Q(city__icontains=query)
+        ).values_list('pk', flat=True)[:20])
+
+    def fts(query):
+        return list(HierarchicalLocation.objects.search(query).values_list('pk', flat=True)[:20])
+
+    print(f"\n{'query':<16} {'icontains ms':>13} {'FTS5 ms':>9} {'rows':>5}")
+    for query in QUERIES:
+        scan_time, _ = timed(icontains, query, repeat=5)
+        fts_time, rows = timed(fts, query, repeat=5)
+        print(f'{query:<16} {scan_time * 1000:>13.2f} {fts_time * 1000:>9.2f} {len(rows):>5}')
+
+
+if __name__ == '__main__':
+    main()
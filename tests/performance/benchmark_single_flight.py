@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Benchmark: concurrent identical requests right after a data version bump
+Warms an endpoint, bumps the domain's DataVersion and lets N threads request
+it at the same moment, once with every request rebuilding on its own (the
+previous behaviour) and once with single_flight and stale-while-revalidate
+(see maps.snapshots). Reports wall time, latencies and the X-Cache outcomes.
+
+Usage:
+    python tests/performance/benchmark_single_flight.py [--locations 100000] [--threads 16]
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from bench_utils import benchmark_db, seed_locations, setup_django
+
+ENDPOINTS = [
+    ('locations', '/api/hierarchical/locations/', {'domain': 'bench'}),
+    ('categories', '/api/hierarchical/categories/', {'domain': 'bench'}),
+    ('domains', '/api/hierarchical/domains/', {}),
+]
+
+
+@contextmanager
+def without_single_flight():
+    """Every miss builds on its own and nothing is served stale"""
+    from maps import snapshots
+
+    single_flight, building = snapshots.single_flight, snapshots.building
+    snapshots.single_flight = lambda key, build: (build(), True)
+    snapshots.building = lambda key: False
+    try:
+        yield
+    finally:
+        snapshots.single_flight, snapshots.building = single_flight, building
+
+
+def burst(url, params, threads):
+    from django.db import connections
+    from django.test import Client
+
+    barrier = threading.Barrier(threads)
+    latencies, outcomes = [], Counter()
+
+    def request():
+        client = Client(SERVER_NAME='localhost')
+        try:
+            barrier.wait()
+            start = time.perf_counter()
+            response = client.get(url, params)
+            latencies.append(time.perf_counter() - start)
+            outcomes[response.get('X-Cache', 'MISS')] += 1
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=request) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started, sorted(latencies), outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'single_flight_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    seed_locations(args.locations)
+
+    from django.test import Client
+    from maps.hierarchical_models import DataVersion
+
+    client = Client(SERVER_NAME='localhost')
+    print(f"\n{'endpoint':<12} {'mode':<14} {'wall ms':>9} {'p50 ms':>9} {'max ms':>9}  X-Cache")
+    for name, url, params in ENDPOINTS:
+        for mode in ('per request', 'single flight'):
+            client.get(url, params)
+            DataVersion.bump(params.get('domain', DataVersion.ALL_DOMAINS))
+            if mode == 'per request':
+                with without_single_flight():
+                    wall, latencies, outcomes = burst(url, params, args.threads)
+            else:
+                wall, latencies, outcomes = burst(url, params, args.threads)
+            summary = ' '.join(f'{outcome}={count}' for outcome, count in sorted(outcomes.items()))
+            print(f'{name:<12} {mode:<14} {wall * 1000:>9.1f} {statistics.median(latencies) * 1000:>9.1f} '
+                  f'{latencies[-1] * 1000:>9.1f}  {summary}')
+
+
+if __name__ == '__main__':
+    main()
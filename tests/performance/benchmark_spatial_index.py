@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Benchmark: bbox queries via the (latitude, longitude) B-tree vs. the R*Tree
+Times fetching the ids of all locations in city, region and country sized
+viewports, once with plain column filters and once with objects.in_bbox().
+
+Usage:
+    python tests/performance/benchmark_spatial_index.py [--locations 1000000]
+"""
+
+import argparse
+import random
+
+from bench_utils import LAT_RANGE, LNG_RANGE, benchmark_db, seed_locations, setup_django, timed
+
+# (name, width in degrees, height in degrees)
+VIEWPORTS = [
+    ('city', 0.2, 0.1),
+    ('region', 2.0, 1.5),
+    ('country', LNG_RANGE[1] - LNG_RANGE[0], LAT_RANGE[1] - LAT_RANGE[0]),
+]
+
+
+def random_bboxes(width, height, count, rng):
+    bboxes = []
+    for _ in range(count):
+        min_lng = rng.uniform(LNG_RANGE[0], LNG_RANGE[1] - width)
+        min_lat = rng.uniform(LAT_RANGE[0], LAT_RANGE[1] - height)
+        bboxes.append((min_lng, min_lat, min_lng + width, min_lat + height))
+    return bboxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=20, help='Random viewports per size')
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'spatial_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    connection = setup_django(db_path)
+    seed_locations(args.locations)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    from maps.hierarchical_models import HierarchicalLocation
+    from maps.spatial import bbox_query
+
+    def btree(bboxes):
+        return sum(
+            len(list(HierarchicalLocation.objects.filter(bbox_query(bbox)).values_list('pk', flat=True)))
+            for bbox in bboxes
+        )
+
+    def rtree(bboxes):
+        return sum(
+            len(list(HierarchicalLocation.objects.in_bbox(bbox).values_list('pk', flat=True)))
+            for bbox in bboxes
+        )
+
+    rng = random.Random(7)
+    print(f"\n{'viewport':<10} {'rows/query':>11} {'B-tree ms':>10} {'R*Tree ms':>10} {'speed-up':>9}")
+    for name, width, height in VIEWPORTS:
+        bboxes = random_bboxes(width, height, args.queries, rng)
+        btree_time, btree_rows = timed(btree, bboxes, repeat=3)
+        rtree_time, rtree_rows = timed(rtree, bboxes, repeat=3)
+        assert btree_rows == rtree_rows, (btree_rows, rtree_rows)
+
+        per_query = 1000 / len(bboxes)
+        print(f'{name:<10} {btree_rows // len(bboxes):>11} {btree_time * per_query:>10.2f} '
+              f'{rtree_time * per_query:>10.2f} {btree_time / rtree_time:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
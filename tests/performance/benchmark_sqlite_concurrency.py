@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Benchmark: map reads while an import is writing, default vs. tuned SQLite profile
+Reader threads request city sized viewports from the cluster API (individual
+locations, no snapshot cache) while a writer thread imports locations in
+batched transactions. Runs once with SQLite's defaults (rollback journal,
+reads on ``default``) and once with SQLITE_PRAGMAS and the read-only alias.
+
+Usage:
+    python tests/performance/benchmark_sqlite_concurrency.py [--locations 100000]
+"""
+
+import argparse
+import random
+import statistics
+import threading
+import time
+
+from bench_utils import LAT_RANGE, LNG_RANGE, benchmark_db, seed_locations, setup_django
+
+DEFAULT_PROFILE = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+def city_bboxes(count, rng):
+    bboxes = []
+    for _ in range(count):
+        min_lng = rng.uniform(LNG_RANGE[0], LNG_RANGE[1] - 0.2)
+        min_lat = rng.uniform(LAT_RANGE[0], LAT_RANGE[1] - 0.1)
+        bboxes.append(f'{min_lng:.4f},{min_lat:.4f},{min_lng + 0.2:.4f},{min_lat + 0.1:.4f}')
+    return bboxes
+
+
+def import_batches(domain, stop, batch_size, counter):
+    """Writer: create locations with one category each, one transaction per batch"""
+    from django.db import connections, transaction
+    from maps.hierarchical_models import HierarchicalLocation
+    from maps.signals import batch_version_bumps
+
+    category = domain.categories.order_by('pk').first()
+    rng = random.Random(1)
+    try:
+        while not stop.is_set():
+            with batch_version_bumps(), transaction.atomic():
+                for _ in range(batch_size):
+                    counter[0] += 1
+                    location = HierarchicalLocation.objects.create(
+                        location_id=f'import-{counter[0]}',
+                        name=f'Import {counter[0]}',
+                        latitude=round(rng.uniform(*LAT_RANGE), 7),
+                        longitude=round(rng.uniform(*LNG_RANGE), 7),
+                        city='Berlin',
+                    )
+                    location.categories.add(category)
+    finally:
+        connections.close_all()
+
+
+def read_viewports(bboxes, latencies, errors):
+    """Reader: one cluster API request per bbox"""
+    from django.db import connections
+    from django.test import Client
+
+    client = Client(SERVER_NAME='localhost')
+    try:
+        for bbox in bboxes:
+            start = time.perf_counter()
+            response = client.get('/api/hierarchical/clusters/', {'domain': 'bench', 'z': 15, 'bbox': bbox})
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(response.status_code)
+    finally:
+        connections.close_all()
+
+
+def run(profile, read_alias, domain, args):
+    from django.conf import settings
+    from django.db import connections
+
+    connections.close_all()
+    settings.SQLITE_PRAGMAS = profile
+    settings.MAPS_READ_DATABASE = read_alias
+    # journal_mode is stored in the file: switch it before the run
+    with connections['default'].cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    connections.close_all()
+
+    rng = random.Random(3)
+    stop = threading.Event()
+    imported = [0]
+    latencies, errors = [], []
+    writer = threading.Thread(target=import_batches, args=(domain, stop, args.batch, imported))
+    readers = [
+        threading.Thread(target=read_viewports, args=(city_bboxes(args.requests, rng), latencies, errors))
+        for _ in range(args.readers)
+    ]
+
+    start_count = imported[0]
+    started = time.perf_counter()
+    writer.start()
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    stop.set()
+    writer.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies) * 1000 if latencies else float('nan'),
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else float('nan'),
+        'max': latencies[-1] * 1000 if latencies else float('nan'),
+        'errors': len(errors),
+        'imported/s': (imported[0] - start_count) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per reader thread')
+    parser.add_argument('--batch', type=int, default=500, help='Locations per import transaction')
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'concurrency_{args.locations}', args.db)
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    domain = seed_locations(args.locations)
+
+    from django.conf import settings
+
+    tuned = dict(settings.SQLITE_PRAGMAS)
+    print(f"\n{'profile':<10} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'errors':>7} {'imported/s':>11}")
+    for name, profile, read_alias in [
+        ('default', DEFAULT_PROFILE, None),
+        ('tuned', tuned, settings.MAPS_READ_DATABASE),
+    ]:
+        result = run(profile, read_alias, domain, args)
+        print(f"{name:<10} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['max']:>8.1f} "
+              f"{result['errors']:>7} {result['imported/s']:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
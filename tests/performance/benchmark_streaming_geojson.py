@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Benchmark: buffered vs. streaming GeoJSON from HierarchicalLocationsAPI
+Reports peak RSS, time-to-first-byte and total time for each mode.
+Each mode runs in its own process so peak RSS is not shared.
+
+Usage:
+    python tests/performance/benchmark_streaming_geojson.py [--locations 100000]
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from bench_utils import benchmark_db, seed_locations, setup_django
+
+MODES = ['buffered', 'stream']
+
+
+def run_mode(mode, db_path):
+    """Run one request in this process and print the measurements as JSON"""
+    setup_django(db_path)
+
+    from django.test import RequestFactory
+    from maps.hierarchical_views_new import HierarchicalLocationsAPI
+
+    params = {'domain': 'bench'}
+    if mode == 'stream':
+        params['stream'] = '1'
+    request = RequestFactory().get('/api/hierarchical/locations/', params)
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    response = HierarchicalLocationsAPI.as_view()(request)
+
+    size = 0
+    first_byte = None
+    first_feature = None
+    chunks = response.streaming_content if response.streaming else [response.content]
+    for chunk in chunks:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        if first_feature is None and b'"Feature"' in chunk:
+            first_feature = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+
+    print(json.dumps({
+        'mode': mode,
+        'ttfb_ms': round(first_byte * 1000, 1),
+        'first_feature_ms': round((first_feature or first_byte) * 1000, 1),
+        'total_ms': round(total * 1000, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'rss_growth_mb': round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024, 1),
+        'bytes': size,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--locations', type=int, default=100000)
+    parser.add_argument('--db', help='SQLite file to use and keep (default: a temporary file, deleted afterwards)')
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    db_path = benchmark_db(f'geojson_{args.locations}', args.db)
+
+    if args.child:
+        run_mode(args.child, db_path)
+        return
+
+    print(f'Seeding {args.locations} locations into {db_path} ...')
+    setup_django(db_path)
+    seed_locations(args.locations)
+
+    print(f"\n{'mode':<10} {'TTFB ms':>10} {'1st feature':>12} {'total ms':>10} {'peak RSS MB':>12} {'RSS growth MB':>14} {'bytes':>12}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', mode, '--db', db_path, '--locations', str(args.locations)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['mode']:<10} {result['ttfb_ms']:>10} {result['first_feature_ms']:>12} {result['total_ms']:>10} "
+              f"{result['peak_rss_mb']:>12} {result['rss_growth_mb']:>14} {result['bytes']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -91,6 +91,9 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# Disk cache for Mapbox Vector Tiles (only /tmp is writable on Vercel)
+VECTOR_TILE_CACHE_DIR = Path('/tmp') / 'tiles'
+
 # CORS settings for embedding
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -106,6 +109,8 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
+    # ?format= selects the payload layout (format=columnar), not a renderer
+    'URL_FORMAT_OVERRIDE': None,
 }
 
 # Default primary key field type